@@ -0,0 +1,827 @@
+import functools
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from dataset_cache import read_cached_frame, write_frame
+from sketches import APPROXIMATE, CUSTOMER_SKETCH, HLL_PRECISION, hll_entries, hll_estimate, top_counters
+from trends import TREND_MAX_POINTS, day_number, day_numbers, range_start_day, sales_trend
+
+# Pre-aggregated view of the sales data for the dashboard.
+#
+# The order rows are rolled up once into cells keyed on
+# (order_date, region, category, product, rating). Every KPI and chart the
+# dashboard shows is a sum over cells, so a filter change only has to scan
+# the cells, not the orders.
+#
+# Revenue is summed in integer cents, so a total does not depend on how the
+# rows were grouped and always equals the row-level sum rounded to the cent.
+#
+# Revenue and row counts are also kept per day and (region, category) as
+# prefix sums over the days, so the revenue of any date range is one
+# subtraction per (region, category) and the trend chart reads its daily
+# series without touching the cells.
+#
+# In approximate mode (see sketches.py) the cube also answers distinct
+# customers and the top products from sketches per (month, region,
+# category) bucket. Months the date range covers entirely are read from
+# those; the days of the months at either end from sketches per day
+# (customers) or from the cells themselves (products).
+#
+# With live refresh, the rows appended to the source are not merged into
+# the cube of the initial load: every batch becomes a cube of its own, and a
+# LiveCube answers the dashboard from all of them (see LiveCube).
+
+CUBE_KEYS = ['order_date', 'customer_region', 'category', 'product_name', 'customer_rating']
+# order_cents is the revenue of the rows that have an order_id, which the
+# average order value divides by the distinct orders
+SUM_COLUMNS = ['revenue_cents', 'order_cents', 'rows', 'orders']
+CELL_COLUMNS = CUBE_KEYS + SUM_COLUMNS
+
+# Keys of the buckets the customer sketch is kept for: a prefix of CUBE_KEYS,
+# so the cells of a bucket are next to each other
+SKETCH_KEYS = CUBE_KEYS[:3]
+
+# Arrays a SalesCube derives from its cells on first use, which save()
+# writes out so load() can map them instead of deriving them again
+DERIVED = ('_daily', '_buckets', '_customer_sketch', '_product_sketch')
+
+# Changes whenever the layout save() writes does, so older saved cubes are built again
+SAVE_FORMAT = 2
+
+
+def to_cents(amounts):
+    """Dollar amounts as int64 cents."""
+    return np.round(amounts.to_numpy(dtype='float64') * 100).astype(np.int64)
+
+
+def from_cents(cents):
+    """Int cents back to dollar amounts."""
+    return cents / 100
+
+
+class CubeBuilder:
+    """Accumulates cube cells from one or more chunks of cleaned rows.
+
+    repeated flags the rows whose order_id occurs more than once in the
+    whole dataset (not just in the chunk). Those orders are tracked per cell
+    so they are counted once; every other row is an order on its own.
+    With customer_sketch, the HyperLogLog registers of the customers are
+    kept per (day, region, category) as well.
+    """
+
+    # Merge the partial cells once this many have piled up
+    MERGE_EVERY = 1_000_000
+
+    def __init__(self, customer_sketch=CUSTOMER_SKETCH):
+        self._partials = []
+        self._pending = 0
+        self._repeated_pairs = []
+        self.customer_sketch = customer_sketch
+        self._registers = []
+
+    def add(self, chunk, repeated):
+        rows = chunk[CUBE_KEYS].copy()
+        has_id = chunk['order_id'].notna().to_numpy()
+        rows['revenue_cents'] = to_cents(chunk['total_amount'])
+        rows['order_cents'] = np.where(has_id, rows['revenue_cents'].to_numpy(), 0)
+        rows['orders'] = (~repeated & has_id).astype(np.int64)
+        partial = rows.groupby(CUBE_KEYS, observed=True, dropna=False, sort=False).agg(
+            revenue_cents=('revenue_cents', 'sum'),
+            order_cents=('order_cents', 'sum'),
+            rows=('revenue_cents', 'size'),
+            orders=('orders', 'sum')).reset_index()
+        self._partials.append(partial)
+        self._pending += len(partial)
+
+        pairs = chunk.loc[repeated, CUBE_KEYS + ['order_id']].dropna(subset=['order_id'])
+        self._repeated_pairs.append(pairs.drop_duplicates())
+
+        if self._pending > self.MERGE_EVERY and len(self._partials) > 1:
+            self._partials = [self._merge(self._partials)]
+            self._pending = len(self._partials[0])
+
+        if self.customer_sketch:
+            self._registers.append(customer_registers(chunk))
+            if sum(map(len, self._registers)) > self.MERGE_EVERY and len(self._registers) > 1:
+                self._registers = [merge_registers(self._registers)]
+
+    @staticmethod
+    def _merge(partials):
+        partials = [partial for partial in partials if len(partial)]
+        if not partials:
+            return pd.DataFrame(columns=CELL_COLUMNS)
+        cells = pd.concat(partials, ignore_index=True)
+        for column in CUBE_KEYS:
+            if cells[column].dtype == object:
+                cells[column] = cells[column].astype('category')
+        return cells.groupby(CUBE_KEYS, observed=True, dropna=False, sort=False).sum().reset_index()
+
+    def _cells(self):
+        return self._merge(self._partials)
+
+    def _pairs(self):
+        """Distinct (cell keys, order_id) of the repeated orders added so far."""
+        return _concat_pairs(self._repeated_pairs).drop_duplicates()
+
+    def _customer_registers(self):
+        return merge_registers(self._registers) if self.customer_sketch else None
+
+    def build(self):
+        cells = self._cells()
+
+        # Each repeated order counts once in every cell it appears in ...
+        pairs = self._pairs()
+        cells = self._merge([cells, pair_orders(pairs)])
+
+        # ... and the ones spanning several cells are kept for the correction
+        return SalesCube(cells, shared_pairs(pairs), self._customer_registers())
+
+
+def _concat_pairs(frames):
+    frames = [frame for frame in frames if len(frame)]
+    if not frames:
+        return pd.DataFrame(columns=CUBE_KEYS + ['order_id'])
+    return pd.concat(frames, ignore_index=True)
+
+
+def pair_orders(pairs):
+    """Partial cells adding one order per (cell keys, order_id) pair."""
+    orders = pairs.groupby(CUBE_KEYS, observed=True, dropna=False, sort=False).size()
+    orders = orders.rename('orders').reset_index()
+    orders['revenue_cents'] = 0
+    orders['order_cents'] = 0
+    orders['rows'] = 0
+    return orders[CELL_COLUMNS]
+
+
+def shared_pairs(pairs):
+    """The pairs of the orders that appear in more than one cell."""
+    return pairs[pairs['order_id'].duplicated(keep=False)]
+
+
+def customer_registers(rows):
+    """HyperLogLog registers of the customers of rows per (day, region, category), as sparse rows."""
+    known = rows['customer_id'].notna().to_numpy()
+    ids = rows.loc[known, 'customer_id']
+    entries = rows.loc[known, SKETCH_KEYS].reset_index(drop=True)
+    entries['register'], entries['rank'] = hll_entries(
+        ids.to_numpy(dtype=np.int64) if pd.api.types.is_numeric_dtype(ids) else ids.to_numpy())
+    return merge_registers([entries])
+
+
+def merge_registers(frames):
+    """Combine sparse register rows, keeping the highest rank per bucket and register."""
+    frames = [frame for frame in frames if frame is not None and len(frame)]
+    if not frames:
+        return pd.DataFrame({column: pd.Series(dtype=dtype) for column, dtype in
+                             [(key, object) for key in SKETCH_KEYS] + [('register', np.int32), ('rank', np.uint8)]})
+    entries = pd.concat(frames, ignore_index=True)
+    for column in SKETCH_KEYS:
+        if entries[column].dtype == object:
+            entries[column] = entries[column].astype('category')
+    return entries.groupby(SKETCH_KEYS + ['register'], observed=True, dropna=False, sort=False)['rank'].max().reset_index()
+
+
+def _as_key_dtypes(frame, cells, columns=CUBE_KEYS):
+    frame = frame.copy()
+    for column in columns:
+        frame[column] = frame[column].astype(cells[column].dtype)
+    return frame
+
+
+def _codes(values):
+    """(codes, uniques) of values, with uniques in sorted order and -1 for missing values."""
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        return values.cat.codes.to_numpy(), values.cat.categories
+    return pd.factorize(values, sort=True)
+
+
+def _plain_keys(frame):
+    frame = frame.copy()
+    for column in CUBE_KEYS:
+        if isinstance(frame[column].dtype, pd.CategoricalDtype):
+            frame[column] = frame[column].astype(object)
+    return frame
+
+
+def _value_codes(cells):
+    """(code of every cell, code of every value) per filter column."""
+    value_codes = {}
+    for column in ('customer_region', 'category'):
+        codes, uniques = _codes(cells[column])
+        value_codes[column] = (codes, {value: code for code, value in enumerate(uniques)})
+    return value_codes
+
+
+class SalesCube:
+    """Revenue, row and order counts per (day, region, category, product, rating)."""
+
+    def __init__(self, cells, shared_pairs, customer_registers=None):
+        cells = cells.sort_values(CUBE_KEYS, ignore_index=True)
+        for column in SUM_COLUMNS:
+            cells[column] = cells[column].astype(np.int64)
+        cells['month_year'] = cells['order_date'].dt.to_period('M')
+        self.cells = cells
+        self._dates = cells['order_date'].to_numpy()
+        self._rows = cells['rows'].to_numpy()
+
+        # Code of every cell per filter column, so a value filter is a table lookup
+        self._value_codes = _value_codes(cells)
+
+        # An order_id can span several cells (one order with several
+        # products, or a reused id). Keep those pairs so the distinct order
+        # count of a selection can be corrected for double counting.
+        self.shared_pairs = _as_key_dtypes(shared_pairs, cells)
+        positions = cells[CUBE_KEYS].reset_index().rename(columns={'index': 'cell'})
+        shared = self.shared_pairs.merge(positions, on=CUBE_KEYS)
+        self._shared_order_ids = shared['order_id'].to_numpy()
+        self._shared_order_codes = pd.factorize(shared['order_id'])[0]
+        self._shared_order_cells = shared['cell'].to_numpy()
+
+        self.customer_registers = None
+        if customer_registers is not None:
+            self.customer_registers = _as_key_dtypes(customer_registers, cells, SKETCH_KEYS)
+
+    def save(self, directory):
+        """Write the cells, pairs, registers and derived arrays to a new directory, for load() to map."""
+        os.makedirs(directory)
+        write_frame(self.cells, os.path.join(directory, 'cells'))
+        write_frame(self.shared_pairs.reset_index(drop=True), os.path.join(directory, 'pairs'))
+        if self.customer_registers is not None:
+            write_frame(self.customer_registers, os.path.join(directory, 'registers'))
+        arrays = {'shared_order_ids': self._shared_order_ids, 'shared_order_codes': self._shared_order_codes,
+                  'shared_order_cells': self._shared_order_cells}
+        derived = {}
+        for name in DERIVED:
+            if name != '_daily' and self.customer_registers is None:
+                continue  # only approximate and clientside mode use the sketches
+            values = getattr(self, name)
+            derived[name] = None if values is None else len(values)
+            for position, value in enumerate(values or ()):
+                arrays[f"{name}-{position}"] = value
+        for name, value in arrays.items():
+            np.save(os.path.join(directory, f"{name}.npy"), np.asarray(value))
+        with open(os.path.join(directory, 'cube.json'), 'w') as f:
+            json.dump({'derived': derived}, f)
+
+    @classmethod
+    def load(cls, directory):
+        """Cube saved by save(), its cells and arrays read-only memory maps rather than copies."""
+        with open(os.path.join(directory, 'cube.json')) as f:
+            meta = json.load(f)
+
+        def array(name):
+            value = np.load(os.path.join(directory, f"{name}.npy"), mmap_mode='r')
+            return value.item() if value.ndim == 0 else value
+
+        cube = cls.__new__(cls)
+        cube.cells = read_cached_frame(os.path.join(directory, 'cells'))
+        cube._dates = cube.cells['order_date'].to_numpy()
+        cube._rows = cube.cells['rows'].to_numpy()
+        cube._value_codes = _value_codes(cube.cells)
+        cube.shared_pairs = read_cached_frame(os.path.join(directory, 'pairs'))
+        cube._shared_order_ids = array('shared_order_ids')
+        cube._shared_order_codes = array('shared_order_codes')
+        cube._shared_order_cells = array('shared_order_cells')
+        registers_dir = os.path.join(directory, 'registers')
+        cube.customer_registers = read_cached_frame(registers_dir) if os.path.isdir(registers_dir) else None
+        for name, size in meta['derived'].items():
+            # Set on the instance, where functools.cached_property looks first
+            setattr(cube, name, None if size is None else tuple(array(f"{name}-{i}") for i in range(size)))
+        return cube
+
+    @classmethod
+    def from_frame(cls, df):
+        """Build the cube from a fully loaded frame."""
+        builder = CubeBuilder()
+        builder.add(df, df['order_id'].duplicated(keep=False).to_numpy())
+        return builder.build()
+
+    def __len__(self):
+        return len(self.cells)
+
+    def compacted(self):
+        """The cube as one SalesCube (see LiveCube.compacted); this one already is."""
+        return self
+
+    def _value_mask(self, column, selected):
+        codes, code_of = self._value_codes[column]
+        allowed = np.zeros(len(code_of) + 1, dtype=bool)  # the last slot is for missing values (-1)
+        for value in selected:
+            if value in code_of:
+                allowed[code_of[value]] = True
+        return allowed[codes]
+
+    def mask(self, start_date=None, end_date=None, regions=None, categories=None):
+        """Boolean mask of the cells matching the dashboard filters, with the same rules as the raw path."""
+        lo, hi = 0, len(self.cells)
+        if start_date and end_date:
+            lo = np.searchsorted(self._dates, pd.Timestamp(start_date).to_datetime64(), side='left')
+            hi = np.searchsorted(self._dates, pd.Timestamp(end_date).to_datetime64(), side='right')
+
+        mask = np.zeros(len(self.cells), dtype=bool)
+        mask[lo:hi] = True
+        if regions and len(regions) > 0:
+            mask &= self._value_mask('customer_region', regions)
+        if categories and len(categories) > 0:
+            mask &= self._value_mask('category', categories)
+        return mask
+
+    def select(self, start_date=None, end_date=None, regions=None, categories=None):
+        """Cells matching the dashboard filters."""
+        filters = (start_date, end_date, regions, categories)
+        return CubeSlice(self, self.mask(*filters), filters)
+
+    def count(self, start_date=None, end_date=None, regions=None, categories=None):
+        """Number of order rows matching the filters, without touching any rows."""
+        return int(self._rows[self.mask(start_date, end_date, regions, categories)].sum())
+
+    def filter_values(self):
+        """Regions, categories and (first, last) order date, for the filter controls."""
+        cells = self.cells
+        return (sorted(cells['customer_region'].unique()), sorted(cells['category'].unique()),
+                (cells['order_date'].min(), cells['order_date'].max()))
+
+    @functools.cached_property
+    def _daily(self):
+        """(first day number, revenue cents prefix, rows prefix, undated cents) per (region, category).
+
+        Row i of a prefix array is the total of the days before first + i, one
+        column per (region, category) pair. None if some order dates have a
+        time of day, since a date range then cuts through days.
+        """
+        dates = self._dates
+        dated = ~np.isnat(dates)
+        days = day_numbers(dates[dated])
+        if (dates[dated] != days.astype('datetime64[D]')).any():
+            return None
+
+        (region_codes, regions), (category_codes, categories) = (
+            self._value_codes['customer_region'], self._value_codes['category'])
+        # Slot 0 of either code is for missing values
+        pairs = (region_codes + 1) * (len(categories) + 1) + category_codes + 1
+        n_pairs = (len(regions) + 1) * (len(categories) + 1)
+        first = int(days[0]) if len(days) else 0
+        n_days = int(days[-1]) - first + 1 if len(days) else 0
+
+        index = (days - first) * n_pairs + pairs[dated]
+        prefixes = []
+        for values in (self.cells['revenue_cents'].to_numpy(), self._rows):
+            per_day = np.bincount(index, weights=values[dated], minlength=n_days * n_pairs)
+            prefix = np.zeros((n_days + 1, n_pairs), dtype=np.int64)
+            np.cumsum(np.round(per_day).astype(np.int64).reshape(n_days, n_pairs), axis=0, out=prefix[1:])
+            prefixes.append(prefix)
+        revenue = self.cells['revenue_cents'].to_numpy()
+        undated = np.round(np.bincount(pairs[~dated], weights=revenue[~dated], minlength=n_pairs)).astype(np.int64)
+        return first, prefixes[0], prefixes[1], undated
+
+    def _pair_mask(self, regions, categories):
+        """Which (region, category) columns of the prefix arrays the filters select."""
+        allowed = []
+        for column, selected in (('customer_region', regions), ('category', categories)):
+            _, code_of = self._value_codes[column]
+            if selected and len(selected) > 0:
+                mask = np.zeros(len(code_of) + 1, dtype=bool)
+                mask[[code_of[value] + 1 for value in selected if value in code_of]] = True
+            else:
+                mask = np.ones(len(code_of) + 1, dtype=bool)
+            allowed.append(mask)
+        return np.outer(*allowed).ravel()
+
+    def _day_range(self, start_date, end_date):
+        """Rows (lo, hi) of the prefix arrays bounding the date range."""
+        first, prefix, _, _ = self._daily
+        n_days = len(prefix) - 1
+        if not (start_date and end_date):
+            return 0, n_days
+        lo = day_number(pd.Timestamp(start_date).ceil('D')) - first
+        hi = day_number(pd.Timestamp(end_date).floor('D')) - first + 1
+        lo, hi = min(max(lo, 0), n_days), min(max(hi, 0), n_days)
+        return lo, max(lo, hi)
+
+    def revenue_cents(self, start_date=None, end_date=None, regions=None, categories=None):
+        """Revenue of the rows matching the filters, in cents, from the prefix sums."""
+        _, prefix, _, undated = self._daily
+        lo, hi = self._day_range(start_date, end_date)
+        pairs = self._pair_mask(regions, categories)
+        total = int((prefix[hi, pairs] - prefix[lo, pairs]).sum())
+        if not (start_date and end_date):
+            total += int(undated[pairs].sum())
+        return total
+
+    def daily_revenue(self, start_date=None, end_date=None, regions=None, categories=None):
+        """(day numbers, revenue cents, rows) of every day in the date range."""
+        first, prefix_cents, prefix_rows, _ = self._daily
+        lo, hi = self._day_range(start_date, end_date)
+        pairs = self._pair_mask(regions, categories)
+        cents = np.diff(prefix_cents[lo:hi + 1][:, pairs].sum(axis=1))
+        rows = np.diff(prefix_rows[lo:hi + 1][:, pairs].sum(axis=1))
+        return np.arange(first + lo, first + hi), cents, rows
+
+    def order_cents(self, mask):
+        """Revenue of the rows with an order_id across the selected cells, in cents."""
+        return int(self.cells['order_cents'].to_numpy()[mask].sum())
+
+    def distinct_orders(self, mask):
+        """Number of distinct order_ids across the selected cells."""
+        total = int(self.cells['orders'].to_numpy()[mask].sum())
+        if len(self._shared_order_cells):
+            selected = mask[self._shared_order_cells].astype(np.int64)
+            per_order = np.bincount(self._shared_order_codes, weights=selected)
+            total -= int(np.maximum(per_order - 1, 0).sum())
+        return total
+
+    def shared_orders(self, mask):
+        """order_id of every (cell, order) pair of the orders spanning cells, for the selected cells."""
+        return self._shared_order_ids[mask[self._shared_order_cells]]
+
+    @functools.cached_property
+    def _buckets(self):
+        """Sketch bucket of every cell: (day, region, category) and (month, region, category)."""
+        by = dict(observed=True, dropna=False, sort=False)
+        day = self.cells.groupby(SKETCH_KEYS, **by).ngroup().to_numpy()
+        month = self.cells.groupby(['month_year', 'customer_region', 'category'], **by).ngroup().to_numpy()
+        return day, month, np.bincount(month)
+
+    def _sketch_selection(self, mask):
+        """Month buckets whose cells are all selected, and the selected cells of the other months."""
+        _, month, month_sizes = self._buckets
+        selected = np.bincount(month[mask], minlength=len(month_sizes))
+        full = selected == month_sizes
+        return full, mask & ~full[month]
+
+    @functools.cached_property
+    def _customer_sketch(self):
+        """Day bucket, register and rank of the sparse registers, and dense registers per month bucket."""
+        if self.customer_registers is None:
+            raise ValueError("This cube was built without the customer sketch "
+                             "(SWIFTSHOP_APPROXIMATE or SWIFTSHOP_CLIENTSIDE)")
+        day, month, month_sizes = self._buckets
+        first = np.flatnonzero(np.r_[True, day[1:] != day[:-1]])
+        keys = self.cells[SKETCH_KEYS].iloc[first].reset_index(drop=True)
+        keys['bucket'] = day[first]
+        entries = self.customer_registers.merge(keys, on=SKETCH_KEYS)
+        bucket = entries['bucket'].to_numpy()
+        register = entries['register'].to_numpy()
+        rank = entries['rank'].to_numpy()
+
+        dense = np.zeros((len(month_sizes), 2 ** HLL_PRECISION), dtype=np.uint8)
+        np.maximum.at(dense, (month[first][bucket], register), rank)
+        return bucket, register, rank, dense
+
+    def selected_registers(self, mask):
+        """Dense HyperLogLog registers of the customers across the selected cells."""
+        bucket, register, rank, dense = self._customer_sketch
+        day, _, _ = self._buckets
+        full, partial_cells = self._sketch_selection(mask)
+        registers = dense[full].max(axis=0, initial=0)
+        partial = np.zeros(day[-1] + 1 if len(day) else 0, dtype=bool)
+        partial[day[partial_cells]] = True
+        selected = partial[bucket]
+        np.maximum.at(registers, register[selected], rank[selected])
+        return registers
+
+    def distinct_customers(self, mask):
+        """Estimated number of distinct customers across the selected cells."""
+        return hll_estimate(self.selected_registers(mask))
+
+    @functools.cached_property
+    def _product_sketch(self):
+        """Top counters of product revenue per month bucket, with their floors."""
+        _, month, month_sizes = self._buckets
+        codes, names = _codes(self.cells['product_name'])
+        known = codes >= 0
+        revenue = pd.DataFrame({'bucket': month[known], 'item': codes[known],
+                                'cents': self.cells['revenue_cents'].to_numpy()[known]})
+        revenue = revenue.groupby(['bucket', 'item'], sort=False)['cents'].sum().reset_index()
+        bucket, item, cents = (revenue[column].to_numpy() for column in ('bucket', 'item', 'cents'))
+        kept, floors = top_counters(bucket, item, cents, n_buckets=len(month_sizes))
+        return bucket[kept], item[kept], cents[kept], floors
+
+    def product_counters(self, mask):
+        """(names, revenue, missed, floor) of the products the top counters hold for the selected cells.
+
+        revenue and missed are in cents, per name; floor is the most revenue
+        the counters may have missed for a product that is not in names.
+        """
+        bucket, item, cents, floors = self._product_sketch
+        codes, names = _codes(self.cells['product_name'])
+        full, partial_cells = self._sketch_selection(mask)
+        partial_cells &= codes >= 0
+        counted = full[bucket]
+        items, partial_items = item[counted], codes[partial_cells]
+
+        revenue = (np.bincount(items, weights=cents[counted], minlength=len(names))
+                   + np.bincount(partial_items, weights=self.cells['revenue_cents'].to_numpy()[partial_cells],
+                                 minlength=len(names)))
+        missed = floors[full].sum() - np.bincount(items, weights=floors[bucket[counted]], minlength=len(names))
+        candidates = np.flatnonzero(np.bincount(items, minlength=len(names))
+                                    + np.bincount(partial_items, minlength=len(names)))
+        return (np.asarray(names[candidates], dtype=object), revenue[candidates], missed[candidates],
+                floors[full].sum())
+
+    def approximate_top_products(self, mask, n=10):
+        """The n products with the highest revenue from the top counters.
+
+        Besides product_name and total_amount, max_error is how much revenue
+        the counters may have missed for each product; total_amount is never
+        more than its true revenue.
+        """
+        names, revenue, missed, _ = self.product_counters(mask)
+        return _top_products(names, revenue, missed, n)
+
+
+def _top_products(names, revenue, missed, n):
+    """Frame of the n names with the highest revenue (cents), ties going to the first name."""
+    by_name = np.argsort(names, kind='stable')
+    names, revenue, missed = names[by_name], revenue[by_name], missed[by_name]
+    candidates = np.arange(len(names))
+    if len(candidates) > n:
+        # Only the n largest (and any ties with the last of them) need sorting
+        nth = np.partition(revenue, len(candidates) - n)[len(candidates) - n]
+        candidates = candidates[revenue >= nth]
+    top = candidates[np.argsort(-revenue[candidates], kind='stable')][:n]
+    return pd.DataFrame({'product_name': names[top],
+                         'total_amount': from_cents(np.round(revenue[top]).astype(np.int64)),
+                         'max_error': from_cents(np.round(missed[top]).astype(np.int64))})
+
+
+class CubeSlice:
+    """Aggregates over one selection of cube cells."""
+
+    def __init__(self, cube, mask, filters=(None, None, None, None)):
+        self.cube = cube
+        self.mask = mask
+        self.filters = filters
+
+    @functools.cached_property
+    def cells(self):
+        return self.cube.cells[self.mask]
+
+    @property
+    def empty(self):
+        """True if no cell matches; checked on the mask, before any cells are copied."""
+        return not self.mask.any()
+
+    def row_count(self):
+        return int(self.cube._rows[self.mask].sum())
+
+    def _revenue_by(self, column):
+        cents = self.cells.groupby(column, observed=True)['revenue_cents'].sum()
+        return from_cents(cents).rename('total_amount')
+
+    def revenue_cents(self):
+        if self.cube._daily is not None:
+            return self.cube.revenue_cents(*self.filters)
+        return int(self.cells['revenue_cents'].sum())
+
+    def total_revenue(self):
+        return from_cents(self.revenue_cents())
+
+    def order_cents(self):
+        return self.cube.order_cents(self.mask)
+
+    def distinct_orders(self):
+        return self.cube.distinct_orders(self.mask)
+
+    def avg_order_value(self):
+        """Revenue of the rows with an order_id per distinct order; 0 when there are none.
+
+        Rows without an order_id are left out, as a groupby('order_id') does.
+        """
+        orders = self.distinct_orders()
+        return from_cents(self.order_cents()) / orders if orders else 0.0
+
+    def distinct_customers(self):
+        """Estimated number of distinct customers, from the customer sketch."""
+        return self.cube.distinct_customers(self.mask)
+
+    def avg_rating(self):
+        """Mean rating over rated rows (rating > 0), or None if there are none."""
+        rated = self.cells[self.cells['customer_rating'] > 0]
+        if rated.empty:
+            return None
+        rows = rated['rows'].to_numpy()
+        return float((rated['customer_rating'].to_numpy(dtype='float64') * rows).sum() / rows.sum())
+
+    def daily_totals(self):
+        """(sorted day numbers, revenue cents, rows) of the dated cells, for sales_trend()."""
+        if self.cube._daily is not None:
+            return self.cube.daily_revenue(*self.filters)
+        cells = self.cells[self.cells['order_date'].notna()]
+        days = day_numbers(cells['order_date'].to_numpy())
+        return days, cells['revenue_cents'].to_numpy(), cells['rows'].to_numpy()
+
+    def sales_trend(self, granularity='auto', max_points=TREND_MAX_POINTS):
+        """(granularity, frame of period and total_amount) for the trend chart; see trends.py."""
+        return sales_trend(*self.daily_totals(), granularity, max_points, range_start_day(*self.filters[:2]))
+
+    def sales_by_month(self):
+        """Revenue per month as a frame with month_year strings and total_amount."""
+        _, trend = self.sales_trend('month', max_points=None)
+        return trend.rename(columns={'period': 'month_year'})
+
+    def category_revenue(self):
+        """Revenue per category as a frame with category and total_amount."""
+        return self._revenue_by('category').reset_index()
+
+    def rating_counts(self):
+        """Number of rated rows per rating value, sorted by rating."""
+        rated = self.cells[self.cells['customer_rating'] > 0]
+        return rated.groupby('customer_rating')['rows'].sum().sort_index()
+
+    def top_products(self, n=10, approximate=APPROXIMATE):
+        """The n products with the highest revenue, as product_name and total_amount."""
+        if approximate:
+            return self.cube.approximate_top_products(self.mask, n)
+        product_revenue = self._revenue_by('product_name')
+        return product_revenue.sort_values(ascending=False, kind='stable').head(n).reset_index()
+
+
+def _empty_pairs():
+    return _concat_pairs([])
+
+
+def _merge_cubes(first, second):
+    """One cube of the cells of two cubes that do not share any orders (see LiveCube)."""
+    registers = None
+    if first.customer_registers is not None:
+        registers = merge_registers([first.customer_registers, second.customer_registers])
+    cells = CubeBuilder._merge([first.cells[CELL_COLUMNS], second.cells[CELL_COLUMNS]])
+    return SalesCube(cells, _empty_pairs(), registers)
+
+
+def _key_mask(frame, filters):
+    """Which rows of a frame of cube keys match the dashboard filters, with the same rules as SalesCube.mask."""
+    start_date, end_date, regions, categories = filters
+    mask = np.ones(len(frame), dtype=bool)
+    if start_date and end_date:
+        dates = frame['order_date']
+        mask &= ((dates >= pd.Timestamp(start_date)) & (dates <= pd.Timestamp(end_date))).to_numpy()
+    if regions and len(regions) > 0:
+        mask &= frame['customer_region'].isin(regions).to_numpy()
+    if categories and len(categories) > 0:
+        mask &= frame['category'].isin(categories).to_numpy()
+    return mask
+
+
+class LiveCube:
+    """The cube of the initial load and of the rows live refresh appended since.
+
+    parts[0] is the cube of the initial load, which is never rebuilt. Every
+    batch of appended rows becomes a cube of its own, which is merged with
+    the one before it while it has at least half as many cells, so a batch
+    costs time in proportion to its own cells (plus the merges, amortized)
+    and there are only logarithmically many parts to query.
+
+    An order can have rows in several parts. Its (cell keys, order_id)
+    pairs are counted once per cell across all parts, and the pairs of the
+    orders that came to span several cells through appended rows are kept
+    in pairs, one frame per part after the first, for the distinct order
+    count to correct (the initial cube keeps its own in shared_pairs).
+    """
+
+    def __init__(self, parts, pairs):
+        self.parts = parts
+        self.pairs = pairs
+
+    @classmethod
+    def of(cls, cube):
+        """A LiveCube of a SalesCube, to add batches to."""
+        return cls([cube], [])
+
+    def extend(self, chunk, repeated, previous_pairs):
+        """A new LiveCube with the rows of chunk added.
+
+        repeated flags the rows of chunk whose order_id occurs more than once
+        in all the data so far, chunk included. previous_pairs holds the
+        (cell keys, order_id) of the rows added before whose order_id appears
+        again in chunk.
+        """
+        builder = CubeBuilder(customer_sketch=self.parts[0].customer_registers is not None)
+        builder.add(chunk, repeated)
+
+        # Compare plain values: either side may have categories the other lacks
+        new_pairs = _plain_keys(builder._pairs())
+        previous_pairs = _plain_keys(previous_pairs[CUBE_KEYS + ['order_id']].drop_duplicates())
+        fresh = new_pairs
+        if len(previous_pairs):
+            # Pairs already counted in an earlier part must not add another order
+            fresh = new_pairs.merge(previous_pairs, how='left', indicator=True)
+            fresh = fresh[fresh['_merge'] == 'left_only'].drop(columns='_merge')
+        cells = CubeBuilder._merge([builder._cells(), pair_orders(fresh)])
+
+        # Orders spanning several cells for the first time bring all their
+        # pairs; orders that did before only the ones they gained
+        all_pairs = _concat_pairs([previous_pairs, fresh])
+        n_all = all_pairs.groupby('order_id').size()
+        n_previous = previous_pairs.groupby('order_id').size().reindex(n_all.index, fill_value=0)
+        spanning = _concat_pairs([
+            all_pairs[all_pairs['order_id'].isin(n_all.index[(n_all >= 2) & (n_previous < 2)])],
+            fresh[fresh['order_id'].isin(n_previous.index[n_previous >= 2])]])
+
+        parts = self.parts + [SalesCube(cells, _empty_pairs(), builder._customer_registers())]
+        pairs = self.pairs + [spanning]
+        while len(parts) > 2 and 2 * len(parts[-1]) >= len(parts[-2]):
+            last, last_pairs = parts.pop(), pairs.pop()
+            parts[-1] = _merge_cubes(parts[-1], last)
+            pairs[-1] = _concat_pairs([pairs[-1], last_pairs])
+        return LiveCube(parts, pairs)
+
+    def __len__(self):
+        return sum(len(part) for part in self.parts)
+
+    def select(self, start_date=None, end_date=None, regions=None, categories=None):
+        """Cells matching the dashboard filters, in every part."""
+        filters = (start_date, end_date, regions, categories)
+        return LiveSlice(self, [part.select(*filters) for part in self.parts], filters)
+
+    def count(self, start_date=None, end_date=None, regions=None, categories=None):
+        """Number of order rows matching the filters, without touching any rows."""
+        return sum(part.count(start_date, end_date, regions, categories) for part in self.parts)
+
+    def filter_values(self):
+        """Regions, categories and (first, last) order date, for the filter controls."""
+        values = [part.filter_values() for part in self.parts]
+        dates = pd.Series([date for _, _, date_range in values for date in date_range], dtype='datetime64[ns]')
+        return (sorted(set().union(*(regions for regions, _, _ in values))),
+                sorted(set().union(*(categories for _, categories, _ in values))),
+                (dates.min(), dates.max()))
+
+    def distinct_orders(self, parts, filters):
+        """Number of distinct order_ids across the selected cells of every part (CubeSlices of parts)."""
+        total = sum(int(part.cube.cells['orders'].to_numpy()[part.mask].sum()) for part in parts)
+        ids = np.concatenate([self.parts[0].shared_orders(parts[0].mask)]
+                             + [pairs['order_id'].to_numpy()[_key_mask(pairs, filters)] for pairs in self.pairs])
+        return total - (len(ids) - len(pd.unique(ids)))
+
+    def compacted(self):
+        """All the parts as one SalesCube, e.g. for the clientside bundle."""
+        return self._compacted
+
+    @functools.cached_property
+    def _compacted(self):
+        if len(self.parts) == 1:
+            return self.parts[0]
+        registers = None
+        if self.parts[0].customer_registers is not None:
+            registers = merge_registers([part.customer_registers for part in self.parts])
+        cells = CubeBuilder._merge([part.cells[CELL_COLUMNS] for part in self.parts])
+        pairs = _concat_pairs([_plain_keys(self.parts[0].shared_pairs)] + self.pairs)
+        return SalesCube(cells, pairs, registers)
+
+
+class LiveSlice(CubeSlice):
+    """Aggregates over one selection of the cells of a LiveCube, combined from a CubeSlice per part."""
+
+    def __init__(self, cube, parts, filters):
+        self.cube = cube
+        self.parts = parts
+        self.filters = filters
+
+    @functools.cached_property
+    def cells(self):
+        return pd.concat([part.cells for part in self.parts], ignore_index=True)
+
+    @property
+    def empty(self):
+        return all(part.empty for part in self.parts)
+
+    def row_count(self):
+        return sum(part.row_count() for part in self.parts)
+
+    def revenue_cents(self):
+        return sum(part.revenue_cents() for part in self.parts)
+
+    def order_cents(self):
+        return sum(part.order_cents() for part in self.parts)
+
+    def distinct_orders(self):
+        return self.cube.distinct_orders(self.parts, self.filters)
+
+    def distinct_customers(self):
+        """Estimated number of distinct customers, from the customer sketches of every part."""
+        return hll_estimate(np.maximum.reduce([part.cube.selected_registers(part.mask) for part in self.parts]))
+
+    def daily_totals(self):
+        days, cents, rows = (np.concatenate(values) for values in zip(*(part.daily_totals() for part in self.parts)))
+        days, day = np.unique(days, return_inverse=True)
+        return (days, np.bincount(day, weights=cents, minlength=len(days)).astype(np.int64),
+                np.bincount(day, weights=rows, minlength=len(days)).astype(np.int64))
+
+    def top_products(self, n=10, approximate=APPROXIMATE):
+        """The n products with the highest revenue, as product_name and total_amount."""
+        if not approximate:
+            return super().top_products(n, approximate)
+        counters, floor = [], 0
+        for part in self.parts:
+            names, revenue, missed, part_floor = part.cube.product_counters(part.mask)
+            # What the part's counters account for of a product's revenue besides revenue itself
+            counters.append(pd.DataFrame({'product_name': names, 'revenue': revenue, 'covered': part_floor - missed}))
+            floor += part_floor
+        totals = pd.concat(counters).groupby('product_name', sort=False)[['revenue', 'covered']].sum()
+        return _top_products(totals.index.to_numpy(dtype=object), totals['revenue'].to_numpy(),
+                             floor - totals['covered'].to_numpy(), n)
@@ -1,13 +1,44 @@
 import pandas as pd
 import numpy as np
-import plotly.express as px
-import plotly.graph_objects as go
-from dash import Dash, dcc, html, Input, Output, dash_table, State
+from dash import ClientsideFunction, Dash, dcc, html, Input, Output, dash_table, State, ctx, no_update
 import dash_bootstrap_components as dbc
+from dash.exceptions import PreventUpdate
 from datetime import datetime
+import functools
+import os
+from urllib.parse import parse_qsl, urlencode, urlsplit
+from flask import Response, jsonify, request, send_file, stream_with_context
+from werkzeug.datastructures import MultiDict
+
+from data_processing import clean_sales_data, memory_report
+from dataset_cache import DEFAULT_CACHE_DIR, load_with_cache
+from aggregates import SalesCube
+from filters import FilterEngine
+from result_cache import ResultCache, normalize_filters
+from timings import (add_server_timing, prometheus_text, record_rows, stage, stage_timings,
+                     start_request_timer, timed, timed_stream, timings)
+from profiling import install_profiling
+from compression import install_compression
+from figures import (fast_category_figure, fast_rating_figure, fast_sales_time_figure,
+                     fast_top_products_figure, message_figure, no_data_figure)
+from export import iter_encoded, iter_gzip, write_csv_file
+from table_query import FilterQueryError, parse_filter_query
+from ingest import ChunkedSalesData, current_rss_mb, plan_ingest, read_raw_source
+from backends import BACKEND, SalesSnapshot
+from sqlite_backend import SqliteSalesStore
+from live_ingest import LIVE_REFRESH_SECONDS, TailIngester
+from shared_data import SHARED_DATA, SharedDataWatcher, load_shared
+from sketches import APPROXIMATE, CLIENTSIDE
+from clientside import client_bundle
+from jobs import BACKGROUND_EXPORTS, FINISHED, JobQueue, JobStore, job_key
+from trends import GRANULARITIES, TREND_GRANULARITY
+from startup import (LAZY_STARTUP, BackgroundLoader, read_metadata, sales_metadata, source_stamp,
+                     write_metadata)
 
 # Initialize the Dash app with a modern theme
 app = Dash(__name__, external_stylesheets=[dbc.themes.FLATLY])
+# The Flask app, for WSGI servers running several workers (gunicorn -w 4 app:server)
+server = app.server
 
 # Custom CSS for enhanced styling
 app.index_string = '''
@@ -143,456 +174,943 @@ app.index_string = '''
 </html>
 '''
 
+# The sales CSV (or directory of CSV files) the dashboard shows
+DATA_FILE = os.environ.get('SWIFTSHOP_DATA_FILE') or 'swiftshop_sales_data.csv'
+
 # Load and process data
+def read_sales_csv(path):
+    # DATA_FILE may also be a directory of CSV files
+    with stage('read_csv'):
+        df = read_raw_source(path)
+    with stage('clean'):
+        return clean_sales_data(df)
+
 def load_data():
     try:
-        df = pd.read_csv('swiftshop_sales_data.csv')
-        
-        # Convert order_date to datetime
-        df['order_date'] = pd.to_datetime(df['order_date'])
-        
-        # Extract year and month for time-based analysis
-        df['year'] = df['order_date'].dt.year
-        df['month'] = df['order_date'].dt.month
-        df['month_year'] = df['order_date'].dt.strftime('%Y-%m')
-        
-        # Handle missing ratings
-        df['payment_method'] = df['payment_method'].fillna("Unknown")
-        
-        median_rating_by_product = df.groupby('product_id')['customer_rating'].median().apply(np.round)
-        for idx in df[df['customer_rating'].isna()].index:
-            product = df.loc[idx, 'product_id']
-            if product in median_rating_by_product and pd.notna(median_rating_by_product[product]):
-                df.loc[idx, 'customer_rating'] = median_rating_by_product[product]
-            else:
-                # If no median for product, use overall median
-                df.loc[idx, 'customer_rating'] = np.round(df['customer_rating'].median())
-
-        # This block fills missing 'customer_region' values based on the most common region (mode) used by the same 'customer_id'. If the customer's region cannot be determined, it sets it as 'Unknown'.
-
-        region_by_customer = df.groupby('customer_id')['customer_region'].agg(lambda x: x.mode()[0] if not x.mode().empty and pd.notna(x.mode()[0]) else np.nan)
-        for idx in df[df['customer_region'].isna()].index:
-            customer = df.loc[idx, 'customer_id']
-            if customer in region_by_customer and pd.notna(region_by_customer[customer]):
-                df.loc[idx, 'customer_region'] = region_by_customer[customer]
-            else:
-                df.loc[idx, 'customer_region'] = 'Unknown'        
-        
+        # Reuse the columnar cache from a previous start when the CSV is unchanged
+        # (a directory of CSV files is read again every time)
+        cache_dir = '' if os.path.isdir(DATA_FILE) else DEFAULT_CACHE_DIR
+        with stage('load_data'):
+            df = load_with_cache(DATA_FILE, read_sales_csv, cache_dir)
+        print(f"Memory usage by column:\n{memory_report(df).to_string()}")
         return df
     except Exception as e:
         print(f"Error loading data: {e}")
-        return pd.DataFrame()
-
-df = load_data()
-
-# Define unique values for filters
-regions = sorted(df['customer_region'].unique())
-categories = sorted(df['category'].unique())
-date_range = [df['order_date'].min(), df['order_date'].max()]
-
-# Create a custom graph template for consistency
-custom_template = go.layout.Template()
-custom_template.layout.colorway = ['#3a7bd5', '#00d2ff', '#3498db', '#2ecc71', '#f39c12', '#e74c3c', '#9b59b6', '#1abc9c', '#34495e', '#f1c40f']
-custom_template.layout.font = dict(family="Segoe UI, Roboto, sans-serif", size=12, color="#495057")
-custom_template.layout.paper_bgcolor = "white"
-custom_template.layout.plot_bgcolor = "white"
-custom_template.layout.xaxis = dict(gridcolor="#f5f5f5", zerolinecolor="#f5f5f5")
-custom_template.layout.yaxis = dict(gridcolor="#f5f5f5", zerolinecolor="#f5f5f5")
-custom_template.layout.legend = dict(orientation="h", y=-0.2)
-custom_template.layout.margin = dict(l=40, r=40, t=50, b=50)
-
-# Dashboard layout
-app.layout = dbc.Container([
-    # Header
-    dbc.Row([
-        dbc.Col([
-            html.Div([
-                html.H1("SwiftShop Sales Dashboard", className="header-title"),
-                html.P("Interactive sales performance monitoring system", className="header-subtitle"),
-            ], className="dashboard-header")
-        ])
-    ]),
+        raise
+
+# The browser's bundle in clientside mode is built from the in-memory cube
+if CLIENTSIDE and BACKEND != 'pandas':
+    raise ValueError("SWIFTSHOP_CLIENTSIDE needs the pandas backend")
+if BACKEND not in ('pandas', 'sqlite'):
+    raise ValueError(f"Unknown backend {BACKEND!r}; expected pandas or sqlite")
+
+# The data the callbacks work on, through the methods listed in backends.py
+def load_sales():
+    # Data larger than the memory budget (SWIFTSHOP_MEMORY_BUDGET_MB) is read in
+    # chunks: only the cube is kept, and the table and export stream the CSV again
+    ingest_mode, chunk_rows = plan_ingest(DATA_FILE)
+    if BACKEND == 'sqlite':
+        # One SQLite file shared by all workers; filters and aggregations run as SQL
+        with stage('sqlite_open'):
+            snapshot = SqliteSalesStore.open(DATA_FILE, chunk_rows=chunk_rows)
+    elif ingest_mode == 'chunked':
+        with stage('chunked_load'):
+            snapshot = ChunkedSalesData.load(DATA_FILE, chunk_rows)
+    elif SHARED_DATA:
+        # Rows, cube and filter index built once by a loader process and mapped
+        # read-only by every worker
+        with stage('shared_attach'):
+            snapshot = load_shared(DATA_FILE)
+    else:
+        df = load_data()
+        # Pre-aggregated cells that the KPIs and charts are computed from, and
+        # the row selection for the table and the export
+        with stage('cube'):
+            cube = SalesCube.from_frame(df)
+        with stage('filter_index'):
+            row_filter = FilterEngine(df)
+        snapshot = SalesSnapshot(df, cube, row_filter, df.attrs.get('data_version'))
     
-    # KPIs Row
-    dbc.Row([
-        dbc.Col([
-            dbc.Card([
-                html.Div([
-                    html.P("TOTAL REVENUE", className="kpi-title"),
-                    html.H2(id="total-sales", className="kpi-value"),
-                    html.P("Across all selected filters", className="text-muted")
-                ], className="kpi-card")
-            ], className="card")
-        ], width=4),
-        
-        dbc.Col([
-            dbc.Card([
-                html.Div([
-                    html.P("AVERAGE ORDER VALUE", className="kpi-title"),
-                    html.H2(id="avg-order-value", className="kpi-value"),
-                    html.P("Customer spend per transaction", className="text-muted")
-                ], className="kpi-card")
-            ], className="card")
-        ], width=4),
-        
-        dbc.Col([
-            dbc.Card([
+    print(f"Backend: {BACKEND} ({ingest_mode if BACKEND == 'pandas' else 'on disk'}), "
+          f"RSS after loading: {current_rss_mb():,.0f} MB")
+    print("Startup stages: " + ', '.join(f"{name} {total:.2f}s" for (unit, name), _, _, total, _
+                                          in stage_timings.summaries() if unit == 'startup'))
+    return snapshot
+
+# The top products and unique customers come from sketches (see sketches.py)
+APPROXIMATE_KPIS = APPROXIMATE and BACKEND == 'pandas'
+
+def load_with_metadata():
+    """The loaded data and its metadata, which is kept for the next lazy start."""
+    # The source as it was before reading, so appended rows make the metadata out of date
+    stamp = source_stamp(DATA_FILE)
+    snapshot = load_sales()
+    described = sales_metadata(snapshot)
+    write_metadata(DATA_FILE, described, stamp)
+    return snapshot, described
+
+# Lazy startup (see startup.py): the layout is served from the metadata the
+# last load left while the data loads in the background, and `sales` is
+# None until it is ready
+if LAZY_STARTUP:
+    sales = None
+    metadata = read_metadata(DATA_FILE) or {'columns': [], 'regions': [], 'categories': [],
+                                            'date_range': (None, None)}
+else:
+    sales, metadata = load_with_metadata()
+
+data_version = sales.data_version if sales is not None else None
+
+# Recent dashboard results, keyed on the callback and the normalized filters
+dashboard_cache = ResultCache(data_version=data_version)
+
+# Cube selections shared by the dashboard callbacks (kept in this process only)
+selection_cache = ResultCache(maxsize=16, directory=None, data_version=data_version)
+
+# Callbacks read `sales` once per request, since live refresh swaps in a new
+# snapshot whenever rows are appended
+def publish_snapshot(snapshot):
+    global sales
+    sales = snapshot
+    dashboard_cache.invalidate(snapshot.data_version)
+    selection_cache.invalidate(snapshot.data_version)
+
+# Pick up rows appended to the CSV while the app runs (in-memory mode only).
+# Shared data is read-only, so there the CSV is loaded again once and every
+# worker switches to the new version.
+def live_refresh_enabled(snapshot):
+    return isinstance(snapshot, SalesSnapshot) and not snapshot.df.empty and LIVE_REFRESH_SECONDS > 0
+
+def start_live_refresh(snapshot):
+    if live_refresh_enabled(snapshot) and SHARED_DATA:
+        SharedDataWatcher(DATA_FILE, snapshot, LIVE_REFRESH_SECONDS, on_update=publish_snapshot).start()
+    elif live_refresh_enabled(snapshot):
+        TailIngester(DATA_FILE, snapshot, on_update=publish_snapshot).start()
+
+def finish_loading(loaded):
+    """Hand the data loaded in the background to the callbacks (lazy startup)."""
+    global sales, metadata
+    snapshot, metadata = loaded
+    # Nothing was cached while loading, so the caches only need the version
+    dashboard_cache.data_version = selection_cache.data_version = snapshot.data_version
+    sales = snapshot
+    start_live_refresh(snapshot)
+
+if LAZY_STARTUP:
+    loader = BackgroundLoader(load_with_metadata, finish_loading).start()
+else:
+    loader = None
+    start_live_refresh(sales)
+
+# Helper columns added by load_data() that the data table doesn't show
+DERIVED_COLUMNS = ['year', 'month', 'month_year']
+
+def table_columns(columns):
+    return [column for column in columns if column not in DERIVED_COLUMNS]
+
+def table_column_specs(columns):
+    return [{"name": i.replace('_', ' ').title(), "id": i} for i in table_columns(columns)]
+
+def refresh_interval(snapshot, status):
+    """(interval in ms, disabled) of the live-refresh poll, which polls every second while the data loads."""
+    if status == 'loading':
+        return 1000, False
+    return LIVE_REFRESH_SECONDS * 1000, not live_refresh_enabled(snapshot)
+
+def load_status_text(status, error=None):
+    if status == 'failed':
+        return f"The sales data could not be loaded: {error}"
+    return "Loading the sales data..." if status == 'loading' else ""
+
+def load_status_color(status):
+    return 'danger' if status == 'failed' else 'info'
+
+def data_version_state(snapshot, status, max_date):
+    """What the data-version store tells the callbacks about the data."""
+    return {'version': snapshot.data_version if snapshot is not None else None,
+            'max_date': max_date.isoformat() if max_date is not None and not pd.isna(max_date) else None,
+            'status': status}
+
+def export_job_panel():
+    """The export link, the job it started and its progress, for background exports."""
+    return [
+        dcc.Store(id='export-link'),
+        dcc.Store(id='export-job'),
+        dcc.Interval(id='export-poll', interval=1000, disabled=True),
+        html.Div([
+            dbc.Progress(id='export-progress', value=0, className="mb-1"),
+            html.Small(id='export-status', className="text-muted d-block"),
+            html.A("Download", id='export-download', className="me-3", style={'display': 'none'}),
+            dbc.Button("Cancel", id='export-cancel', color="link", size="sm", className="p-0"),
+        ], id='export-job-panel', className="mt-3", style={'display': 'none'}),
+    ]
+
+def region_options(regions):
+    return [*[{'label': region, 'value': region} for region in regions if region != 'Unknown'],
+            {'label': 'Unknown', 'value': 'Unknown'}]
+
+def category_options(categories):
+    return [{'label': category, 'value': category} for category in categories]
+
+# Dashboard layout. With lazy startup it is built on every page load, from
+# the metadata of the last load until the data is ready
+def serve_layout():
+    regions, categories, date_range = metadata['regions'], metadata['categories'], metadata['date_range']
+    status = loader.status if loader is not None else 'ready'
+    refresh_ms, refresh_disabled = refresh_interval(sales, status)
+    return dbc.Container([
+        # Header
+        dbc.Row([
+            dbc.Col([
                 html.Div([
-                    html.P("CUSTOMER SATISFACTION", className="kpi-title"),
-                    html.H2(id="avg-rating", className="kpi-value"),
-                    html.P("Average rating (1-5 scale)", className="text-muted")
-                ], className="kpi-card")
-            ], className="card")
-        ], width=4)
-    ]),
-    
-    # Main content area
-    dbc.Row([
-        # Filters sidebar
-        dbc.Col([
-            dbc.Card([
-                dbc.CardBody([
-                    html.H5("DATA FILTERS", className="section-title"),
-                    
-                    html.Label("Date Range:", className="font-weight-bold mt-3 mb-2"),
-                    dcc.DatePickerRange(
-                        id='date-range',
-                        min_date_allowed=date_range[0],
-                        max_date_allowed=date_range[1],
-                        start_date=date_range[0],
-                        end_date=date_range[1],
-                        calendar_orientation='horizontal',
-                        clearable=True,
-                        with_portal=True,
-                        updatemode='bothdates',  
-                        style={'width': '100%'},
-                        className="mb-3"
-                    ),
-                    
-                    html.Label("Region:", className="font-weight-bold mt-3 mb-2"),
-                    dcc.Dropdown(
-                        id='region-dropdown',
-                        options=[
-                            *[{'label': region, 'value': region} for region in regions if region != 'Unknown'],
-                            {'label': 'Unknown', 'value': 'Unknown'}],
-                        value=None,
-                        placeholder="All Regions",
-                        multi=True,
-                        clearable=True,
-                        className="mb-3"
-                    ),
-                    
-                    html.Label("Product Category:", className="font-weight-bold mt-3 mb-2"),
-                    dcc.Dropdown(
-                        id='category-dropdown',
-                        options=[{'label': category, 'value': category} for category in categories],
-                        value=None,
-                        placeholder="All Categories",
-                        multi=True,
-                        clearable=True,
-                        className="mb-3"
-                    ),
-                    
-                    dbc.Button(
-                        [html.I(className="fas fa-download me-2"), "Export Filtered Data"],
-                        id="export-button",
-                        color="primary",
-                        className="export-btn mt-4"
-                    ),
-                ])
-            ], className="card")
-        ], width=3),
+                    html.H1("SwiftShop Sales Dashboard", className="header-title"),
+                    html.P("Interactive sales performance monitoring system", className="header-subtitle"),
+                ], className="dashboard-header")
+            ])
+        ]),
+        # Lazy startup: says while the data is loading, or why it could not be loaded
+        *([dbc.Alert(load_status_text(status, loader.error), id='load-status', color=load_status_color(status),
+                     is_open=status != 'ready')] if LAZY_STARTUP else []),
         
-        # Main charts area
-        dbc.Col([
-            # Sales Over Time Chart
-            dbc.Card([
-                dbc.CardBody([
-                    html.H5("Sales Performance Trend", className="section-title"),
-                    dcc.Graph(id='sales-time-graph', className="dash-graph")
-                ])
-            ], className="card"),
+        # KPIs Row
+        dbc.Row([
+            dbc.Col([
+                dbc.Card([
+                    html.Div([
+                        html.P("TOTAL REVENUE", className="kpi-title"),
+                        html.H2(id="total-sales", className="kpi-value"),
+                        html.P("Across all selected filters", className="text-muted")
+                    ], className="kpi-card")
+                ], className="card")
+            ], width=3),
             
-            # Category and Rating Row
-            dbc.Row([
-                dbc.Col([
-                    dbc.Card([
-                        dbc.CardBody([
-                            html.H5("Category Performance", className="section-title"),
-                            dcc.Graph(id='category-performance', className="dash-graph")
-                        ])
-                    ], className="card")
-                ], width=6),
-                
-                dbc.Col([
-                    dbc.Card([
-                        dbc.CardBody([
-                            html.H5("Rating Distribution", className="section-title"),
-                            dcc.Graph(id='rating-distribution', className="dash-graph")
-                        ])
-                    ], className="card")
-                ], width=6)
-            ]),
+            dbc.Col([
+                dbc.Card([
+                    html.Div([
+                        html.P("AVERAGE ORDER VALUE", className="kpi-title"),
+                        html.H2(id="avg-order-value", className="kpi-value"),
+                        html.P("Customer spend per transaction", className="text-muted")
+                    ], className="kpi-card")
+                ], className="card")
+            ], width=3),
             
-            # Top Products Chart
-            dbc.Card([
-                dbc.CardBody([
-                    html.H5("Top 10 Revenue Generating Products", className="section-title"),
-                    dcc.Graph(id='top-products', className="dash-graph")
-                ])
-            ], className="card"),
+            dbc.Col([
+                dbc.Card([
+                    html.Div([
+                        html.P("UNIQUE CUSTOMERS", className="kpi-title"),
+                        html.H2(id="unique-customers", className="kpi-value"),
+                        html.P("Distinct customers who ordered", className="text-muted")
+                    ], className="kpi-card")
+                ], className="card")
+            ], width=3),
             
-            # Data Table
-            dbc.Card([
-                dbc.CardBody([
-                    html.H5("Data Preview", className="section-title d-flex justify-content-between align-items-center"),
+            dbc.Col([
+                dbc.Card([
                     html.Div([
-                        dash_table.DataTable(
-                            id='data-table',
-                            columns=[{"name": i.replace('_', ' ').title(), "id": i} for i in df.columns 
-                                    if i not in ['year', 'month', 'month_year']],
-                            page_size=10,
-                            style_table={'overflowX': 'auto'},
-                            style_cell={
-                                'textAlign': 'left',
-                                'padding': '12px 15px',
-                                'font-family': 'Segoe UI, sans-serif',
-                                'font-size': '13px'
-                            },
-                            style_header={
-                                'backgroundColor': '#f1f3f5',
-                                'fontWeight': 'bold',
-                                'border': '1px solid #e9ecef'
-                            },
-                            style_data_conditional=[
-                                {
-                                    'if': {'row_index': 'odd'},
-                                    'backgroundColor': '#f8f9fa'
-                                }
-                            ],
-                            style_as_list_view=True,
-                            filter_action="native",
-                            sort_action="native",
-                            sort_mode="multi",
-                            page_action="native",
-                        )
-                    ], className="dash-table-container")
-                ])
-            ], className="card mt-4")
+                        html.P("CUSTOMER SATISFACTION", className="kpi-title"),
+                        html.H2(id="avg-rating", className="kpi-value"),
+                        html.P("Average rating (1-5 scale)", className="text-muted")
+                    ], className="kpi-card")
+                ], className="card")
+            ], width=3)
+        ]),
+        
+        # Main content area
+        dbc.Row([
+            # Filters sidebar
+            dbc.Col([
+                dbc.Card([
+                    dbc.CardBody([
+                        html.H5("DATA FILTERS", className="section-title"),
+                        
+                        html.Label("Date Range:", className="font-weight-bold mt-3 mb-2"),
+                        dcc.DatePickerRange(
+                            id='date-range',
+                            min_date_allowed=date_range[0],
+                            max_date_allowed=date_range[1],
+                            start_date=date_range[0],
+                            end_date=date_range[1],
+                            calendar_orientation='horizontal',
+                            clearable=True,
+                            with_portal=True,
+                            updatemode='bothdates',  
+                            style={'width': '100%'},
+                            className="mb-3"
+                        ),
+                        
+                        html.Label("Region:", className="font-weight-bold mt-3 mb-2"),
+                        dcc.Dropdown(
+                            id='region-dropdown',
+                            options=region_options(regions),
+                            value=None,
+                            placeholder="All Regions",
+                            multi=True,
+                            clearable=True,
+                            className="mb-3"
+                        ),
+                        
+                        html.Label("Product Category:", className="font-weight-bold mt-3 mb-2"),
+                        dcc.Dropdown(
+                            id='category-dropdown',
+                            options=category_options(categories),
+                            value=None,
+                            placeholder="All Categories",
+                            multi=True,
+                            clearable=True,
+                            className="mb-3"
+                        ),
+                        
+                        # In background mode the button starts an export job
+                        # for the link in the store instead of following it
+                        dbc.Button(
+                            [html.I(className="fas fa-download me-2"), "Export Filtered Data"],
+                            id="export-button",
+                            color="primary",
+                            **({} if BACKGROUND_EXPORTS else
+                               {'href': app.get_relative_path('/export.csv'), 'external_link': True}),
+                            className="export-btn mt-4"
+                        ),
+                        dbc.Checkbox(
+                            id='export-gzip',
+                            label="Compress export (gzip)",
+                            value=False,
+                            className="mt-2"
+                        ),
+                        html.Small(id='match-count', className="text-muted d-block mt-2"),
+                        *(export_job_panel() if BACKGROUND_EXPORTS else []),
+                    ])
+                ], className="card")
+            ], width=3),
             
-        ], width=9)
-    ]),
-    
-    # Footer
-    dbc.Row([
-        dbc.Col([
-            html.Hr(),
-            html.P("SwiftShop Sales Dashboard • by Faisal Alkhunain", 
-                   className="text-muted text-center")
-        ])
-    ], className="mt-5"),
-    
-    # Hidden download component
-    dcc.Download(id="download-dataframe-csv"),
-    
-    # Font Awesome for icons
-    html.Link(
-        rel="stylesheet",
-        href="https://cdnjs.cloudflare.com/ajax/libs/font-awesome/6.0.0/css/all.min.css"
-    )
-], fluid=True, className="px-4 py-3")
-
-# Define callback to filter data
-@app.callback(
-    [Output('sales-time-graph', 'figure'),
-     Output('category-performance', 'figure'),
-     Output('rating-distribution', 'figure'),
-     Output('top-products', 'figure'),
-     Output('total-sales', 'children'),
-     Output('avg-order-value', 'children'),
-     Output('avg-rating', 'children'),
-     Output('data-table', 'data')],
-    [Input('date-range', 'start_date'),
-     Input('date-range', 'end_date'),
-     Input('region-dropdown', 'value'),
-     Input('category-dropdown', 'value')]
-)
-def update_dashboard(start_date, end_date, selected_regions, selected_categories):
-    # Filter data based on inputs
-    filtered_df = df.copy()
-    
-    if start_date and end_date:
-        filtered_df = filtered_df[(filtered_df['order_date'] >= start_date) & 
-                                  (filtered_df['order_date'] <= end_date)]
-    
-    if selected_regions and len(selected_regions) > 0:
-        filtered_df = filtered_df[filtered_df['customer_region'].isin(selected_regions)]
-    
-    if selected_categories and len(selected_categories) > 0:
-        filtered_df = filtered_df[filtered_df['category'].isin(selected_categories)]
-    
-    # Check if filtered dataframe is empty
-    if filtered_df.empty:
-        # Create empty figures with "No data" messages
-        fig_time = go.Figure()
-        fig_time.add_annotation(
-            text="No data available for the selected filters",
-            xref="paper", yref="paper",
-            x=0.5, y=0.5, showarrow=False,
-            font=dict(size=16)
-        )
-        fig_time.update_layout(height=350)
+            # Main charts area
+            dbc.Col([
+                # Sales Over Time Chart
+                dbc.Card([
+                    dbc.CardBody([
+                        html.Div([
+                            html.H5("Sales Performance Trend", className="section-title"),
+                            # Bucket size of the trend; auto picks it from the selected date span
+                            dbc.RadioItems(
+                                id='trend-granularity',
+                                options=[{'label': 'Auto', 'value': 'auto'}] +
+                                        [{'label': g.capitalize(), 'value': g} for g in GRANULARITIES],
+                                value=TREND_GRANULARITY,
+                                inline=True,
+                            ),
+                        ], className="d-flex justify-content-between align-items-center"),
+                        dcc.Graph(id='sales-time-graph', className="dash-graph")
+                    ])
+                ], className="card"),
+                
+                # Category and Rating Row
+                dbc.Row([
+                    dbc.Col([
+                        dbc.Card([
+                            dbc.CardBody([
+                                html.H5("Category Performance", className="section-title"),
+                                dcc.Graph(id='category-performance', className="dash-graph")
+                            ])
+                        ], className="card")
+                    ], width=6),
+                    
+                    dbc.Col([
+                        dbc.Card([
+                            dbc.CardBody([
+                                html.H5("Rating Distribution", className="section-title"),
+                                dcc.Graph(id='rating-distribution', className="dash-graph")
+                            ])
+                        ], className="card")
+                    ], width=6)
+                ]),
+                
+                # Top Products Chart
+                dbc.Card([
+                    dbc.CardBody([
+                        html.H5("Top 10 Revenue Generating Products", className="section-title"),
+                        dcc.Graph(id='top-products', className="dash-graph")
+                    ])
+                ], className="card"),
+                
+                # Data Table
+                dbc.Card([
+                    dbc.CardBody([
+                        html.H5("Data Preview", className="section-title d-flex justify-content-between align-items-center"),
+                        html.Div([
+                            dash_table.DataTable(
+                                id='data-table',
+                                columns=table_column_specs(metadata['columns']),
+                                page_current=0,
+                                page_size=10,
+                                style_table={'overflowX': 'auto'},
+                                style_cell={
+                                    'textAlign': 'left',
+                                    'padding': '12px 15px',
+                                    'font-family': 'Segoe UI, sans-serif',
+                                    'font-size': '13px'
+                                },
+                                style_header={
+                                    'backgroundColor': '#f1f3f5',
+                                    'fontWeight': 'bold',
+                                    'border': '1px solid #e9ecef'
+                                },
+                                style_data_conditional=[
+                                    {
+                                        'if': {'row_index': 'odd'},
+                                        'backgroundColor': '#f8f9fa'
+                                    }
+                                ],
+                                style_as_list_view=True,
+                                filter_action="custom",
+                                filter_query='',
+                                sort_action="custom",
+                                sort_mode="multi",
+                                sort_by=[],
+                                page_action="custom",
+                            )
+                        ], className="dash-table-container")
+                    ])
+                ], className="card mt-4")
+                
+            ], width=9)
+        ]),
         
-        fig_category = go.Figure()
-        fig_category.add_annotation(
-            text="No data available for the selected filters",
-            xref="paper", yref="paper",
-            x=0.5, y=0.5, showarrow=False,
-            font=dict(size=16)
-        )
-        fig_category.update_layout(height=300)
+        # Footer
+        dbc.Row([
+            dbc.Col([
+                html.Hr(),
+                html.P("SwiftShop Sales Dashboard • by Faisal Alkhunain", 
+                       className="text-muted text-center")
+            ])
+        ], className="mt-5"),
         
-        fig_rating = go.Figure()
-        fig_rating.add_annotation(
-            text="No data available for the selected filters",
-            xref="paper", yref="paper",
-            x=0.5, y=0.5, showarrow=False,
-            font=dict(size=16)
-        )
-        fig_rating.update_layout(height=300)
+        # Live refresh: the interval polls for a new data version, which the
+        # store hands to the callbacks that depend on the data
+        dcc.Interval(id='live-refresh', interval=refresh_ms, disabled=refresh_disabled),
+        dcc.Store(id='data-version', data=data_version_state(sales, status, date_range[1])),
+        # Clientside mode: the pre-aggregated arrays the browser computes the dashboard from
+        *([dcc.Store(id='cube-bundle')] if CLIENTSIDE else []),
         
-        fig_top_products = go.Figure()
-        fig_top_products.add_annotation(
-            text="No data available for the selected filters",
-            xref="paper", yref="paper",
-            x=0.5, y=0.5, showarrow=False,
-            font=dict(size=16)
+        # Font Awesome for icons
+        html.Link(
+            rel="stylesheet",
+            href="https://cdnjs.cloudflare.com/ajax/libs/font-awesome/6.0.0/css/all.min.css"
         )
-        fig_top_products.update_layout(height=450)
-        
-        total_sales = "$0.00"
-        avg_order_value = "$0.00"
-        avg_rating = "N/A"
-        table_data = []
-        
-        return fig_time, fig_category, fig_rating, fig_top_products, total_sales, avg_order_value, avg_rating, table_data
-    
-    # If we have data, proceed as normal
+    ], fluid=True, className="px-4 py-3")
+
+app.layout = serve_layout if LAZY_STARTUP else serve_layout()
+
+def unless_loaded(placeholder):
+    """Answer with placeholder(message) instead of running the function until the data is loaded."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if sales is None:
+                message = "Loading data..." if loader.status == 'loading' else "The data could not be loaded"
+                return placeholder(message)
+            return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def dashboard_callback(*args, **kwargs):
+    """app.callback, except in clientside mode, where the browser computes these outputs."""
+    if CLIENTSIDE:
+        return lambda function: function
+    return app.callback(*args, **kwargs)
+
+# The dashboard is split into one callback per figure (plus one for the KPIs).
+# Dash sends each as its own request, so they run concurrently on the
+# threaded server and every figure appears as soon as it is ready. They all
+# start from the same cached selection for the current filters.
+DASHBOARD_INPUTS = [Input('date-range', 'start_date'),
+                    Input('date-range', 'end_date'),
+                    Input('region-dropdown', 'value'),
+                    Input('category-dropdown', 'value'),
+                    Input('data-version', 'data')]
 
+@selection_cache.memoize
+def select_cells(start_date, end_date, selected_regions, selected_categories, data_version=None):
+    # Select the data matching the filters; KPIs and charts are aggregates over it
+    return sales.select(start_date, end_date, selected_regions, selected_categories)
+
+@dashboard_callback(
+    [Output('total-sales', 'children'),
+     Output('avg-order-value', 'children'),
+     Output('unique-customers', 'children'),
+     Output('avg-rating', 'children')],
+    DASHBOARD_INPUTS
+)
+@unless_loaded(lambda message: ("...",) * 4)
+@timed('kpis')
+@dashboard_cache.memoize
+def update_kpis(*filters):
+    with stage('filter'):
+        selection = select_cells(*filters)
+    if selection.empty:
+        return "$0.00", "$0.00", "0", "N/A"
+    record_rows(scanned=selection.row_count(), returned=4)
+    
     # Calculate KPIs
-    total_sales = f"${filtered_df['total_amount'].sum():,.2f}"
-    avg_order_value = f"${filtered_df.groupby('order_id')['total_amount'].sum().mean():,.2f}"
+    with stage('aggregate'):
+        total_sales = f"${selection.total_revenue():,.2f}"
+        avg_order_value = f"${selection.avg_order_value():,.2f}"
+    # Estimated from the customer sketch in approximate mode and for chunked
+    # data (SQLite always counts exactly)
+    with stage('distinct_customers'):
+        customers = sales.distinct_customers(*filters[:4])
+    approximate = APPROXIMATE_KPIS or isinstance(sales, ChunkedSalesData)
+    unique_customers = f"~{customers:,.0f}" if approximate else f"{customers:,}"
     
     # For average rating, exclude orders with no rating (value 0)
-    rating_df = filtered_df[filtered_df['customer_rating'] > 0]
-    avg_rating = f"{rating_df['customer_rating'].mean():.1f}/5.0" if not rating_df.empty else "N/A"
-    
-    # Sales Over Time graph
-    sales_by_month = filtered_df.groupby('month_year')['total_amount'].sum().reset_index()
-    sales_by_month = sales_by_month.sort_values('month_year')
-    
-    fig_time = px.line(sales_by_month, x='month_year', y='total_amount',
-                      labels={'month_year': 'Month', 'total_amount': 'Revenue ($)'},
-                      template=custom_template)
+    with stage('aggregate'):
+        mean_rating = selection.avg_rating()
+    avg_rating = f"{mean_rating:.1f}/5.0" if mean_rating is not None else "N/A"
+    return total_sales, avg_order_value, unique_customers, avg_rating
+
+@dashboard_callback(Output('sales-time-graph', 'figure'),
+                    DASHBOARD_INPUTS + [Input('trend-granularity', 'value')])
+@unless_loaded(lambda message: message_figure(350, message))
+@timed('sales_time_graph')
+@dashboard_cache.memoize(key=lambda *args: normalize_filters(*args) + tuple(args[5:]))
+def update_sales_time_graph(start_date, end_date, selected_regions, selected_categories, data_version=None,
+                            granularity=TREND_GRANULARITY):
+    with stage('filter'):
+        selection = select_cells(start_date, end_date, selected_regions, selected_categories, data_version)
+    if selection.empty:
+        return no_data_figure(350)
     
-    fig_time.update_traces(mode='lines+markers', 
-                          line=dict(width=3, color='#3a7bd5'),
-                          marker=dict(size=8, color='#00d2ff'))
-    # Force the x-axis to be categorical when there's only one data point
-    if len(sales_by_month) <= 1:
-        fig_time.update_layout(
-            xaxis=dict(type='category', tickangle=-45),
-            yaxis=dict(automargin=True),
-            title=None,
-            hovermode="x unified",
-            height=350,
-        )
-    else:
-        fig_time.update_layout(
-            xaxis_tickangle=-45,
-            yaxis=dict(automargin=True),
-            title=None,
-            hovermode="x unified",
-            height=350,
-        )
+    # Sales Over Time graph, with day to quarter buckets and a bounded number of points
+    with stage('aggregate'):
+        granularity, trend = selection.sales_trend(granularity)
+    record_rows(scanned=selection.row_count(), returned=len(trend))
+    with stage('figure'):
+        return fast_sales_time_figure(trend, granularity)
 
-    fig_time.update_yaxes(tickprefix="$", gridwidth=0.5)
+@dashboard_callback(Output('category-performance', 'figure'), DASHBOARD_INPUTS)
+@unless_loaded(lambda message: message_figure(300, message))
+@timed('category_graph')
+@dashboard_cache.memoize
+def update_category_graph(*filters):
+    with stage('filter'):
+        selection = select_cells(*filters)
+    if selection.empty:
+        return no_data_figure(300)
     
     # Category Performance graph
-    category_performance = filtered_df.groupby('category')['total_amount'].sum().reset_index()
-    fig_category = px.pie(category_performance, values='total_amount', names='category',
-                         template=custom_template, hole=0.4)
-    fig_category.update_traces(textposition='inside', textinfo='percent+label')
-    fig_category.update_layout(
-        showlegend=True,
-        title=None,
-        uniformtext_minsize=10,
-        uniformtext_mode='hide',
-        height=300
-    )
+    with stage('aggregate'):
+        data = selection.category_revenue()
+    record_rows(scanned=selection.row_count(), returned=len(data))
+    with stage('figure'):
+        return fast_category_figure(data)
+
+@dashboard_callback(Output('rating-distribution', 'figure'), DASHBOARD_INPUTS)
+@unless_loaded(lambda message: message_figure(300, message))
+@timed('rating_graph')
+@dashboard_cache.memoize
+def update_rating_graph(*filters):
+    with stage('filter'):
+        selection = select_cells(*filters)
+    if selection.empty:
+        return no_data_figure(300)
     
     # Rating Distribution graph
-    rating_counts = filtered_df[filtered_df['customer_rating'] > 0]['customer_rating'].value_counts().sort_index()
-    fig_rating = px.bar(x=rating_counts.index, y=rating_counts.values,
-                       labels={'x': 'Rating', 'y': 'Number of Reviews'},
-                       template=custom_template)
-    fig_rating.update_traces(marker_color='#3498db', opacity=0.8)
-    fig_rating.update_layout(
-        title=None,
-        xaxis=dict(tickmode='linear', tickvals=[1, 2, 3, 4, 5]),
-        height=300
-    )
+    with stage('aggregate'):
+        data = selection.rating_counts()
+    record_rows(scanned=selection.row_count(), returned=len(data))
+    with stage('figure'):
+        return fast_rating_figure(data)
+
+@dashboard_callback(Output('top-products', 'figure'), DASHBOARD_INPUTS)
+@unless_loaded(lambda message: message_figure(450, message))
+@timed('top_products_graph')
+@dashboard_cache.memoize
+def update_top_products_graph(*filters):
+    with stage('filter'):
+        selection = select_cells(*filters)
+    if selection.empty:
+        return no_data_figure(450)
     
     # Top 10 Products graph
-    top_products = filtered_df.groupby('product_name')['total_amount'].sum().sort_values(ascending=False).head(10).reset_index()
-    fig_top_products = px.bar(top_products, x='total_amount', y='product_name', 
-                             orientation='h',
-                             labels={'total_amount': 'Revenue ($)', 'product_name': 'Product'},
-                             template=custom_template)
-    fig_top_products.update_traces(marker_color='#2ecc71', opacity=0.85)
-    fig_top_products.update_layout(
-        title=None,
-        yaxis={'categoryorder': 'total ascending',
-               'automargin': True },
-        xaxis=dict(tickprefix="$"),
-        height=450,
-    )
-    
-    # Update data table
-    table_data = filtered_df.to_dict('records')
-    
-    return fig_time, fig_category, fig_rating, fig_top_products, total_sales, avg_order_value, avg_rating, table_data
+    with stage('aggregate'):
+        data = selection.top_products(10)
+    record_rows(scanned=selection.row_count(), returned=len(data))
+    with stage('figure'):
+        return fast_top_products_figure(data)
 
-# Callback for exporting data
+# Serve the data table one page at a time; sorting and filtering run on the server
 @app.callback(
-    Output("download-dataframe-csv", "data"),
-    Input("export-button", "n_clicks"),
-    [State('date-range', 'start_date'),
-     State('date-range', 'end_date'),
-     State('region-dropdown', 'value'),
-     State('category-dropdown', 'value')],
-    prevent_initial_call=True
+    [Output('data-table', 'data'),
+     Output('data-table', 'page_count'),
+     Output('data-table', 'page_current')],
+    [Input('data-table', 'page_current'),
+     Input('data-table', 'page_size'),
+     Input('data-table', 'sort_by'),
+     Input('data-table', 'filter_query'),
+     Input('date-range', 'start_date'),
+     Input('date-range', 'end_date'),
+     Input('region-dropdown', 'value'),
+     Input('category-dropdown', 'value'),
+     Input('data-version', 'data')]
 )
-def export_data(n_clicks, start_date, end_date, selected_regions, selected_categories):
-    if n_clicks is None:
-        return None
+@unless_loaded(lambda message: ([], 1, 0))
+@timed('table')
+def update_table(page_current, page_size, sort_by, filter_query,
+                 start_date, end_date, selected_regions, selected_categories, data_version):
+    # Any change other than paging (or new data arriving) starts again from the first page
+    if ctx.triggered_id is not None and not ({'data-table.page_current', 'data-version.data'}
+                                             & set(ctx.triggered_prop_ids)):
+        page_current = 0
     
-    # Filter data based on inputs (same as above)
-    filtered_df = df.copy()
+    snapshot = sales
     
-    if start_date and end_date:
-        filtered_df = filtered_df[(filtered_df['order_date'] >= start_date) & 
-                                  (filtered_df['order_date'] <= end_date)]
+    try:
+        conditions = parse_filter_query(filter_query)
+    except FilterQueryError as e:
+        # Like the native table, an invalid filter is ignored
+        print(f"Ignoring table filter: {e}")
+        conditions = []
     
-    if selected_regions and len(selected_regions) > 0:
-        filtered_df = filtered_df[filtered_df['customer_region'].isin(selected_regions)]
+    filters = (start_date, end_date, selected_regions, selected_categories)
+    # Nothing matches: answer from the count without reading any rows
+    with stage('filter'):
+        n_rows = snapshot.count(*filters)
+    if not n_rows:
+        return [], 1, 0
     
-    if selected_categories and len(selected_categories) > 0:
-        filtered_df = filtered_df[filtered_df['category'].isin(selected_categories)]
+    with stage('query'):
+        try:
+            page = snapshot.table_page(filters, conditions, sort_by, page_current, page_size,
+                                       columns=table_columns(snapshot.columns))
+        except FilterQueryError as e:
+            print(f"Ignoring table filter: {e}")
+            page = snapshot.table_page(filters, [], sort_by, page_current, page_size,
+                                       columns=table_columns(snapshot.columns))
+    record_rows(scanned=n_rows, returned=len(page[0]))
+    return page
+
+# Point the export button at the streaming export route for the current filters
+# (in background mode, the store the button starts a job from), and show how
+# many rows it will return (disabled when there are none)
+EXPORT_LINK = Output('export-link', 'data') if BACKGROUND_EXPORTS else Output('export-button', 'href')
+
+@dashboard_callback(
+    [EXPORT_LINK,
+     Output('export-button', 'disabled'),
+     Output('match-count', 'children')],
+    [Input('date-range', 'start_date'),
+     Input('date-range', 'end_date'),
+     Input('region-dropdown', 'value'),
+     Input('category-dropdown', 'value'),
+     Input('export-gzip', 'value'),
+     Input('data-version', 'data')]
+)
+@unless_loaded(lambda message: (None, True, message))
+def update_export_link(start_date, end_date, selected_regions, selected_categories, use_gzip, data_version):
+    n_rows = sales.count(start_date, end_date, selected_regions, selected_categories)
+    params = {
+        'start_date': start_date or '',
+        'end_date': end_date or '',
+        'region': selected_regions or [],
+        'category': selected_categories or [],
+    }
+    if use_gzip:
+        params['gzip'] = 1
+    href = app.get_relative_path('/export.csv') + '?' + urlencode(params, doseq=True)
+    return href, n_rows == 0, f"{n_rows:,} matching rows"
+
+# Clientside mode: send the bundle when the page loads and whenever new data
+# arrives; the callbacks in assets/clientside.js do the rest in the browser
+if CLIENTSIDE:
+    @app.callback(Output('cube-bundle', 'data'), Input('data-version', 'data'))
+    @unless_loaded(lambda message: None)
+    @timed('client_bundle')
+    @dashboard_cache.memoize(key=lambda data_version: ())
+    def update_client_bundle(data_version):
+        snapshot = sales
+        return client_bundle(snapshot.cube.compacted(), snapshot.data_version, app.get_relative_path('/export.csv'))
+
+    for function_name, outputs, inputs in [
+        ('kpis', [Output('total-sales', 'children'), Output('avg-order-value', 'children'),
+                  Output('unique-customers', 'children'), Output('avg-rating', 'children')], DASHBOARD_INPUTS),
+        ('salesTimeGraph', Output('sales-time-graph', 'figure'),
+         DASHBOARD_INPUTS + [Input('trend-granularity', 'value')]),
+        ('categoryGraph', Output('category-performance', 'figure'), DASHBOARD_INPUTS),
+        ('ratingGraph', Output('rating-distribution', 'figure'), DASHBOARD_INPUTS),
+        ('topProductsGraph', Output('top-products', 'figure'), DASHBOARD_INPUTS),
+        ('exportLink', [EXPORT_LINK, Output('export-button', 'disabled'),
+                        Output('match-count', 'children')],
+         DASHBOARD_INPUTS[:4] + [Input('export-gzip', 'value'), Input('data-version', 'data')]),
+    ]:
+        app.clientside_callback(ClientsideFunction('swiftshop', function_name), outputs,
+                                inputs + [Input('cube-bundle', 'data')])
+
+# Tell open dashboards about new data, and let the filters include it. With
+# lazy startup this also tells them once the data is loaded (or failed to
+# load), and then slows the poll down to the live refresh interval.
+@app.callback(
+    [Output('data-version', 'data'),
+     Output('date-range', 'min_date_allowed'),
+     Output('date-range', 'max_date_allowed'),
+     Output('date-range', 'end_date'),
+     Output('region-dropdown', 'options'),
+     Output('category-dropdown', 'options'),
+     Output('data-table', 'columns'),
+     Output('live-refresh', 'interval'),
+     Output('live-refresh', 'disabled')],
+    Input('live-refresh', 'n_intervals'),
+    [State('data-version', 'data'),
+     State('date-range', 'end_date')]
+)
+def refresh_data_version(n_intervals, known, end_date):
+    snapshot = sales
+    status = loader.status if loader is not None else 'ready'
+    if snapshot is None:
+        if known and known.get('status') == status:
+            raise PreventUpdate
+        # The load failed: stop polling
+        return (data_version_state(None, status, None), *[no_update] * 6, *refresh_interval(None, status))
+    if known and known.get('status') == 'ready' and known['version'] == snapshot.data_version:
+        raise PreventUpdate
     
-    # Export filtered data
+    regions, categories, (min_date, max_date) = snapshot.filter_values()
+    # A range that ended at the newest date keeps following it
+    if end_date and known and known.get('max_date') and pd.Timestamp(end_date) >= pd.Timestamp(known['max_date']):
+        end_date = max_date
+    
+    return (data_version_state(snapshot, 'ready', max_date),
+            min_date, max_date, end_date,
+            region_options(regions), category_options(categories),
+            table_column_specs(snapshot.columns), *refresh_interval(snapshot, 'ready'))
+
+if LAZY_STARTUP:
+    @app.callback(
+        [Output('load-status', 'children'),
+         Output('load-status', 'color'),
+         Output('load-status', 'is_open')],
+        Input('data-version', 'data')
+    )
+    def update_load_status(data_version):
+        status = data_version['status']
+        return load_status_text(status, loader.error), load_status_color(status), status != 'ready'
+
+# Requests that need the data answer 503 until it is loaded (lazy startup)
+def data_not_ready(message):
+    return jsonify({'error': message, **loader.report()}), 503, {'Retry-After': '1'}
+
+def export_request(args):
+    """The filters and whether to gzip, from the query string of an export link."""
+    filters = (args.get('start_date'), args.get('end_date'),
+               args.getlist('region'), args.getlist('category'))
+    return filters, bool(args.get('gzip'))
+
+def export_chunks(snapshot, filters, n_rows):
+    if not n_rows:
+        # Just the header, without selecting or copying any rows
+        return iter([(pd.DataFrame(columns=snapshot.columns).to_csv(index=False), 0)])
+    return snapshot.iter_csv(*filters)
+
+def export_filename(use_gzip):
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    return dcc.send_data_frame(filtered_df.to_csv, f"swiftshop_data_{timestamp}.csv", index=False)
+    return f"swiftshop_data_{timestamp}.csv" + ('.gz' if use_gzip else '')
+
+# Streaming CSV export of the filtered data
+@app.server.route('/export.csv')
+@unless_loaded(data_not_ready)
+@timed('export')
+def export_data():
+    filters, use_gzip = export_request(request.args)
+    snapshot = sales
+    try:
+        with stage('filter'):
+            n_rows = snapshot.count(*filters)
+    except ValueError as e:
+        return jsonify({'error': f"Invalid date: {e}"}), 400
+    record_rows(scanned=n_rows)
+    chunks = export_chunks(snapshot, filters, n_rows)
+    
+    filename = export_filename(use_gzip)
+    body = iter_encoded(text for text, _ in chunks)
+    mimetype = 'text/csv'
+    if use_gzip:
+        body = iter_gzip(body)
+        mimetype = 'application/gzip'
+    # The CSV is built while it is sent, after this function returned
+    body = timed_stream('export', body, n_rows)
+    
+    return Response(stream_with_context(body), mimetype=mimetype,
+                    headers={'Content-Disposition': f'attachment; filename="{filename}"',
+                             'X-Row-Count': str(n_rows)})
+
+# Background exports (see jobs.py): a job writes the CSV to a file on the
+# job workers, and the dashboard polls it until the file can be downloaded
+export_jobs = JobQueue(JobStore()) if BACKGROUND_EXPORTS else None
+
+def job_status(job):
+    """What the API and the dashboard show of a job."""
+    status = {name: job[name] for name in ('id', 'status', 'done', 'total', 'filename', 'size', 'error')}
+    status['download'] = app.get_relative_path(f"/api/exports/{job['id']}/download")
+    return status
+
+@timed('export_job')
+def write_export(snapshot, filters, n_rows, use_gzip, path, progress):
+    record_rows(scanned=n_rows, returned=n_rows)
+    write_csv_file(path, export_chunks(snapshot, filters, n_rows), use_gzip, progress)
+
+def submit_export(args):
+    """The export job for an export link's query string, started unless an identical one exists."""
+    filters, use_gzip = export_request(args)
+    snapshot = sales
+    n_rows = snapshot.count(*filters)
+    # A repeated export is only served from an earlier file while the data is
+    # unchanged, which needs its version
+    key = job_key('export', normalize_filters(*filters), use_gzip, snapshot.data_version)
+    return export_jobs.submit(
+        key, 'export', n_rows, export_filename(use_gzip),
+        lambda path, progress: write_export(snapshot, filters, n_rows, use_gzip, path, progress),
+        reuse_done=snapshot.data_version is not None)
+
+if BACKGROUND_EXPORTS:
+    @app.server.route('/api/exports', methods=['POST'])
+    @unless_loaded(data_not_ready)
+    def start_export_job():
+        try:
+            job = submit_export(request.args)
+        except ValueError as e:
+            return jsonify({'error': f"Invalid date: {e}"}), 400
+        return jsonify(job_status(job)), 202
+
+    @app.server.route('/api/exports/<job_id>')
+    def export_job_status(job_id):
+        job = export_jobs.store.get(job_id)
+        if job is None:
+            return jsonify({'error': "No such export"}), 404
+        return jsonify(job_status(job))
+
+    @app.server.route('/api/exports/<job_id>/cancel', methods=['POST'])
+    def cancel_export_job(job_id):
+        job = export_jobs.store.cancel(job_id)
+        if job is None:
+            return jsonify({'error': "No such export"}), 404
+        return jsonify(job_status(job))
+
+    @app.server.route('/api/exports/<job_id>/download')
+    def download_export(job_id):
+        job = export_jobs.store.get(job_id)
+        if job is None or (job['status'] == 'done' and not os.path.exists(job['path'])):
+            return jsonify({'error': "No such export"}), 404
+        if job['status'] != 'done':
+            return jsonify(job_status(job)), 409
+        mimetype = 'application/gzip' if job['filename'].endswith('.gz') else 'text/csv'
+        return send_file(job['path'], mimetype=mimetype, as_attachment=True, download_name=job['filename'])
+
+    def export_status_text(job):
+        if job['status'] == 'queued':
+            return "Waiting for a free export worker..."
+        if job['status'] == 'running':
+            return f"Exporting: {job['done']:,} of {job['total']:,} rows"
+        if job['status'] == 'done':
+            return f"Ready: {job['total']:,} rows, {(job['size'] or 0) / 1024 ** 2:,.1f} MB"
+        if job['status'] == 'cancelled':
+            return "Export cancelled"
+        return f"Export failed: {job['error']}"
+
+    # The export button starts a job for the current link and the poll follows it
+    @app.callback(
+        [Output('export-job', 'data'),
+         Output('export-poll', 'disabled', allow_duplicate=True)],
+        Input('export-button', 'n_clicks'),
+        State('export-link', 'data'),
+        prevent_initial_call=True
+    )
+    def start_export(n_clicks, link):
+        if not link or sales is None:
+            raise PreventUpdate
+        args = MultiDict(parse_qsl(urlsplit(link).query, keep_blank_values=True))
+        return job_status(submit_export(args)), False
+
+    @app.callback(
+        [Output('export-job-panel', 'style'),
+         Output('export-progress', 'value'),
+         Output('export-progress', 'label'),
+         Output('export-status', 'children'),
+         Output('export-download', 'href'),
+         Output('export-download', 'style'),
+         Output('export-cancel', 'style'),
+         Output('export-poll', 'disabled')],
+        [Input('export-poll', 'n_intervals'),
+         Input('export-job', 'data')]
+    )
+    def poll_export(n_intervals, started):
+        job = export_jobs.store.get(started['id']) if started else None
+        if job is None:
+            return {'display': 'none'}, 0, "", "", None, {'display': 'none'}, {'display': 'none'}, True
+        finished = job['status'] in FINISHED
+        done = job['status'] == 'done'
+        percent = 100 if done else 100 * job['done'] / job['total'] if job['total'] else 0
+        return ({'display': 'block'}, percent, f"{percent:.0f}%", export_status_text(job),
+                job_status(job)['download'], {} if done else {'display': 'none'},
+                {'display': 'none'} if finished else {}, finished)
+
+    # The poll shows the job as cancelled once its worker has stopped
+    @app.callback(Input('export-cancel', 'n_clicks'), State('export-job', 'data'), prevent_initial_call=True)
+    def cancel_export(n_clicks, started):
+        if started:
+            export_jobs.store.cancel(started['id'])
+
+# Number of rows the filters select, answered before any row is read
+@app.server.route('/api/count')
+@unless_loaded(data_not_ready)
+def count_rows():
+    args = request.args
+    snapshot = sales
+    try:
+        n_rows = snapshot.count(args.get('start_date'), args.get('end_date'),
+                                     args.getlist('region'), args.getlist('category'))
+    except ValueError as e:
+        return jsonify({'error': f"Invalid date: {e}"}), 400
+    return jsonify({'rows': n_rows, 'data_version': snapshot.data_version})
+
+# Liveness: the server is up, whether or not the data is loaded yet
+@app.server.route('/healthz')
+def healthz():
+    return jsonify({'status': 'ok'})
+
+# Readiness: 200 once the data is loaded (at import, without lazy startup),
+# 503 while it loads or after it failed to
+@app.server.route('/readyz')
+def readyz():
+    report = loader.report() if loader is not None else {'status': 'ready'}
+    snapshot = sales
+    if snapshot is not None:
+        report['data_version'] = snapshot.data_version
+    return jsonify(report), 200 if report['status'] == 'ready' else 503
+
+def cache_stats():
+    return {'dashboard': dashboard_cache.stats(), 'selection': selection_cache.stats()}
+
+# Per-callback timings (count, p50, p99 and max in ms), slowest first, and
+# the hits and misses of the result caches
+@app.server.route('/timings')
+def timings_report():
+    return jsonify({'callbacks': timings.report(), 'caches': cache_stats()})
+
+# Callback, stage and startup timings, rows, response sizes and result cache
+# hits for Prometheus
+@app.server.route('/metrics')
+def metrics():
+    return Response(prometheus_text(cache_stats()), mimetype='text/plain; version=0.0.4')
+
+# Compress large responses (gzip, or Brotli when installed). Flask runs the
+# after_request hooks last registered first, so this one runs after the
+# timing hook and the recorded response sizes are the uncompressed ones.
+install_compression(app.server)
+
+# List the callbacks' durations in each response's Server-Timing header, and
+# record each callback's serialization time and response size
+app.server.before_request(start_request_timer)
+app.server.after_request(add_server_timing)
+
+# With SWIFTSHOP_PROFILE_DIR set, write a cProfile dump of every request
+install_profiling(app.server)
 
 # Run the app
 if __name__ == '__main__':
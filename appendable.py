@@ -0,0 +1,112 @@
+import numpy as np
+import pandas as pd
+
+# Append-only storage for live refresh.
+#
+# Rows appended to the source are written into arrays with spare capacity
+# instead of being concatenated onto everything loaded before. An array is
+# only copied when it is full, into one half as large again, so adding rows
+# costs time in proportion to the rows added. Every version of the data is
+# a view of the first n elements, which later appends do not touch, so the
+# snapshots already handed to the callbacks stay as they were. Only the
+# newest version is appended to.
+
+GROWTH = 1.5
+
+
+class GrowableArray:
+    """A 1-d numpy array with spare capacity at the end."""
+
+    def __init__(self, values):
+        # The first append copies, so values (e.g. a read-only memory map) is never written to
+        self._buffer = np.asarray(values)
+        self.size = len(self._buffer)
+
+    @property
+    def values(self):
+        """The elements so far, as a view that later appends leave unchanged."""
+        return self._buffer[:self.size]
+
+    def append(self, values):
+        """Add values at the end, widening the dtype if they need it; returns the new view."""
+        values = np.asarray(values)
+        end = self.size + len(values)
+        dtype = np.promote_types(self._buffer.dtype, values.dtype) if len(values) else self._buffer.dtype
+        if end > len(self._buffer) or dtype != self._buffer.dtype:
+            grown = np.empty(max(end, int(len(self._buffer) * GROWTH)), dtype=dtype)
+            grown[:self.size] = self._buffer[:self.size]
+            self._buffer = grown
+        self._buffer[self.size:end] = values
+        self.size = end
+        return self.values
+
+
+def _codes_dtype(dtype):
+    """The dtype pandas keeps the codes of a categorical of dtype in."""
+    return pd.Categorical.from_codes(np.empty(0, dtype=np.int8), dtype=dtype, validate=False).codes.dtype
+
+
+class AppendableFrame:
+    """The columns of a cleaned sales frame, in GrowableArrays that rows are appended to.
+
+    Categorical columns are kept as their codes and monthly periods as their
+    ordinals. Categories stay sorted, as astype('category') makes them: a
+    new value that sorts before existing ones rewrites the column's codes
+    once, which only happens when a value appears for the first time.
+    """
+
+    def __init__(self, df):
+        self.attrs = dict(df.attrs)
+        self._columns = {}
+        for name in df.columns:
+            series = df[name]
+            if isinstance(series.dtype, pd.CategoricalDtype):
+                self._columns[name] = ('category', GrowableArray(series.cat.codes.to_numpy()), series.dtype)
+            elif isinstance(series.dtype, pd.PeriodDtype):
+                self._columns[name] = ('period', GrowableArray(series.array.asi8), series.dtype)
+            else:
+                self._columns[name] = ('array', GrowableArray(series.to_numpy()), None)
+
+    def __len__(self):
+        return next(iter(self._columns.values()))[1].size if self._columns else 0
+
+    @staticmethod
+    def _append_categorical(codes, dtype, values):
+        categories = dtype.categories
+        added = pd.Index(values.dropna().astype(object).unique()).difference(categories)
+        if len(added):
+            union = categories.append(added).sort_values()
+            if not union[:len(categories)].equals(categories):
+                # A new value sorts before existing ones: recode the rows so far
+                mapping = np.append(union.get_indexer(categories), -1)
+                codes = GrowableArray(mapping[codes.values].astype(_codes_dtype(pd.CategoricalDtype(union))))
+            dtype = pd.CategoricalDtype(union)
+        codes.append(pd.Categorical(values, dtype=dtype).codes.astype(_codes_dtype(dtype)))
+        return codes, dtype
+
+    def append(self, rows):
+        """Add the rows of a cleaned frame with the same columns; returns the frame of all rows."""
+        for name, (kind, values, dtype) in self._columns.items():
+            new = rows[name]
+            if kind == 'category':
+                values, dtype = self._append_categorical(values, dtype, new)
+            elif kind == 'period':
+                values.append(new.array.asi8)
+            else:
+                values.append(new.to_numpy())
+            self._columns[name] = (kind, values, dtype)
+        return self.frame()
+
+    def frame(self):
+        """A DataFrame viewing the rows so far, without copying them."""
+        data = {}
+        for name, (kind, values, dtype) in self._columns.items():
+            if kind == 'category':
+                data[name] = pd.Categorical.from_codes(values.values, dtype=dtype, validate=False)
+            elif kind == 'period':
+                data[name] = pd.arrays.PeriodArray(values.values, dtype=dtype)
+            else:
+                data[name] = values.values
+        df = pd.DataFrame(data, copy=False)
+        df.attrs = dict(self.attrs)
+        return df
@@ -0,0 +1,623 @@
+// Dashboard callbacks run in the browser in clientside mode (see clientside.py).
+//
+// The server sends the bundle of pre-aggregated arrays once per data
+// version; these functions answer every filter change from it, with the
+// rules of the server callbacks in app.py: the same date range semantics,
+// the trend buckets and downsampling of trends.py, and Python's number
+// formatting.
+(function () {
+    'use strict';
+
+    const DAY_MS = 86400000;
+    const TYPED_ARRAYS = {
+        i1: Int8Array, u1: Uint8Array, i2: Int16Array, u2: Uint16Array,
+        i4: Int32Array, u4: Uint32Array, f4: Float32Array, f8: Float64Array,
+    };
+
+    function decode(value) {
+        // typed_array() sends empty and non-numeric arrays as plain lists
+        if (Array.isArray(value)) {
+            return value;
+        }
+        const text = atob(value.bdata);
+        const bytes = new Uint8Array(text.length);
+        for (let i = 0; i < text.length; i++) {
+            bytes[i] = text.charCodeAt(i);
+        }
+        return new TYPED_ARRAYS[value.dtype](bytes.buffer);
+    }
+
+    function decodeAll(arrays) {
+        const decoded = {};
+        for (const name of Object.keys(arrays)) {
+            decoded[name] = decode(arrays[name]);
+        }
+        return decoded;
+    }
+
+    let cached = null;
+
+    // The decoded arrays of a bundle, kept while its data version is current
+    function load(bundle) {
+        if (cached && (cached.source === bundle || (bundle.version != null && cached.version === bundle.version))) {
+            return cached;
+        }
+        cached = {
+            source: bundle,
+            version: bundle.version,
+            buckets: decodeAll(bundle.buckets),
+            spanning: decodeAll(bundle.spanning),
+            productCents: decodeAll(bundle.product_cents),
+            ratingRows: decodeAll(bundle.rating_rows),
+            monthRegisters: decode(bundle.customers.month_registers),
+            monthLowRegisters: decode(bundle.customers.month_low_registers),
+            dayRegisters: decode(bundle.customers.day_registers),
+            nMonthRegisters: 2 ** bundle.customers.month_precision,
+            nDayRegisters: 2 ** bundle.customers.day_precision,
+        };
+        // Number of buckets of every (month, region, category)
+        cached.monthSizes = new Int32Array(cached.monthRegisters.length / cached.nMonthRegisters);
+        for (const month of cached.buckets.month_bucket) {
+            cached.monthSizes[month] += 1;
+        }
+        cached.nSpanning = cached.spanning.order.reduce((most, order) => Math.max(most, order + 1), 0);
+        return cached;
+    }
+
+    // Day number of a date string, rounded up or down to whole days like pandas' ceil and floor
+    function dayNumber(value, roundUp) {
+        const match = /^(\d{4})-(\d{2})-(\d{2})(?:[T ](\d{2}):(\d{2})(?::(\d{2})(\.\d+)?)?)?/.exec(value);
+        const ms = Date.UTC(+match[1], +match[2] - 1, +match[3], +(match[4] || 0), +(match[5] || 0),
+                            +(match[6] || 0), match[7] ? Math.round(parseFloat(match[7]) * 1000) : 0);
+        return roundUp ? Math.ceil(ms / DAY_MS) : Math.floor(ms / DAY_MS);
+    }
+
+    // Days [lo, hi) of the bundle the date range covers, as SalesCube._day_range
+    function dayRange(bundle, startDate, endDate) {
+        const nDays = bundle.n_days;
+        if (!(startDate && endDate)) {
+            return {lo: 0, hi: nDays, dated: false};
+        }
+        const clip = (day) => Math.min(Math.max(day, 0), nDays);
+        const lo = clip(dayNumber(startDate, true) - bundle.first_day);
+        const hi = clip(dayNumber(endDate, false) - bundle.first_day + 1);
+        return {lo: lo, hi: Math.max(lo, hi), dated: true};
+    }
+
+    // Which codes a value filter allows (slot 0 is for missing values), or null for no filter
+    function allowedCodes(names, selected) {
+        if (!selected || selected.length === 0) {
+            return null;
+        }
+        const allowed = new Uint8Array(names.length + 1);
+        for (const value of selected) {
+            const code = names.indexOf(value);
+            if (code >= 0) {
+                allowed[code + 1] = 1;
+            }
+        }
+        return allowed;
+    }
+
+    function select(bundle, startDate, endDate, regions, categories) {
+        const data = load(bundle);
+        const {day, region, category, rows} = data.buckets;
+        const range = dayRange(bundle, startDate, endDate);
+        const allowedRegions = allowedCodes(bundle.regions, regions);
+        const allowedCategories = allowedCodes(bundle.categories, categories);
+        const selected = new Uint8Array(day.length);
+        let nRows = 0;
+        for (let b = 0; b < day.length; b++) {
+            const d = day[b];
+            if ((d < 0 ? range.dated : d < range.lo || d >= range.hi)
+                    || (allowedRegions && !allowedRegions[region[b] + 1])
+                    || (allowedCategories && !allowedCategories[category[b] + 1])) {
+                continue;
+            }
+            selected[b] = 1;
+            nRows += rows[b];
+        }
+        return {data: data, range: range, selected: selected, rows: nRows};
+    }
+
+    // Python's format(value, f',.{digits}f'): round half to even at exact ties, group thousands
+    function formatNumber(value, digits) {
+        let text;
+        const half = value * 2 ** (digits + 1);
+        if (Number.isInteger(half) && Math.abs(half % 2) === 1) {
+            // value lies exactly halfway between two roundings; toFixed would round away from zero
+            let scaled = Math.floor(value * 10 ** digits);
+            if (scaled % 2 !== 0) {
+                scaled += 1;
+            }
+            const sign = scaled < 0 ? '-' : '';
+            const units = String(Math.abs(scaled)).padStart(digits + 1, '0');
+            text = sign + units.slice(0, units.length - digits) + (digits ? '.' + units.slice(units.length - digits) : '');
+        } else {
+            text = value.toFixed(digits);
+        }
+        const [whole, fraction] = text.split('.');
+        return whole.replace(/\B(?=(\d{3})+(?!\d))/g, ',') + (fraction === undefined ? '' : '.' + fraction);
+    }
+
+    // Distinct orders of the selected buckets: orders spanning several buckets count once
+    function distinctOrders(selection) {
+        const {data, selected} = selection;
+        const {orders} = data.buckets;
+        let total = 0;
+        for (let b = 0; b < orders.length; b++) {
+            if (selected[b]) {
+                total += orders[b];
+            }
+        }
+        const seen = new Uint8Array(data.nSpanning);
+        const {order, bucket} = data.spanning;
+        for (let i = 0; i < order.length; i++) {
+            if (selected[bucket[i]]) {
+                if (seen[order[i]]) {
+                    total -= 1;
+                }
+                seen[order[i]] = 1;
+            }
+        }
+        return total;
+    }
+
+    function sigma(x) {
+        if (x === 1) {
+            return Infinity;
+        }
+        let y = 1.0, z = x;
+        for (;;) {
+            x *= x;
+            const previous = z;
+            z = z + x * y;
+            y += y;
+            if (z === previous) {
+                return z;
+            }
+        }
+    }
+
+    function tau(x) {
+        if (x === 0 || x === 1) {
+            return 0.0;
+        }
+        let y = 1.0, z = 1 - x;
+        for (;;) {
+            x = Math.sqrt(x);
+            const previous = z;
+            y *= 0.5;
+            z -= (1 - x) ** 2 * y;
+            if (z === previous) {
+                return z / 3;
+            }
+        }
+    }
+
+    // sketches.hll_estimate: Ertl's improved HyperLogLog estimator
+    function hllEstimate(registers) {
+        const m = registers.length;
+        const lowBits = 64 - Math.log2(m);
+        const counts = new Float64Array(lowBits + 2);
+        for (let i = 0; i < m; i++) {
+            counts[registers[i]] += 1;
+        }
+        if (counts[0] === m) {
+            return 0.0;
+        }
+        let z = m * tau(1 - counts[lowBits + 1] / m);
+        for (let k = lowBits; k > 0; k--) {
+            z = 0.5 * (z + counts[k]);
+        }
+        z += m * sigma(counts[0] / m);
+        return m * m / (2 * Math.log(2) * z);
+    }
+
+    // Merge register block `block` of `registers` (blocks of m) into `merged`
+    function mergeRegisters(merged, registers, block) {
+        const m = merged.length, offset = block * m;
+        for (let r = 0; r < m; r++) {
+            if (registers[offset + r] > merged[r]) {
+                merged[r] = registers[offset + r];
+            }
+        }
+    }
+
+    // Estimated distinct customers: months covered entirely from their own
+    // registers, plus what the days of the other months add to the coarse ones
+    function distinctCustomers(selection) {
+        const {data, selected} = selection;
+        const monthBucket = data.buckets.month_bucket;
+        const counts = new Int32Array(data.monthSizes.length);
+        for (let b = 0; b < selected.length; b++) {
+            if (selected[b]) {
+                counts[monthBucket[b]] += 1;
+            }
+        }
+        const full = new Uint8Array(data.nMonthRegisters);
+        const fullLow = new Uint8Array(data.nDayRegisters);
+        let nFull = 0;
+        for (let month = 0; month < counts.length; month++) {
+            if (counts[month] && counts[month] === data.monthSizes[month]) {
+                mergeRegisters(full, data.monthRegisters, month);
+                mergeRegisters(fullLow, data.monthLowRegisters, month);
+                nFull += 1;
+            }
+        }
+        const withPartial = fullLow.slice();
+        let nPartial = 0;
+        for (let b = 0; b < selected.length; b++) {
+            if (selected[b] && counts[monthBucket[b]] !== data.monthSizes[monthBucket[b]]) {
+                mergeRegisters(withPartial, data.dayRegisters, b);
+                nPartial += 1;
+            }
+        }
+        if (!nPartial) {
+            return hllEstimate(full);
+        }
+        if (!nFull) {
+            return hllEstimate(withPartial);
+        }
+        return hllEstimate(full) + Math.max(0, hllEstimate(withPartial) - hllEstimate(fullLow));
+    }
+
+    // Rows per rating value of the selection, sorted by rating
+    function ratingCounts(selection) {
+        const {bucket, rating, rows} = selection.data.ratingRows;
+        const counts = new Map();
+        for (let i = 0; i < bucket.length; i++) {
+            if (selection.selected[bucket[i]]) {
+                counts.set(rating[i], (counts.get(rating[i]) || 0) + rows[i]);
+            }
+        }
+        return [...counts.entries()].sort((a, b) => a[0] - b[0]);
+    }
+
+    function kpis(startDate, endDate, regions, categories, dataVersion, bundle) {
+        if (!bundle) {
+            throw window.dash_clientside.PreventUpdate;
+        }
+        const selection = select(bundle, startDate, endDate, regions, categories);
+        if (selection.rows === 0) {
+            return ['$0.00', '$0.00', '0', 'N/A'];
+        }
+        const {cents, order_cents} = selection.data.buckets;
+        let totalCents = 0, orderCents = 0;
+        for (let b = 0; b < cents.length; b++) {
+            if (selection.selected[b]) {
+                totalCents += cents[b];
+                orderCents += order_cents[b];
+            }
+        }
+        const total = totalCents / 100;
+        // Rows without an order_id are left out of the average order value
+        const orders = distinctOrders(selection);
+        let ratingSum = 0, rated = 0;
+        for (const [rating, rows] of ratingCounts(selection)) {
+            ratingSum += rating * rows;
+            rated += rows;
+        }
+        return [
+            '$' + formatNumber(total, 2),
+            '$' + formatNumber(orders ? orderCents / 100 / orders : 0, 2),
+            '~' + formatNumber(distinctCustomers(selection), 0),
+            rated ? formatNumber(ratingSum / rated, 1) + '/5.0' : 'N/A',
+        ];
+    }
+
+    // trends.py, for one day number or bucket key at a time
+
+    function monthOfDay(day) {
+        const date = new Date(day * DAY_MS);
+        return (date.getUTCFullYear() - 1970) * 12 + date.getUTCMonth();
+    }
+
+    function bucketKey(day, granularity) {
+        if (granularity === 'day') {
+            return day;
+        }
+        if (granularity === 'week') {
+            return Math.floor((day + 3) / 7);
+        }
+        const month = monthOfDay(day);
+        return granularity === 'month' ? month : Math.floor(month / 3);
+    }
+
+    function monthStartDay(month) {
+        return Date.UTC(1970 + Math.floor(month / 12), ((month % 12) + 12) % 12, 1) / DAY_MS;
+    }
+
+    function bucketStartDay(key, granularity) {
+        if (granularity === 'day') {
+            return key;
+        }
+        if (granularity === 'week') {
+            return key * 7 - 3;
+        }
+        return monthStartDay(granularity === 'month' ? key : key * 3);
+    }
+
+    function bucketLabel(key, granularity, startDay) {
+        if (granularity === 'day' || granularity === 'week') {
+            const day = startDay === null ? bucketStartDay(key, granularity)
+                : Math.max(bucketStartDay(key, granularity), startDay);
+            return new Date(day * DAY_MS).toISOString().slice(0, 10);
+        }
+        if (granularity === 'month') {
+            return new Date(monthStartDay(key) * DAY_MS).toISOString().slice(0, 7);
+        }
+        return `${Math.floor(key / 4) + 1970}-Q${((key % 4) + 4) % 4 + 1}`;
+    }
+
+    function chooseGranularity(bundle, nDays, granularity) {
+        if (['day', 'week', 'month', 'quarter'].includes(granularity)) {
+            return granularity;
+        }
+        for (const [maxDays, finest] of bundle.trend.auto) {
+            if (nDays <= maxDays) {
+                return finest;
+            }
+        }
+        return 'quarter';
+    }
+
+    // numpy's pairwise summation, so that means match the server's to the last bit
+    function pairwiseSum(values, start, n) {
+        if (n < 8) {
+            let sum = -0.0;
+            for (let i = start; i < start + n; i++) {
+                sum += values[i];
+            }
+            return sum;
+        }
+        if (n <= 128) {
+            const r = [];
+            for (let j = 0; j < 8; j++) {
+                r.push(values[start + j]);
+            }
+            let i = 8;
+            for (; i < n - (n % 8); i += 8) {
+                for (let j = 0; j < 8; j++) {
+                    r[j] += values[start + i + j];
+                }
+            }
+            let sum = ((r[0] + r[1]) + (r[2] + r[3])) + ((r[4] + r[5]) + (r[6] + r[7]));
+            for (; i < n; i++) {
+                sum += values[start + i];
+            }
+            return sum;
+        }
+        let half = Math.floor(n / 2);
+        half -= half % 8;
+        return pairwiseSum(values, start, half) + pairwiseSum(values, start + half, n - half);
+    }
+
+    function mean(values, lo, hi) {
+        return (values[lo] + pairwiseSum(values, lo + 1, hi - lo - 1)) / (hi - lo);
+    }
+
+    // trends.lttb: positions of the nOut points Largest-Triangle-Three-Buckets keeps
+    function lttb(x, y, nOut) {
+        const n = x.length;
+        if (nOut >= n || nOut < 3) {
+            return x.map((_, i) => i);
+        }
+        const step = (n - 2) / (nOut - 2);
+        const edges = [];
+        for (let i = 0; i < nOut - 1; i++) {
+            edges.push(Math.trunc(i === nOut - 2 ? n - 1 : i * step + 1));
+        }
+        const kept = [0];
+        let previous = 0;
+        for (let i = 0; i < nOut - 2; i++) {
+            const lo = edges[i], hi = edges[i + 1];
+            const nextHi = i + 2 < edges.length ? edges[i + 2] : n;
+            const meanX = mean(x, hi, nextHi), meanY = mean(y, hi, nextHi);
+            let best = lo, bestArea = -1;
+            for (let j = lo; j < hi; j++) {
+                const area = Math.abs((x[previous] - meanX) * (y[j] - y[previous])
+                                      - (x[previous] - x[j]) * (meanY - y[previous]));
+                if (area > bestArea) {
+                    best = j;
+                    bestArea = area;
+                }
+            }
+            previous = best;
+            kept.push(best);
+        }
+        kept.push(n - 1);
+        return kept;
+    }
+
+    // trends.sales_trend: (granularity, labels, revenue) from revenue and rows per day
+    // startDay is the first day of the date range, or null without one
+    function salesTrend(bundle, firstDay, cents, rows, granularity, startDay) {
+        let first = -1, last = -1;
+        for (let i = 0; i < rows.length; i++) {
+            if (rows[i] > 0) {
+                if (first < 0) {
+                    first = i;
+                }
+                last = i;
+            }
+        }
+        granularity = chooseGranularity(bundle, first < 0 ? 0 : last - first + 1, granularity);
+
+        let keys = [], sums = [];
+        let key = null, sum = 0, count = 0;
+        for (let i = 0; i <= rows.length; i++) {
+            const next = i < rows.length ? bucketKey(firstDay + i, granularity) : null;
+            if (next !== key) {
+                if (key !== null && count > 0) {
+                    keys.push(key);
+                    sums.push(sum);
+                }
+                key = next;
+                sum = 0;
+                count = 0;
+            }
+            if (i < rows.length) {
+                sum += cents[i];
+                count += rows[i];
+            }
+        }
+        const maxPoints = bundle.trend.max_points;
+        if (maxPoints && keys.length > maxPoints) {
+            const kept = lttb(keys.map((k) => bucketStartDay(k, granularity)), sums, maxPoints);
+            keys = kept.map((i) => keys[i]);
+            sums = kept.map((i) => sums[i]);
+        }
+        return {granularity: granularity, x: keys.map((k) => bucketLabel(k, granularity, startDay)),
+                y: sums.map((c) => c / 100)};
+    }
+
+    function copy(value) {
+        // plotly.js may write to the figure it draws, and the skeletons are shared
+        return JSON.parse(JSON.stringify(value));
+    }
+
+    function figure(skeleton, arrays) {
+        const [trace, layout] = copy(skeleton);
+        return {data: [Object.assign(trace, arrays)], layout: layout};
+    }
+
+    function noData(bundle, height) {
+        return copy(bundle.figures.no_data[String(height)]);
+    }
+
+    function salesTimeGraph(startDate, endDate, regions, categories, dataVersion, granularity, bundle) {
+        if (!bundle) {
+            throw window.dash_clientside.PreventUpdate;
+        }
+        const selection = select(bundle, startDate, endDate, regions, categories);
+        if (selection.rows === 0) {
+            return noData(bundle, 350);
+        }
+        const {lo, hi} = selection.range;
+        const {day, cents, rows} = selection.data.buckets;
+        const dayCents = new Float64Array(hi - lo), dayRows = new Float64Array(hi - lo);
+        for (let b = 0; b < day.length; b++) {
+            if (selection.selected[b] && day[b] >= 0) {
+                dayCents[day[b] - lo] += cents[b];
+                dayRows[day[b] - lo] += rows[b];
+            }
+        }
+        const startDay = startDate && endDate ? dayNumber(startDate, false) : null;
+        const trend = salesTrend(bundle, bundle.first_day + lo, dayCents, dayRows, granularity, startDay);
+        const skeletons = bundle.figures.sales_time[trend.granularity];
+        return figure(skeletons[trend.x.length <= 1 ? 1 : 0], {x: trend.x, y: trend.y});
+    }
+
+    function categoryGraph(startDate, endDate, regions, categories, dataVersion, bundle) {
+        if (!bundle) {
+            throw window.dash_clientside.PreventUpdate;
+        }
+        const selection = select(bundle, startDate, endDate, regions, categories);
+        if (selection.rows === 0) {
+            return noData(bundle, 300);
+        }
+        const {category, cents} = selection.data.buckets;
+        const revenue = new Float64Array(bundle.categories.length);
+        const present = new Uint8Array(bundle.categories.length);
+        for (let b = 0; b < category.length; b++) {
+            if (selection.selected[b] && category[b] >= 0) {
+                revenue[category[b]] += cents[b];
+                present[category[b]] = 1;
+            }
+        }
+        const labels = [], values = [];
+        for (let c = 0; c < revenue.length; c++) {
+            if (present[c]) {
+                labels.push(bundle.categories[c]);
+                values.push(revenue[c] / 100);
+            }
+        }
+        return figure(bundle.figures.category, {labels: labels, values: values});
+    }
+
+    function ratingGraph(startDate, endDate, regions, categories, dataVersion, bundle) {
+        if (!bundle) {
+            throw window.dash_clientside.PreventUpdate;
+        }
+        const selection = select(bundle, startDate, endDate, regions, categories);
+        if (selection.rows === 0) {
+            return noData(bundle, 300);
+        }
+        const counts = ratingCounts(selection);
+        return figure(bundle.figures.rating, {x: counts.map((c) => c[0]), y: counts.map((c) => c[1])});
+    }
+
+    function topProductsGraph(startDate, endDate, regions, categories, dataVersion, bundle) {
+        if (!bundle) {
+            throw window.dash_clientside.PreventUpdate;
+        }
+        const selection = select(bundle, startDate, endDate, regions, categories);
+        if (selection.rows === 0) {
+            return noData(bundle, 450);
+        }
+        const {bucket, product, cents} = selection.data.productCents;
+        const revenue = new Float64Array(bundle.products.length);
+        const present = new Uint8Array(bundle.products.length);
+        for (let i = 0; i < bucket.length; i++) {
+            if (selection.selected[bucket[i]]) {
+                revenue[product[i]] += cents[i];
+                present[product[i]] = 1;
+            }
+        }
+        const candidates = [];
+        for (let p = 0; p < revenue.length; p++) {
+            if (present[p]) {
+                candidates.push(p);
+            }
+        }
+        // Highest revenue first; ties keep the order of the product names, like a stable sort
+        const top = candidates.sort((a, b) => revenue[b] - revenue[a] || a - b).slice(0, 10);
+        return figure(bundle.figures.top_products,
+                      {x: top.map((p) => revenue[p] / 100), y: top.map((p) => bundle.products[p])});
+    }
+
+    // urllib.parse.urlencode's quoting: spaces as +, and only letters, digits and _.-~ left as they are
+    function quotePlus(value) {
+        return encodeURIComponent(String(value))
+            .replace(/[!'()*]/g, (c) => '%' + c.charCodeAt(0).toString(16).toUpperCase())
+            .replace(/%20/g, '+');
+    }
+
+    function exportLink(startDate, endDate, regions, categories, useGzip, dataVersion, bundle) {
+        if (!bundle) {
+            throw window.dash_clientside.PreventUpdate;
+        }
+        const selection = select(bundle, startDate, endDate, regions, categories);
+        const params = [['start_date', startDate || ''], ['end_date', endDate || '']];
+        for (const region of regions || []) {
+            params.push(['region', region]);
+        }
+        for (const category of categories || []) {
+            params.push(['category', category]);
+        }
+        if (useGzip) {
+            params.push(['gzip', 1]);
+        }
+        const query = params.map(([name, value]) => quotePlus(name) + '=' + quotePlus(value)).join('&');
+        return [bundle.export_path + '?' + query, selection.rows === 0,
+                formatNumber(selection.rows, 0) + ' matching rows'];
+    }
+
+    const swiftshop = {
+        kpis: kpis,
+        salesTimeGraph: salesTimeGraph,
+        categoryGraph: categoryGraph,
+        ratingGraph: ratingGraph,
+        topProductsGraph: topProductsGraph,
+        exportLink: exportLink,
+    };
+
+    if (typeof window !== 'undefined') {
+        window.dash_clientside = Object.assign({}, window.dash_clientside, {swiftshop: swiftshop});
+    }
+    if (typeof module !== 'undefined') {
+        // For checking the results against the server's (benchmarks/bench_clientside.py)
+        module.exports = swiftshop;
+    }
+})();
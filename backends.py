@@ -0,0 +1,69 @@
+import os
+
+from export import iter_csv_chunks
+from sketches import APPROXIMATE
+from table_query import query_rows, table_page
+
+# Data backends of the dashboard.
+#
+# The callbacks and routes talk to the loaded data only through these
+# methods, so where the rows live is decided once at startup:
+#
+#   select(start, end, regions, categories)  aggregates for the KPIs and charts
+#                                           (empty, row_count, total_revenue,
+#                                           avg_order_value, avg_rating, sales_trend,
+#                                           category_revenue, rating_counts, top_products)
+#   count(start, end, regions, categories)   number of matching rows
+#   distinct_customers(start, end, regions, categories)
+#   table_page(filters, conditions, sort_by, page_current, page_size, columns)
+#   iter_csv(start, end, regions, categories)
+#                                           (CSV text, rows in it) pairs, header first
+#   filter_values()                          regions, categories, (first, last) date
+#   columns, data_version
+#
+# Implementations: SalesSnapshot (pandas, everything in memory, below),
+# ingest.ChunkedSalesData (pandas, the cube in memory and the rows read from
+# the CSV again) and sqlite_backend.SqliteSalesStore (one SQLite file the
+# filters and aggregations are pushed down to, shared by all workers).
+
+# 'pandas' (in memory, or chunked per SWIFTSHOP_INGEST_MODE) or 'sqlite'
+BACKEND = os.environ.get('SWIFTSHOP_BACKEND', 'pandas')
+
+
+class SalesSnapshot:
+    """One consistent version of the data loaded in memory."""
+
+    def __init__(self, df, cube, row_filter, data_version):
+        self.df = df
+        self.cube = cube
+        self.row_filter = row_filter
+        self.data_version = data_version
+
+    @property
+    def columns(self):
+        return list(self.df.columns)
+
+    def select(self, start_date=None, end_date=None, selected_regions=None, selected_categories=None):
+        """Cube cells matching the dashboard filters."""
+        return self.cube.select(start_date, end_date, selected_regions, selected_categories)
+
+    def count(self, start_date=None, end_date=None, selected_regions=None, selected_categories=None):
+        return self.cube.count(start_date, end_date, selected_regions, selected_categories)
+
+    def distinct_customers(self, start_date=None, end_date=None, selected_regions=None, selected_categories=None):
+        """Number of distinct customer_ids in the matching rows, estimated in approximate mode."""
+        if APPROXIMATE:
+            return self.select(start_date, end_date, selected_regions, selected_categories).distinct_customers()
+        rows = self.row_filter.select(start_date, end_date, selected_regions, selected_categories)
+        return self.df['customer_id'].iloc[rows].nunique()
+
+    def filter_values(self):
+        return self.cube.filter_values()
+
+    def table_page(self, filters, conditions, sort_by, page_current, page_size, columns=None):
+        rows = query_rows(self.df, conditions, self.row_filter.select(*filters))
+        return table_page(self.df, rows, sort_by, page_current, page_size, columns=columns)
+
+    def iter_csv(self, start_date=None, end_date=None, selected_regions=None, selected_categories=None):
+        rows = self.row_filter.select(start_date, end_date, selected_regions, selected_categories)
+        return iter_csv_chunks(self.df, rows)
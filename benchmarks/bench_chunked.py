@@ -0,0 +1,113 @@
+"""Compare peak memory and load time of the in-memory and chunked ingestion.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_chunked --sizes 1000000 5000000 --chunk-rows 250000
+
+Every load runs in its own process, so the peak RSS of one does not hide
+the other. With --check the cube built from chunks is also compared with
+the one built from the whole frame (this loads the data in memory).
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import pandas as pd
+import psutil
+
+from aggregates import SalesCube
+from benchmarks.synthetic import write_sales_csv
+from data_processing import clean_sales_data
+from ingest import ChunkedSalesData
+
+
+class PeakRSS:
+    """Samples this process's RSS in a background thread and keeps the maximum."""
+
+    def __init__(self, interval=0.01):
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        process = psutil.Process()
+        while not self._stop.is_set():
+            self.peak = max(self.peak, process.memory_info().rss)
+            time.sleep(self.interval)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, psutil.Process().memory_info().rss)
+
+
+def load(mode, path, chunk_rows):
+    if mode == 'chunked':
+        return ChunkedSalesData.load(path, chunk_rows).cube
+    return SalesCube.from_frame(clean_sales_data(pd.read_csv(path)))
+
+
+def worker(mode, path, chunk_rows):
+    """Load once and print the measurements as JSON (runs in a child process)."""
+    start = time.perf_counter()
+    with PeakRSS() as rss:
+        cube = load(mode, path, chunk_rows)
+    print(json.dumps({'seconds': time.perf_counter() - start,
+                      'peak_rss_mb': rss.peak / 1024 ** 2,
+                      'cells': len(cube)}))
+
+
+def measure(mode, path, chunk_rows):
+    output = subprocess.run(
+        [sys.executable, '-m', 'benchmarks.bench_chunked', '--worker', mode, path, str(chunk_rows)],
+        check=True, capture_output=True, text=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def same_cube(path, chunk_rows):
+    full = load('memory', path, chunk_rows)
+    chunked = load('chunked', path, chunk_rows)
+    filters = (None, None, None, None)
+    return (full.cells.astype(str).equals(chunked.cells.astype(str))
+            and full.distinct_orders(full.select(*filters).mask)
+            == chunked.distinct_orders(chunked.select(*filters).mask))
+
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == '--worker':
+        mode, path, chunk_rows = sys.argv[2], sys.argv[3], int(sys.argv[4])
+        worker(mode, path, chunk_rows)
+        return
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1_000_000])
+    parser.add_argument('--chunk-rows', type=int, default=250_000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--check', action='store_true')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for n_rows in args.sizes:
+            path = os.path.join(tmp, f"sales_{n_rows}.csv")
+            write_sales_csv(path, n_rows, seed=args.seed)
+            print(f"{n_rows:,} rows ({os.path.getsize(path) / 1024 ** 2:,.0f} MB CSV)")
+            print(f"  {'mode':<8} {'load (s)':>9} {'peak RSS (MB)':>14} {'cells':>10}")
+            for mode in ('memory', 'chunked'):
+                result = measure(mode, path, args.chunk_rows)
+                print(f"  {mode:<8} {result['seconds']:>9.2f} {result['peak_rss_mb']:>14,.0f} {result['cells']:>10,}")
+            if args.check:
+                print(f"  identical cube: {same_cube(path, args.chunk_rows)}")
+
+
+if __name__ == '__main__':
+    main()
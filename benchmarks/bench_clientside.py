@@ -0,0 +1,186 @@
+"""Measure the clientside mode's bundle and check its results against the server callbacks.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_clientside --rows 1000000
+
+Builds the bundle clientside.py sends to the browser from synthetic data
+and reports its size, plain and gzipped, and how long it takes to build.
+If Node.js is installed, assets/clientside.js is run on the bundle for the
+filters of bench_dashboard.py (plus a few more) and every trend
+granularity; its KPIs, figures and export links must equal what the
+server callbacks return. Unique customers are estimated differently (see
+clientside.py), so their error against the exact count is listed instead.
+Times are the median per filter change: all outputs computed in Node.js,
+and the same outputs computed by the server (without the request).
+"""
+import argparse
+import base64
+import gzip
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+from urllib.parse import urlencode
+
+import numpy as np
+from plotly.io.json import to_json_plotly
+
+from aggregates import CubeBuilder
+from benchmarks.bench_cube import NULL_ORDER_RATE
+from benchmarks.bench_dashboard import FILTERS
+from benchmarks.synthetic import generate_sales_data
+from clientside import client_bundle
+from data_processing import clean_sales_data
+from figures import (TYPED_ARRAY_DTYPES, fast_category_figure, fast_rating_figure, fast_sales_time_figure,
+                     fast_top_products_figure, no_data_figure)
+from filters import FilterEngine
+from trends import GRANULARITIES
+
+CHECK_FILTERS = FILTERS + [
+    ('one day', ('2024-05-17', '2024-05-17', None, None)),
+    ('two categories', (None, None, None, ['Clothing', 'Electronics'])),
+    ('reversed dates', ('2024-05-31', '2024-05-01', None, None)),
+    ('times of day', ('2024-03-03T12:00:00', '2024-07-19T08:00:00', None, ['Home Goods'])),
+]
+
+EXPORT_PATH = '/export.csv'
+
+NODE_SCRIPT = r"""
+const fs = require('fs');
+const swiftshop = require(process.argv[1]);
+const {bundle, cases, repeat} = JSON.parse(fs.readFileSync(process.argv[2]));
+const run = ([filters, granularity]) => ({
+    kpis: swiftshop.kpis(...filters, null, bundle),
+    sales_time: swiftshop.salesTimeGraph(...filters, null, granularity, bundle),
+    category: swiftshop.categoryGraph(...filters, null, bundle),
+    rating: swiftshop.ratingGraph(...filters, null, bundle),
+    top_products: swiftshop.topProductsGraph(...filters, null, bundle),
+    export_link: swiftshop.exportLink(...filters, false, null, bundle),
+});
+let start = process.hrtime.bigint();
+run(cases[0]);  // decodes the bundle
+const decodeMs = Number(process.hrtime.bigint() - start) / 1e6;
+const results = [], durations = [];
+for (const c of cases) {
+    results.push(run(c));
+    for (let i = 0; i < repeat; i++) {
+        start = process.hrtime.bigint();
+        run(c);
+        durations.push(Number(process.hrtime.bigint() - start) / 1e6);
+    }
+}
+durations.sort((a, b) => a - b);
+console.log(JSON.stringify({results, decodeMs, medianMs: durations[Math.floor(durations.length / 2)]}));
+"""
+
+
+def plain(value):
+    """value as JSON would carry it, with typed arrays turned into lists."""
+    value = json.loads(to_json_plotly(value))
+    dtypes = {short: np.dtype(name) for name, short in TYPED_ARRAY_DTYPES.items()}
+
+    def walk(item):
+        if isinstance(item, dict):
+            if set(item) == {'dtype', 'bdata'}:
+                return np.frombuffer(base64.b64decode(item['bdata']), dtype=dtypes[item['dtype']]).tolist()
+            return {key: walk(v) for key, v in item.items()}
+        if isinstance(item, list):
+            return [walk(v) for v in item]
+        return item
+    return walk(value)
+
+
+def server_outputs(cube, filters, granularity):
+    """The server callbacks' results for one filter change, as in app.py (exact mode)."""
+    selection = cube.select(*filters)
+    n_rows = cube.count(*filters)
+    params = {'start_date': filters[0] or '', 'end_date': filters[1] or '',
+              'region': filters[2] or [], 'category': filters[3] or []}
+    export_link = [EXPORT_PATH + '?' + urlencode(params, doseq=True), n_rows == 0, f"{n_rows:,} matching rows"]
+    if selection.empty:
+        return {'kpis': ["$0.00", "$0.00", "0", "N/A"], 'sales_time': no_data_figure(350),
+                'category': no_data_figure(300), 'rating': no_data_figure(300),
+                'top_products': no_data_figure(450), 'export_link': export_link}
+    mean_rating = selection.avg_rating()
+    kpis = [f"${selection.total_revenue():,.2f}", f"${selection.avg_order_value():,.2f}", "unique customers",
+            f"{mean_rating:.1f}/5.0" if mean_rating is not None else "N/A"]
+    granularity, trend = selection.sales_trend(granularity)
+    return {'kpis': kpis,
+            'sales_time': fast_sales_time_figure(trend, granularity),
+            'category': fast_category_figure(selection.category_revenue()),
+            'rating': fast_rating_figure(selection.rating_counts()),
+            'top_products': fast_top_products_figure(selection.top_products(10, approximate=False)),
+            'export_link': export_link}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=1_000_000)
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    # Some rows without an order_id, which the average order value leaves out
+    df = clean_sales_data(generate_sales_data(args.rows, seed=args.seed, null_rates={'order_id': NULL_ORDER_RATE}))
+    # The bundle needs the customer sketch, whatever SWIFTSHOP_CLIENTSIDE says
+    builder = CubeBuilder(customer_sketch=True)
+    builder.add(df, df['order_id'].duplicated(keep=False).to_numpy())
+    cube = builder.build()
+    start = time.perf_counter()
+    bundle = client_bundle(cube, 'bench', EXPORT_PATH)
+    build_s = time.perf_counter() - start
+    data = to_json_plotly(bundle).encode()
+    print(f"{args.rows:,} rows, {len(cube):,} cells: bundle of {len(data) / 1024:,.0f} KB "
+          f"({len(gzip.compress(data, 6)) / 1024:,.0f} KB gzipped), built in {build_s:.2f}s")
+
+    cases = [(label, list(filters), granularity) for label, filters in CHECK_FILTERS
+             for granularity in ['auto'] + GRANULARITIES]
+    durations = []
+    expected = []
+    for _, filters, granularity in cases:
+        start = time.perf_counter()
+        expected.append(server_outputs(cube, filters, granularity))
+        durations.append(time.perf_counter() - start)
+    print(f"  server: {np.median(durations) * 1000:.2f} ms per filter change (median, all outputs)")
+
+    node = shutil.which('node')
+    if node is None:
+        print("  Node.js is not installed; the browser side was not checked")
+        return
+    script = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'assets', 'clientside.js')
+    with tempfile.TemporaryDirectory() as tmp:
+        with open(os.path.join(tmp, 'input.json'), 'wb') as f:
+            f.write(to_json_plotly({'bundle': bundle, 'repeat': args.repeat,
+                                    'cases': [[filters, granularity] for _, filters, granularity in cases]}).encode())
+        output = subprocess.run([node, '-e', NODE_SCRIPT, script, os.path.join(tmp, 'input.json')],
+                                check=True, stdout=subprocess.PIPE, text=True).stdout
+    result = json.loads(output)
+    print(f"  browser (Node.js): bundle decoded in {result['decodeMs']:.1f} ms, "
+          f"{result['medianMs']:.2f} ms per filter change (median, all outputs)")
+
+    mismatches = 0
+    row_filter = FilterEngine(df)
+    for (label, filters, granularity), server, client in zip(cases, expected, result['results']):
+        for output, value in server.items():
+            client_value = client[output]
+            if output == 'kpis':
+                # Unique customers are compared with the exact count below
+                value, client_value = value[:2] + value[3:], client_value[:2] + client_value[3:]
+            if plain(value) != client_value:
+                mismatches += 1
+                print(f"  MISMATCH {label} ({granularity}) {output}:\n    server {plain(value)}\n"
+                      f"    client {client_value}")
+        if granularity == 'auto':
+            exact = df['customer_id'].iloc[row_filter.select(*filters)].nunique()
+            estimate = float(client['kpis'][2].lstrip('~').replace(',', ''))
+            error = f"{estimate / exact - 1:+.1%}" if exact else 'n/a'
+            print(f"  {label:<36} unique customers {exact:>9,} exact, {client['kpis'][2]:>9} estimated ({error})")
+    print(f"  {len(cases)} filter changes checked: "
+          + ("all outputs match the server's" if not mismatches else f"{mismatches} mismatches"))
+
+
+if __name__ == '__main__':
+    main()
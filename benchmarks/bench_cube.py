@@ -0,0 +1,124 @@
+"""Check the aggregate cube against the raw row scan and time both.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_cube --sizes 100000 1000000
+
+About 1% of the rows have no order_id, which the average order value
+must leave out the way the row scan's groupby('order_id') does.
+"""
+import argparse
+import time
+
+import numpy as np
+
+from aggregates import SalesCube
+from benchmarks.synthetic import generate_sales_data
+from data_processing import clean_sales_data
+
+FILTERS = [
+    (None, None, None, None),
+    ('2024-03-01', '2024-09-30', ['North', 'East'], None),
+    ('2024-01-01', '2025-06-30', None, ['Electronics']),
+    ('2024-05-01', '2024-05-31', ['South'], ['Clothing', 'Home Goods']),
+    ('2025-01-01', '2025-01-01', ['West'], ['Electronics']),
+]
+
+# Share of rows without an order_id
+NULL_ORDER_RATE = 0.01
+
+
+def raw_aggregates(df, start_date, end_date, regions, categories):
+    """The row-level computation update_dashboard did before the cube."""
+    filtered_df = df
+    if start_date and end_date:
+        filtered_df = filtered_df[(filtered_df['order_date'] >= start_date) &
+                                  (filtered_df['order_date'] <= end_date)]
+    if regions:
+        filtered_df = filtered_df[filtered_df['customer_region'].isin(regions)]
+    if categories:
+        filtered_df = filtered_df[filtered_df['category'].isin(categories)]
+    if filtered_df.empty:
+        return None
+
+    rating_df = filtered_df[filtered_df['customer_rating'] > 0]
+    sales_by_month = filtered_df.groupby('month_year')['total_amount'].sum().sort_index()
+    return {
+        'total_sales': f"${filtered_df['total_amount'].sum():,.2f}",
+        'avg_order_value': f"${filtered_df.groupby('order_id')['total_amount'].sum().mean():,.2f}",
+        'avg_rating': f"{rating_df['customer_rating'].mean():.1f}/5.0" if not rating_df.empty else "N/A",
+        'sales_by_month': dict(zip(sales_by_month.index.astype(str), sales_by_month.to_numpy())),
+        'category': filtered_df.groupby('category', observed=True)['total_amount'].sum().to_dict(),
+        'ratings': rating_df['customer_rating'].value_counts().sort_index().to_dict(),
+        'top_products': filtered_df.groupby('product_name', observed=True)['total_amount'].sum()
+                                   .sort_values(ascending=False).head(10).to_dict(),
+    }
+
+
+def cube_aggregates(cube, start_date, end_date, regions, categories):
+    selection = cube.select(start_date, end_date, regions, categories)
+    if selection.empty:
+        return None
+
+    mean_rating = selection.avg_rating()
+    sales_by_month = selection.sales_by_month()
+    return {
+        'total_sales': f"${selection.total_revenue():,.2f}",
+        'avg_order_value': f"${selection.avg_order_value():,.2f}",
+        'avg_rating': f"{mean_rating:.1f}/5.0" if mean_rating is not None else "N/A",
+        'sales_by_month': dict(zip(sales_by_month['month_year'], sales_by_month['total_amount'])),
+        'category': selection.category_revenue().set_index('category')['total_amount'].to_dict(),
+        'ratings': selection.rating_counts().to_dict(),
+        'top_products': selection.top_products(10).set_index('product_name')['total_amount'].to_dict(),
+    }
+
+
+def same_amounts(raw, cube):
+    """Equal keys and equal amounts once the row-level float sums are rounded to the cent."""
+    return raw.keys() == cube.keys() and all(np.round(raw[k], 2) == cube[k] for k in raw)
+
+
+def matches(raw, cube):
+    if raw is None or cube is None:
+        return raw is cube
+    # Products tied on revenue may be cut at different places of the top 10
+    top_raw, top_cube = raw['top_products'], cube['top_products']
+    cutoff = min(top_cube.values())
+    top_ok = all(np.round(v, 2) == top_cube.get(k, cutoff) for k, v in top_raw.items())
+    return (all(raw[k] == cube[k] for k in ('total_sales', 'avg_order_value', 'avg_rating', 'ratings'))
+            and same_amounts(raw['sales_by_month'], cube['sales_by_month'])
+            and same_amounts(raw['category'], cube['category'])
+            and top_ok)
+
+
+def mean_time(func, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = func()
+    return result, (time.perf_counter() - start) / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100_000, 1_000_000])
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    for n_rows in args.sizes:
+        df = clean_sales_data(generate_sales_data(n_rows, seed=args.seed, null_rates={'order_id': NULL_ORDER_RATE}))
+        start = time.perf_counter()
+        cube = SalesCube.from_frame(df)
+        build_time = time.perf_counter() - start
+        print(f"{n_rows:,} rows -> {len(cube):,} cells (built in {build_time:.2f}s)")
+        print(f"  {'filter':<55} {'raw (ms)':>9} {'cube (ms)':>10}  identical")
+
+        for filters in FILTERS:
+            raw, raw_time = mean_time(lambda: raw_aggregates(df, *filters), args.repeat)
+            fast, cube_time = mean_time(lambda: cube_aggregates(cube, *filters), args.repeat)
+            label = ' '.join(str(f) for f in filters)
+            print(f"  {label[:55]:<55} {raw_time * 1000:>9.1f} {cube_time * 1000:>10.1f}  {matches(raw, fast)}")
+
+
+if __name__ == '__main__':
+    main()
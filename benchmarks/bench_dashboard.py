@@ -0,0 +1,274 @@
+"""Benchmark the dashboard end to end on synthetic data and write the results as JSON.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_dashboard --rows 10000 1000000 --output results.json
+    python -m benchmarks.bench_dashboard --rows 1000000 --baseline results.json
+
+For every size a CSV is generated (see synthetic.py) and app.py is started
+twice in a fresh process, without a browser or a server. The first start
+parses the CSV (cold); the second loads from the dataset cache it left
+(warm) and then calls every dashboard callback through Dash's HTTP endpoint
+with the Flask test client, for each of FILTERS: --repeat times with the
+result caches emptied first (uncached) and --repeat times with them filled
+(cached). Response sizes are the serialized figures and table pages the
+browser would download. Last, the export of all rows is streamed, plain
+and gzipped.
+
+Settings such as SWIFTSHOP_BACKEND=sqlite are passed with --env. With
+--baseline, metrics that changed by more than --threshold are listed.
+"""
+import argparse
+import contextlib
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from urllib.parse import urlencode
+
+import numpy as np
+import psutil
+
+from benchmarks.bench_chunked import PeakRSS
+from benchmarks.synthetic import write_sales_csv
+
+# (label, (start_date, end_date, regions, categories)), within the generated dates
+FILTERS = [
+    ('all data', (None, None, None, None)),
+    ('one year, two regions', ('2024-03-01', '2025-02-28', ['North', 'East'], None)),
+    ('one month, one region and category', ('2024-05-01', '2024-05-31', ['South'], ['Clothing'])),
+    ('no match', ('2024-05-01', '2024-05-31', ['Nowhere'], None)),
+]
+
+# Values of the callback inputs other than the filters
+OTHER_INPUTS = {
+    'data-table.page_current': 0,
+    'data-table.page_size': 10,
+    'data-table.sort_by': [{'column_id': 'total_amount', 'direction': 'desc'}],
+    'data-table.filter_query': '',
+    'export-gzip.value': False,
+}
+
+
+def percentile_ms(durations, q):
+    return float(np.percentile(durations, q) * 1000)
+
+
+def callback_requests(app_module):
+    """(name, output key, outputs, input props) of every callback driven by the filters.
+
+    A callback is named after its first output's id. Clientside callbacks
+    (SWIFTSHOP_CLIENTSIDE) run in the browser and are left out.
+    """
+    requests = []
+    for key, callback in app_module.app.callback_map.items():
+        if 'callback' not in callback:
+            continue
+        props = [f"{i['id']}.{i['property']}" for i in callback['inputs']]
+        if 'region-dropdown.value' not in props:
+            continue
+        outputs = [{'id': o.split('.')[0], 'property': o.split('.')[1]}
+                   for o in key.strip('.').split('...')]
+        requests.append((outputs[0]['id'], key, outputs if key.startswith('..') else outputs[0], props))
+    return requests
+
+
+def request_body(app_module, key, outputs, props, filters):
+    start_date, end_date, regions, categories = filters
+    values = {
+        **OTHER_INPUTS,
+        'date-range.start_date': start_date,
+        'date-range.end_date': end_date,
+        'region-dropdown.value': regions,
+        'category-dropdown.value': categories,
+        'data-version.data': {'version': app_module.sales.data_version},
+        'trend-granularity.value': app_module.TREND_GRANULARITY,
+    }
+    inputs = [{'id': p.split('.')[0], 'property': p.split('.')[1], 'value': values[p]} for p in props]
+    return {'output': key, 'outputs': outputs, 'inputs': inputs, 'state': [],
+            'changedPropIds': ['region-dropdown.value']}
+
+
+def time_callbacks(app_module, client, repeat):
+    results = {}
+    for name, key, outputs, props in callback_requests(app_module):
+        results[name] = {}
+        for label, filters in FILTERS:
+            body = request_body(app_module, key, outputs, props, filters)
+            measured = {}
+            for cached in (False, True):
+                durations = []
+                for _ in range(repeat):
+                    if not cached:
+                        app_module.dashboard_cache.invalidate()
+                        app_module.selection_cache.invalidate()
+                    start = time.perf_counter()
+                    response = client.post('/_dash-update-component', json=body)
+                    durations.append(time.perf_counter() - start)
+                    if response.status_code not in (200, 204):
+                        raise RuntimeError(f"{name} returned {response.status_code}: {response.data[:200]}")
+                prefix = 'cached' if cached else 'uncached'
+                measured[f'{prefix}_p50_ms'] = percentile_ms(durations, 50)
+                measured[f'{prefix}_p99_ms'] = percentile_ms(durations, 99)
+            measured['response_bytes'] = len(response.data)
+            results[name][label] = measured
+    return results
+
+
+def time_export(client, use_gzip):
+    query = urlencode({'gzip': 1}) if use_gzip else ''
+    start = time.perf_counter()
+    response = client.get(f'/export.csv?{query}', buffered=False)
+    n_bytes = 0
+    for chunk in response.response:
+        n_bytes += len(chunk)
+    response.close()
+    seconds = time.perf_counter() - start
+    n_rows = int(response.headers['X-Row-Count'])
+    return {'rows': n_rows, 'bytes': n_bytes, 'seconds': seconds,
+            'mb_per_s': n_bytes / 1024 ** 2 / seconds, 'rows_per_s': n_rows / seconds}
+
+
+def worker(full, repeat):
+    """Start the app, measure and print the results as JSON (runs in a child process)."""
+    start = time.perf_counter()
+    # stdout carries only the result
+    with contextlib.redirect_stdout(sys.stderr):
+        import dash, dash_bootstrap_components, pandas, plotly  # noqa: F401  (not part of the load time)
+        imports_s = time.perf_counter() - start
+        with PeakRSS() as load_rss:
+            start = time.perf_counter()
+            import app as app_module
+            # With SWIFTSHOP_LAZY_STARTUP the data is still loading in the background
+            while app_module.sales is None and app_module.loader.status == 'loading':
+                time.sleep(0.01)
+            load_s = time.perf_counter() - start
+        result = {'imports_s': imports_s, 'load_s': load_s, 'load_peak_rss_mb': load_rss.peak / 1024 ** 2}
+        if full:
+            client = app_module.server.test_client()
+            with PeakRSS() as rss:
+                result['callbacks'] = time_callbacks(app_module, client, repeat)
+                result['export'] = {'plain': time_export(client, False), 'gzip': time_export(client, True)}
+            result['peak_rss_mb'] = max(rss.peak, load_rss.peak) / 1024 ** 2
+    print(json.dumps(result), flush=True)
+
+
+def run_worker(full, repeat, env):
+    output = subprocess.run(
+        [sys.executable, '-m', 'benchmarks.bench_dashboard', '--worker', str(int(full)), str(repeat)],
+        check=True, stdout=subprocess.PIPE, env=env, text=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def measure(path, cache_dir, repeat, extra_env):
+    env = {**os.environ, 'SWIFTSHOP_DATA_FILE': path, 'SWIFTSHOP_CACHE_DIR': cache_dir,
+           'SWIFTSHOP_LIVE_REFRESH_SECONDS': '0', **extra_env}
+    cold = run_worker(False, repeat, env)
+    warm = run_worker(True, repeat, env)
+    warm['load'] = {'cold_s': cold['load_s'], 'cold_peak_rss_mb': cold['load_peak_rss_mb'],
+                    'warm_s': warm.pop('load_s'), 'warm_peak_rss_mb': warm.pop('load_peak_rss_mb'),
+                    'imports_s': warm.pop('imports_s')}
+    return warm
+
+
+def metadata(args, extra_env):
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True).stdout.strip()
+    except OSError:
+        commit = ''
+    return {
+        'timestamp': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'git_commit': commit or None,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'memory_gb': psutil.virtual_memory().total / 1024 ** 3,
+        'env': extra_env,
+        'args': vars(args),
+    }
+
+
+def flatten(value, prefix=''):
+    """{'a.b.c': number} of every number in nested dicts."""
+    if isinstance(value, dict):
+        flat = {}
+        for key, item in value.items():
+            flat.update(flatten(item, f"{prefix}.{key}" if prefix else str(key)))
+        return flat
+    return {prefix: value} if isinstance(value, (int, float)) and not isinstance(value, bool) else {}
+
+
+def compare(results, baseline, threshold):
+    current = {f"{r['rows']} rows.{k}": v for r in results for k, v in flatten(r).items()}
+    previous = {f"{r['rows']} rows.{k}": v for r in baseline['results'] for k, v in flatten(r).items()}
+    print(f"\nChanges of more than {threshold:.0%} against the baseline from {baseline['meta']['timestamp']}:")
+    changed = 0
+    for key in sorted(current.keys() & previous.keys()):
+        if previous[key] and abs(current[key] / previous[key] - 1) > threshold:
+            print(f"  {key}: {previous[key]:,.3f} -> {current[key]:,.3f} ({current[key] / previous[key] - 1:+.0%})")
+            changed += 1
+    if not changed:
+        print("  none")
+
+
+def print_result(result):
+    load = result['load']
+    print(f"{result['rows']:,} rows ({result['csv_mb']:,.0f} MB CSV): "
+          f"load cold {load['cold_s']:.2f}s, warm {load['warm_s']:.2f}s, "
+          f"peak RSS {result['peak_rss_mb']:,.0f} MB")
+    print(f"  {'callback':<20} {'filters':<36} {'p50 (ms)':>9} {'p99 (ms)':>9} {'cached':>7} {'bytes':>10}")
+    for name, by_filter in result['callbacks'].items():
+        for label, m in by_filter.items():
+            print(f"  {name:<20} {label:<36} {m['uncached_p50_ms']:>9.2f} {m['uncached_p99_ms']:>9.2f} "
+                  f"{m['cached_p50_ms']:>7.2f} {m['response_bytes']:>10,}")
+    for kind, m in result['export'].items():
+        print(f"  export ({kind}): {m['rows']:,} rows, {m['bytes'] / 1024 ** 2:,.1f} MB in {m['seconds']:.2f}s "
+              f"({m['mb_per_s']:,.1f} MB/s, {m['rows_per_s']:,.0f} rows/s)")
+
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == '--worker':
+        worker(sys.argv[2] == '1', int(sys.argv[3]))
+        return
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, nargs='+', default=[10_000, 100_000, 1_000_000])
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--env', nargs='*', default=[], metavar='NAME=VALUE',
+                        help="settings for the app, e.g. SWIFTSHOP_BACKEND=sqlite")
+    parser.add_argument('--data-dir', help="keep the generated CSVs here and reuse them in later runs")
+    parser.add_argument('--output', default='bench_dashboard.json')
+    parser.add_argument('--baseline', help="results of an earlier run to compare with")
+    parser.add_argument('--threshold', type=float, default=0.1)
+    args = parser.parse_args()
+    extra_env = dict(setting.split('=', 1) for setting in args.env)
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        data_dir = args.data_dir or tmp
+        os.makedirs(data_dir, exist_ok=True)
+        for n_rows in args.rows:
+            path = os.path.join(data_dir, f'sales_{n_rows}_{args.seed}.csv')
+            if not os.path.exists(path):
+                write_sales_csv(path, n_rows, seed=args.seed)
+            result = {'rows': n_rows, 'csv_mb': os.path.getsize(path) / 1024 ** 2,
+                      **measure(path, os.path.join(tmp, f'cache_{n_rows}'), args.repeat, extra_env)}
+            print_result(result)
+            results.append(result)
+
+    with open(args.output, 'w') as f:
+        json.dump({'meta': metadata(args, extra_env), 'results': results}, f, indent=2)
+    print(f"Results written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            compare(results, json.load(f), args.threshold)
+
+
+if __name__ == '__main__':
+    main()
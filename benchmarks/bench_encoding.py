@@ -0,0 +1,91 @@
+"""Compare the size and encoding time of the callback responses before and after the fast path.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_encoding --rows 1000000 --page-size 100
+
+Before: charts built with Plotly Express, table records with Timestamps,
+encoded with plotly's json engine and sent uncompressed. After: the fast
+figures (see figures.py) and plain table records, encoded with orjson
+(which Dash uses when it is installed), and compressed the way
+compression.py does for a browser accepting gzip (and Brotli, if
+installed). Sizes are the bytes sent; times the median per response.
+"""
+import argparse
+import time
+
+import numpy as np
+from plotly.io.json import to_json_plotly
+
+import compression
+from aggregates import SalesCube
+from benchmarks.synthetic import generate_sales_data
+from data_processing import clean_sales_data
+from figures import (category_figure, fast_category_figure, fast_rating_figure, fast_sales_time_figure,
+                     fast_top_products_figure, rating_figure, sales_time_figure, top_products_figure)
+from table_query import page_records
+
+TABLE_COLUMNS = ['order_id', 'order_date', 'customer_id', 'customer_region', 'product_name',
+                 'category', 'unit_price', 'quantity', 'total_amount', 'payment_method', 'customer_rating']
+
+
+def median_ms(function, repeat):
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        durations.append(time.perf_counter() - start)
+    return np.median(durations) * 1000, result
+
+
+def response(output_id, prop, value):
+    """A callback response the way Dash wraps it."""
+    return {'multi': True, 'response': {output_id: {prop: value}}}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=1_000_000)
+    parser.add_argument('--page-size', type=int, default=100)
+    parser.add_argument('--repeat', type=int, default=50)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    df = clean_sales_data(generate_sales_data(args.rows, seed=args.seed))
+    selection = SalesCube.from_frame(df).select()
+    granularity, trend = selection.sales_trend('day', max_points=None)
+    page = df[TABLE_COLUMNS].iloc[:args.page_size]
+    responses = [
+        (f'daily trend ({len(trend)} points)',
+         response('sales-time-graph', 'figure', sales_time_figure(trend, granularity)),
+         response('sales-time-graph', 'figure', fast_sales_time_figure(trend, granularity))),
+        ('categories',
+         response('category-performance', 'figure', category_figure(selection.category_revenue())),
+         response('category-performance', 'figure', fast_category_figure(selection.category_revenue()))),
+        ('ratings',
+         response('rating-distribution', 'figure', rating_figure(selection.rating_counts())),
+         response('rating-distribution', 'figure', fast_rating_figure(selection.rating_counts()))),
+        ('top products',
+         response('top-products', 'figure', top_products_figure(selection.top_products(10))),
+         response('top-products', 'figure', fast_top_products_figure(selection.top_products(10)))),
+        (f'table page ({args.page_size} rows)',
+         response('data-table', 'data', page.to_dict('records')),
+         response('data-table', 'data', page_records(page))),
+    ]
+
+    encodings = ['gzip'] + (['br'] if compression.brotli is not None else [])
+    print(f"{args.rows:,} rows; after = orjson + " + ' / '.join(encodings))
+    print(f"  {'response':<28} {'before (B)':>11} {'after (B)':>10} {'compressed (B)':>15} "
+          f"{'before (ms)':>12} {'after (ms)':>11} {'compress (ms)':>14}")
+    for label, before, after in responses:
+        before_ms, before_json = median_ms(lambda: to_json_plotly(before, engine='json'), args.repeat)
+        after_ms, after_json = median_ms(lambda: to_json_plotly(after), args.repeat)
+        data = after_json.encode()
+        compressed = [median_ms(lambda: compression.compress(data, encoding), args.repeat) for encoding in encodings]
+        print(f"  {label:<28} {len(before_json.encode()):>11,} {len(data):>10,} "
+              f"{' / '.join(f'{len(body):,}' for _, body in compressed):>15} "
+              f"{before_ms:>12.3f} {after_ms:>11.3f} {' / '.join(f'{ms:.3f}' for ms, _ in compressed):>14}")
+
+
+if __name__ == '__main__':
+    main()
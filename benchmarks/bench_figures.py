@@ -0,0 +1,70 @@
+"""Time building each dashboard figure with plotly.express and with the fast path.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_figures --rows 1000000 --repeat 50
+
+The chart inputs are computed once from the aggregate cube of a synthetic
+dataset, so only the figure construction (including the JSON encoding Dash
+does before sending it) is timed. "identical" compares the JSON plotly.js
+receives from both paths.
+"""
+import argparse
+import json
+import time
+
+import numpy as np
+from plotly.io.json import to_json_plotly
+
+import figures
+from aggregates import SalesCube
+from benchmarks.synthetic import generate_sales_data
+from data_processing import clean_sales_data
+
+CHARTS = [
+    ('sales_time', figures.sales_time_figure, figures.fast_sales_time_figure, 'sales_by_month'),
+    ('category', figures.category_figure, figures.fast_category_figure, 'category_revenue'),
+    ('rating', figures.rating_figure, figures.fast_rating_figure, 'rating_counts'),
+    ('top_products', figures.top_products_figure, figures.fast_top_products_figure, 'top_products'),
+]
+
+FILTERS = [
+    ('all data', (None, None, None, None)),
+    ('one month, one region', ('2024-05-01', '2024-05-31', ['South'], None)),
+]
+
+
+def percentiles(build, argument, repeat):
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        to_json_plotly(build(argument))
+        durations.append(time.perf_counter() - start)
+    durations = np.array(durations) * 1000
+    return np.percentile(durations, 50), np.percentile(durations, 99)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=1_000_000)
+    parser.add_argument('--repeat', type=int, default=50)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    cube = SalesCube.from_frame(clean_sales_data(generate_sales_data(args.rows, seed=args.seed)))
+    for label, filters in FILTERS:
+        selection = cube.select(*filters)
+        print(f"{label}: {len(selection.cells):,} cells")
+        print(f"  {'chart':<14} {'px p50':>8} {'px p99':>8} {'fast p50':>9} {'fast p99':>9} {'speedup':>8}  identical")
+        for name, slow, fast, method in CHARTS:
+            argument = getattr(selection, method)()
+            fast(argument)  # builds the skeleton, as the first dashboard request does
+            same = json.loads(to_json_plotly(slow(argument))) == json.loads(to_json_plotly(fast(argument)))
+            slow_p50, slow_p99 = percentiles(slow, argument, args.repeat)
+            fast_p50, fast_p99 = percentiles(fast, argument, args.repeat)
+            print(f"  {name:<14} {slow_p50:>8.2f} {slow_p99:>8.2f} {fast_p50:>9.3f} {fast_p99:>9.3f} "
+                  f"{slow_p50 / fast_p50:>7.0f}x  {same}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+"""Per-call latency of the shared filter engine versus the copy + boolean chain.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_filters --sizes 1000000 10000000
+"""
+import argparse
+import time
+
+import numpy as np
+
+from benchmarks.synthetic import generate_sales_data
+from data_processing import clean_sales_data
+from filters import FilterEngine
+
+FILTERS = [
+    ('2024-01-01T00:00:00', '2025-06-30T00:00:00', None, None),
+    ('2024-03-01', '2024-09-30', ['North', 'East'], None),
+    ('2024-01-01', '2025-06-30', None, ['Electronics']),
+    ('2024-05-01', '2024-05-31', ['South'], ['Clothing', 'Home Goods']),
+    (None, None, ['West'], None),
+]
+
+
+def chained_filter(df, start_date, end_date, selected_regions, selected_categories):
+    """The filtering both callbacks did before the engine."""
+    filtered_df = df.copy()
+    if start_date and end_date:
+        filtered_df = filtered_df[(filtered_df['order_date'] >= start_date) &
+                                  (filtered_df['order_date'] <= end_date)]
+    if selected_regions and len(selected_regions) > 0:
+        filtered_df = filtered_df[filtered_df['customer_region'].isin(selected_regions)]
+    if selected_categories and len(selected_categories) > 0:
+        filtered_df = filtered_df[filtered_df['category'].isin(selected_categories)]
+    return filtered_df
+
+
+def percentile_ms(func, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        times.append((time.perf_counter() - start) * 1000)
+    return result, np.percentile(times, 50), np.percentile(times, 99)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1_000_000, 10_000_000])
+    parser.add_argument('--repeat', type=int, default=10)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    for n_rows in args.sizes:
+        df = clean_sales_data(generate_sales_data(n_rows, seed=args.seed))
+        start = time.perf_counter()
+        engine = FilterEngine(df)
+        print(f"{n_rows:,} rows (engine built in {time.perf_counter() - start:.2f}s)")
+        print(f"  {'filter':<55} {'chain p50/p99 (ms)':>19} {'engine p50/p99 (ms)':>20}  identical")
+
+        for filters in FILTERS:
+            expected, chain_p50, chain_p99 = percentile_ms(lambda: chained_filter(df, *filters), args.repeat)
+            rows, engine_p50, engine_p99 = percentile_ms(lambda: engine.select(*filters), args.repeat)
+            identical = np.array_equal(rows, df.index.get_indexer(expected.index))
+            label = ' '.join(str(f) for f in filters)
+            print(f"  {label[:55]:<55} {chain_p50:>9.1f}/{chain_p99:<9.1f} {engine_p50:>9.1f}/{engine_p99:<10.1f}  {identical}")
+
+
+if __name__ == '__main__':
+    main()
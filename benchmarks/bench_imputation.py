@@ -0,0 +1,72 @@
+"""Compare the vectorized imputation against the original per-row loop.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_imputation --sizes 10000 1000000 10000000
+"""
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+from benchmarks.synthetic import generate_sales_data
+from data_processing import impute_customer_rating, impute_customer_region
+
+
+def legacy_impute(df):
+    """The loop load_data() used before the vectorized engine, kept as the reference."""
+    median_rating_by_product = df.groupby('product_id')['customer_rating'].median().apply(np.round)
+    for idx in df[df['customer_rating'].isna()].index:
+        product = df.loc[idx, 'product_id']
+        if product in median_rating_by_product and pd.notna(median_rating_by_product[product]):
+            df.loc[idx, 'customer_rating'] = median_rating_by_product[product]
+        else:
+            df.loc[idx, 'customer_rating'] = np.round(df['customer_rating'].median())
+
+    region_by_customer = df.groupby('customer_id')['customer_region'].agg(lambda x: x.mode()[0] if not x.mode().empty and pd.notna(x.mode()[0]) else np.nan)
+    for idx in df[df['customer_region'].isna()].index:
+        customer = df.loc[idx, 'customer_id']
+        if customer in region_by_customer and pd.notna(region_by_customer[customer]):
+            df.loc[idx, 'customer_region'] = region_by_customer[customer]
+        else:
+            df.loc[idx, 'customer_region'] = 'Unknown'
+    return df
+
+
+def vectorized_impute(df):
+    df = impute_customer_rating(df)
+    return impute_customer_region(df)
+
+
+def timed(func, df):
+    start = time.perf_counter()
+    result = func(df)
+    return result, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10_000, 1_000_000, 10_000_000])
+    parser.add_argument('--legacy-max-rows', type=int, default=1_000_000,
+                        help="skip the per-row loop above this size (it takes hours at 10M rows)")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    print(f"{'rows':>12} {'vectorized (s)':>15} {'legacy (s)':>12} {'speedup':>9}  identical")
+    for n_rows in args.sizes:
+        raw = generate_sales_data(n_rows, seed=args.seed)
+        fast, fast_time = timed(vectorized_impute, raw.copy())
+
+        if n_rows > args.legacy_max_rows:
+            print(f"{n_rows:>12,} {fast_time:>15.3f} {'skipped':>12} {'-':>9}  -")
+            continue
+
+        slow, slow_time = timed(legacy_impute, raw.copy())
+        identical = (fast['customer_rating'].equals(slow['customer_rating'])
+                     and fast['customer_region'].equals(slow['customer_region']))
+        print(f"{n_rows:>12,} {fast_time:>15.3f} {slow_time:>12.3f} {slow_time / fast_time:>8.0f}x  {identical}")
+
+
+if __name__ == '__main__':
+    main()
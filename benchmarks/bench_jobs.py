@@ -0,0 +1,146 @@
+"""Compare streamed exports against background export jobs while the dashboard is in use.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_jobs --rows 1000000
+
+Generates a CSV (see synthetic.py) and loads app.py with
+SWIFTSHOP_BACKGROUND_EXPORTS=1, without a browser or a server. The
+dashboard callbacks of bench_dashboard.py are timed with the result
+caches emptied first: idle, while the EXPORTS are streamed from
+/export.csv on their own threads, as the threaded server would, and
+while they run as jobs. A streamed export holds its request thread until
+the whole file is sent; a job only for its submit request. Last, the
+same new export is submitted from --submitters threads at once, which
+must start one job, and submitted again once it is done, which must be
+served from its file.
+"""
+import argparse
+import os
+import tempfile
+import threading
+import time
+from urllib.parse import urlencode
+
+import numpy as np
+
+from benchmarks.bench_dashboard import FILTERS, callback_requests, percentile_ms, request_body
+from benchmarks.synthetic import write_sales_csv
+
+# Export links run at the same time: all rows, plain and gzipped, and two
+# region filters
+EXPORTS = [
+    {},
+    {'gzip': 1},
+    {'region': ['North']},
+    {'region': ['North', 'East'], 'gzip': 1},
+]
+
+
+def time_callbacks(app_module, client, rounds):
+    """Durations of every filter-driven callback for each of FILTERS, rounds times, uncached."""
+    bodies = [request_body(app_module, key, outputs, props, filters)
+              for _, key, outputs, props in callback_requests(app_module) for _, filters in FILTERS]
+    durations = []
+    for _ in range(rounds):
+        for body in bodies:
+            app_module.dashboard_cache.invalidate()
+            app_module.selection_cache.invalidate()
+            start = time.perf_counter()
+            client.post('/_dash-update-component', json=body)
+            durations.append(time.perf_counter() - start)
+    return durations
+
+
+def print_callbacks(label, durations):
+    print(f"  callbacks {label:<22} p50 {percentile_ms(durations, 50):7.1f} ms  "
+          f"p99 {percentile_ms(durations, 99):7.1f} ms")
+
+
+def stream_export(client, params, held):
+    start = time.perf_counter()
+    response = client.get('/export.csv?' + urlencode(params, doseq=True), buffered=False)
+    for _ in response.response:
+        pass
+    response.close()
+    held.append(time.perf_counter() - start)
+
+
+def wait_for(app_module, job_ids):
+    while any(app_module.export_jobs.store.get(job_id)['status'] not in app_module.FINISHED
+              for job_id in job_ids):
+        time.sleep(0.05)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=1_000_000)
+    parser.add_argument('--rounds', type=int, default=3)
+    parser.add_argument('--workers', type=int, default=2, help="SWIFTSHOP_JOB_WORKERS")
+    parser.add_argument('--submitters', type=int, default=8)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'sales.csv')
+        write_sales_csv(path, args.rows, seed=args.seed)
+        os.environ.update({'SWIFTSHOP_DATA_FILE': path, 'SWIFTSHOP_CACHE_DIR': os.path.join(tmp, 'cache'),
+                           'SWIFTSHOP_JOB_DIR': os.path.join(tmp, 'jobs'), 'SWIFTSHOP_BACKGROUND_EXPORTS': '1',
+                           'SWIFTSHOP_JOB_WORKERS': str(args.workers), 'SWIFTSHOP_LIVE_REFRESH_SECONDS': '0'})
+        import app as app_module
+        client = app_module.server.test_client()
+        print(f"{args.rows:,} rows, {len(EXPORTS)} exports at a time, {args.workers} job workers")
+
+        time_callbacks(app_module, client, 1)  # warm up
+        print_callbacks("idle", time_callbacks(app_module, client, args.rounds))
+
+        held = []
+        threads = [threading.Thread(target=stream_export, args=(client, params, held)) for params in EXPORTS]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        durations = time_callbacks(app_module, client, args.rounds)
+        for thread in threads:
+            thread.join()
+        print_callbacks("while streaming", durations)
+        print(f"  streamed: done in {time.perf_counter() - start:.2f}s, "
+              f"request threads held {np.median(held):.2f}s each (median)")
+
+        start = time.perf_counter()
+        submits = []
+        for params in EXPORTS:
+            submitted = time.perf_counter()
+            job_id = client.post('/api/exports?' + urlencode(params, doseq=True)).json['id']
+            submits.append((job_id, time.perf_counter() - submitted))
+        durations = time_callbacks(app_module, client, args.rounds)
+        wait_for(app_module, [job_id for job_id, _ in submits])
+        print_callbacks("while jobs run", durations)
+        print(f"  jobs: done in {time.perf_counter() - start:.2f}s, "
+              f"request threads held {np.median([s for _, s in submits]) * 1000:.1f} ms each (median)")
+
+        # Identical exports at the same time start one job
+        params = {'category': ['Clothing']}
+        job_ids = []
+        barrier = threading.Barrier(args.submitters)
+
+        def submit():
+            barrier.wait()
+            job_ids.append(client.post('/api/exports?' + urlencode(params, doseq=True)).json['id'])
+
+        threads = [threading.Thread(target=submit) for _ in range(args.submitters)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        print(f"  {args.submitters} identical submits at once: {len(set(job_ids))} job(s)")
+        start = time.perf_counter()
+        wait_for(app_module, job_ids[:1])
+        print(f"  first export done in {time.perf_counter() - start:.2f}s")
+        start = time.perf_counter()
+        job = client.post('/api/exports?' + urlencode(params, doseq=True)).json
+        print(f"  repeated: {'same job' if job['id'] == job_ids[0] else 'new job'} ({job['status']}) "
+              f"in {(time.perf_counter() - start) * 1000:.1f} ms")
+
+
+if __name__ == '__main__':
+    main()
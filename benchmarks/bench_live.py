@@ -0,0 +1,78 @@
+"""Time of one live refresh batch against the number of rows already loaded.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_live --sizes 100000 1000000 5000000 --batch 1000
+
+For each size, writes that many rows of a synthetic CSV (see synthetic.py),
+loads them the way app.py does in memory, then appends --batches batches
+of --batch rows to the file and times TailIngester.poll() on each. The
+time per batch should depend on the batch, not on the rows before it.
+With --check the KPIs of the final snapshot are compared against a cube
+built from scratch over the same rows.
+"""
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+
+from aggregates import SalesCube
+from backends import SalesSnapshot
+from benchmarks.synthetic import generate_sales_data
+from data_processing import clean_sales_data
+from filters import FilterEngine
+from ingest import read_raw_source
+from live_ingest import TailIngester
+
+FILTERS = [
+    (None, None, None, None),
+    ('2024-03-01', '2024-09-30', ['North', 'East'], None),
+    ('2024-01-01', '2025-06-30', None, ['Electronics']),
+]
+
+
+def kpis(sales, filters):
+    selection = sales.select(*filters)
+    return selection.row_count(), selection.total_revenue(), selection.distinct_orders()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100_000, 1_000_000])
+    parser.add_argument('--batch', type=int, default=1_000)
+    parser.add_argument('--batches', type=int, default=50)
+    parser.add_argument('--check', action='store_true')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    for n_rows in args.sizes:
+        raw = generate_sales_data(n_rows + args.batch * args.batches, seed=args.seed)
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'sales.csv')
+            raw.iloc[:n_rows].to_csv(path, index=False)
+            df = clean_sales_data(read_raw_source(path))
+            ingester = TailIngester(path, SalesSnapshot(df, SalesCube.from_frame(df), FilterEngine(df), 'bench'))
+            start = time.perf_counter()
+            ingester.prepare()
+            print(f"{n_rows:,} rows loaded, live refresh prepared in {time.perf_counter() - start:.2f}s")
+
+            times = []
+            for first in range(n_rows, len(raw), args.batch):
+                raw.iloc[first:first + args.batch].to_csv(path, mode='a', header=False, index=False)
+                start = time.perf_counter()
+                ingester.poll()
+                times.append((time.perf_counter() - start) * 1000)
+            print(f"  {args.batches} batches of {args.batch:,} rows: p50 {np.percentile(times, 50):.1f} ms  "
+                  f"p99 {np.percentile(times, 99):.1f} ms  ({len(ingester.snapshot.cube.parts)} cube parts)")
+
+            if args.check:
+                live = ingester.snapshot
+                rebuilt = SalesSnapshot(live.df, SalesCube.from_frame(live.df), FilterEngine(live.df), 'rebuilt')
+                same = all(kpis(live, filters) == kpis(rebuilt, filters) for filters in FILTERS)
+                print(f"  KPIs match a rebuilt cube: {same}")
+
+
+if __name__ == '__main__':
+    main()
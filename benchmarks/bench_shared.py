@@ -0,0 +1,99 @@
+"""Compare the memory of N workers loading the data each against N workers attaching to shared data.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_shared --rows 1000000 --workers 1 2 4 8
+
+Each worker runs in its own process, loads the data the way app.py does in
+that mode (from a warm dataset cache when not shared), runs a few dashboard
+queries and waits until all workers are measured. USS is the memory only
+that worker holds; PSS splits the shared pages between the processes
+mapping them, so the sum of PSS is what the workers cost together.
+"""
+import argparse
+import contextlib
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import psutil
+
+from aggregates import SalesCube
+from backends import SalesSnapshot
+from benchmarks.synthetic import write_sales_csv
+from dataset_cache import load_with_cache
+from filters import FilterEngine
+from shared_data import build_shared, load_shared, read_sales_csv
+
+QUERIES = [
+    (None, None, None, None),
+    ('2024-05-01', '2024-05-31', ['South'], None),
+]
+
+
+def worker(mode, path, cache_dir):
+    """Load, query, print the load time and wait for stdin to close (runs in a child process)."""
+    start = time.perf_counter()
+    # stdout carries only the result
+    with contextlib.redirect_stdout(sys.stderr):
+        if mode == 'shared':
+            sales = load_shared(path, cache_dir)
+        else:
+            df = load_with_cache(path, read_sales_csv, cache_dir)
+            sales = SalesSnapshot(df, SalesCube.from_frame(df), FilterEngine(df), df.attrs['data_version'])
+    seconds = time.perf_counter() - start
+    for filters in QUERIES:
+        selection = sales.select(*filters)
+        selection.total_revenue(), selection.sales_by_month(), selection.top_products()
+        sales.table_page(filters, [], [{'column_id': 'total_amount', 'direction': 'desc'}], 0, 25)
+    print(json.dumps({'seconds': seconds}), flush=True)
+    sys.stdin.read()
+
+
+def measure(mode, path, cache_dir, n_workers):
+    processes = [subprocess.Popen(
+        [sys.executable, '-m', 'benchmarks.bench_shared', '--worker', mode, path, cache_dir],
+        stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True) for _ in range(n_workers)]
+    try:
+        seconds = [json.loads(p.stdout.readline())['seconds'] for p in processes]
+        memory = [psutil.Process(p.pid).memory_full_info() for p in processes]
+    finally:
+        for p in processes:
+            p.stdin.close()
+            p.wait()
+    return {'load_s': max(seconds),
+            'uss_mb': sum(m.uss for m in memory) / n_workers / 1024 ** 2,
+            'pss_total_mb': sum(m.pss for m in memory) / 1024 ** 2}
+
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == '--worker':
+        worker(*sys.argv[2:5])
+        return
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=1_000_000)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'sales.csv')
+        cache_dir = os.path.join(tmp, 'cache')
+        write_sales_csv(path, args.rows, seed=args.seed)
+        # Build the cache and the shared files up front, so only attaching is measured
+        build_shared(path, cache_dir)
+        print(f"{args.rows:,} rows")
+        print(f"  {'mode':<8} {'workers':>7} {'load (s)':>9} {'USS/worker (MB)':>16} {'total PSS (MB)':>15}")
+        for n_workers in args.workers:
+            for mode in ('private', 'shared'):
+                result = measure(mode, path, cache_dir, n_workers)
+                print(f"  {mode:<8} {n_workers:>7} {result['load_s']:>9.2f} "
+                      f"{result['uss_mb']:>16,.0f} {result['pss_total_mb']:>15,.0f}")
+
+
+if __name__ == '__main__':
+    main()
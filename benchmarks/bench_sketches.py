@@ -0,0 +1,76 @@
+"""Compare the exact and approximate top products and distinct customers.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_sketches --rows 1000000 --products 200000
+
+The data has a catalog of --products variants with Zipf-like popularity.
+Exact top products are a group-by over the selected cube cells and exact
+distinct customers a nunique over the selected rows, as in exact mode; the
+approximate ones come from the sketches. The first approximate query of a
+cube also builds its bucket index, which is timed separately.
+"""
+import argparse
+import time
+
+import numpy as np
+
+from aggregates import CubeBuilder
+from benchmarks.synthetic import generate_sales_data
+from data_processing import clean_sales_data
+from filters import FilterEngine
+
+FILTERS = [
+    ('all data', (None, None, None, None)),
+    ('six months, two regions', ('2024-03-10', '2024-09-20', ['North', 'East'], None)),
+    ('one month, one region', ('2024-05-01', '2024-05-31', ['South'], None)),
+]
+
+
+def median_ms(function, repeat):
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        durations.append(time.perf_counter() - start)
+    return np.median(durations) * 1000, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=1_000_000)
+    parser.add_argument('--products', type=int, default=200_000)
+    parser.add_argument('--repeat', type=int, default=10)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    df = clean_sales_data(generate_sales_data(args.rows, seed=args.seed, n_products=args.products))
+    start = time.perf_counter()
+    builder = CubeBuilder(customer_sketch=True)
+    builder.add(df, df['order_id'].duplicated(keep=False).to_numpy())
+    cube = builder.build()
+    print(f"{args.rows:,} rows, {df['product_name'].nunique():,} products, {len(cube):,} cells; "
+          f"cube with customer sketch built in {time.perf_counter() - start:.2f}s")
+    start = time.perf_counter()
+    cube.select().distinct_customers(), cube.select().top_products(approximate=True)
+    print(f"sketch index built on first query in {time.perf_counter() - start:.2f}s")
+    row_filter = FilterEngine(df)
+
+    for label, filters in FILTERS:
+        selection = cube.select(*filters)
+        exact_ms, exact = median_ms(lambda: selection.top_products(approximate=False), args.repeat)
+        approx_ms, approx = median_ms(lambda: selection.top_products(approximate=True), args.repeat)
+        same = list(exact['product_name'].astype(str)) == list(approx['product_name'].astype(str))
+        print(f"{label}:")
+        print(f"  top products     exact {exact_ms:>8.2f} ms  approximate {approx_ms:>7.2f} ms  "
+              f"same top 10: {same}, max error ${approx['max_error'].max():,.2f}")
+
+        exact_ms, exact = median_ms(
+            lambda: df['customer_id'].iloc[row_filter.select(*filters)].nunique(), args.repeat)
+        approx_ms, approx = median_ms(selection.distinct_customers, args.repeat)
+        print(f"  customers        exact {exact_ms:>8.2f} ms  approximate {approx_ms:>7.2f} ms  "
+              f"{exact:,} vs {approx:,.0f} ({(approx - exact) / max(exact, 1):+.2%})")
+
+
+if __name__ == '__main__':
+    main()
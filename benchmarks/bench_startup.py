@@ -0,0 +1,106 @@
+"""Measure how soon a freshly started dashboard answers, with and without lazy startup.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_startup --rows 1000000
+
+Generates a CSV (see synthetic.py) and starts app.py as a server in a new
+process, --repeat times per mode: loading the data at import (eager) and
+with SWIFTSHOP_LAZY_STARTUP=1 (lazy), each with an empty cache directory
+(cold) and with the cache the previous start left (warm). From the moment
+the process is started, it reports when /healthz first answers, when the
+first byte of the dashboard page arrives (time to first byte), and when
+/readyz reports the data as loaded.
+"""
+import argparse
+import http.client
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from benchmarks.synthetic import write_sales_csv
+
+SERVER_SCRIPT = "import sys, app; app.app.run(debug=False, port=int(sys.argv[1]))"
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def get(port, path):
+    """Status of GET path once its first byte arrives, or None while the server is not listening."""
+    connection = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+    try:
+        connection.request('GET', path)
+        response = connection.getresponse()
+        response.read(1)
+        return response.status
+    except (ConnectionRefusedError, ConnectionResetError):
+        return None
+    finally:
+        connection.close()
+
+
+def start_once(path, cache_dir, lazy, poll_s=0.005):
+    """Seconds from starting the server until /healthz answers, / sends its first byte and /readyz is 200."""
+    port = free_port()
+    env = {**os.environ, 'SWIFTSHOP_DATA_FILE': path, 'SWIFTSHOP_CACHE_DIR': cache_dir,
+           'SWIFTSHOP_LIVE_REFRESH_SECONDS': '0', 'SWIFTSHOP_LAZY_STARTUP': '1' if lazy else '0'}
+    start = time.perf_counter()
+    process = subprocess.Popen([sys.executable, '-c', SERVER_SCRIPT, str(port)], env=env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    times = {}
+    try:
+        while 'ready_s' not in times:
+            if process.poll() is not None:
+                raise RuntimeError(f"The server exited with code {process.returncode}")
+            if 'healthz_s' not in times and get(port, '/healthz') == 200:
+                times['healthz_s'] = time.perf_counter() - start
+            if 'healthz_s' in times and 'ttfb_s' not in times and get(port, '/') == 200:
+                times['ttfb_s'] = time.perf_counter() - start
+            if 'ttfb_s' in times and get(port, '/readyz') == 200:
+                times['ready_s'] = time.perf_counter() - start
+            time.sleep(poll_s)
+    finally:
+        process.terminate()
+        process.wait()
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=1_000_000)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'sales.csv')
+        write_sales_csv(path, args.rows, seed=args.seed)
+        print(f"{args.rows:,} rows, median of {args.repeat} starts (seconds after starting the process)")
+        print(f"  {'':<12} {'/healthz':>9} {'first byte':>11} {'/readyz':>9}")
+        for lazy in (False, True):
+            for warm in (False, True):
+                results = []
+                cache_dir = os.path.join(tmp, 'cache')
+                for _ in range(args.repeat):
+                    if not warm:
+                        shutil.rmtree(cache_dir, ignore_errors=True)
+                    elif not os.path.isdir(cache_dir):
+                        start_once(path, cache_dir, lazy)
+                    results.append(start_once(path, cache_dir, lazy))
+                label = f"{'lazy' if lazy else 'eager'}, {'warm' if warm else 'cold'}"
+                medians = [np.median([r[key] for r in results]) for key in ('healthz_s', 'ttfb_s', 'ready_s')]
+                print(f"  {label:<12} {medians[0]:9.2f} {medians[1]:11.2f} {medians[2]:9.2f}")
+
+
+if __name__ == '__main__':
+    main()
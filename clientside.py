@@ -0,0 +1,152 @@
+import numpy as np
+import pandas as pd
+
+from aggregates import _codes
+from figures import client_skeletons, typed_array
+from sketches import HLL_PRECISION, fold_registers
+from trends import AUTO_GRANULARITY, TREND_MAX_POINTS, day_numbers
+
+# Clientside mode: the KPIs, charts and export link are computed in the browser.
+#
+# With SWIFTSHOP_CLIENTSIDE=1 the server sends one bundle of pre-aggregated
+# typed arrays when the page loads (and again when new data arrives), and
+# the callbacks in assets/clientside.js answer every filter change from it
+# without a request. Only the data table and the export still go to the
+# server, since they need the rows themselves.
+#
+# The filters can only tell cells apart by day, region and category, so
+# the bundle sums the cube cells per (day, region, category) bucket, with
+# revenue per product and rows per rating kept per bucket for the top
+# products and the rating chart. The orders that span several buckets are
+# listed, which keeps the average order value exact.
+#
+# Distinct customers are estimated from HyperLogLog registers, like the
+# server's approximate mode: per (month, region, category) for the months
+# the date range covers entirely, and per bucket, at a coarser precision
+# to keep the bundle small, for the days of the months at either end. The
+# estimate for those days is the growth they add to the union of the
+# coarse registers, so the error of the coarse registers only applies to
+# the customers of the partly covered months.
+
+# Precision of the customer registers per (month, region, category) and,
+# coarser, per bucket: 1024 and 64 bytes each
+MONTH_HLL_PRECISION = min(HLL_PRECISION, 10)
+DAY_HLL_PRECISION = min(HLL_PRECISION, 6)
+
+
+def _month_numbers(days):
+    """Months since 1970-01 of day numbers."""
+    return days.astype('datetime64[D]').astype('datetime64[M]').astype(np.int64)
+
+
+def _dense_registers(buckets, n_buckets, registers, ranks, precision):
+    """Dense registers at precision per bucket from the cube's sparse (register, rank) entries."""
+    registers, ranks = fold_registers(registers, ranks, HLL_PRECISION, precision)
+    dense = np.zeros((n_buckets, 2 ** precision), dtype=np.uint8)
+    np.maximum.at(dense, (buckets, registers), ranks)
+    return dense
+
+
+def client_bundle(cube, data_version=None, export_path='/export.csv'):
+    """The arrays and figure skeletons the browser computes the dashboard from, as JSON-able dicts.
+
+    Day numbers count from the first order date; undated cells are on
+    day -1 and only count without a date filter. Region, category and
+    product codes index their lists, with -1 for missing values.
+    """
+    if cube._daily is None:
+        raise ValueError("Clientside mode needs order dates without a time of day")
+    if cube.customer_registers is None:
+        raise ValueError("This cube was built without the customer sketch")
+    cells = cube.cells
+    first_day, prefix, _, _ = cube._daily
+    dated = ~np.isnat(cube._dates)
+    day = np.full(len(cells), -1, dtype=np.int64)
+    day[dated] = day_numbers(cube._dates[dated]) - first_day
+    (region, region_of), (category, category_of) = (cube._value_codes['customer_region'],
+                                                    cube._value_codes['category'])
+    product, products = _codes(cells['product_name'])
+
+    keys = pd.DataFrame({'day': day, 'region': region, 'category': category})
+    grouped = keys.assign(cents=cells['revenue_cents'].to_numpy(), order_cents=cells['order_cents'].to_numpy(),
+                          rows=cells['rows'].to_numpy(), orders=cells['orders'].to_numpy()
+                          ).groupby(['day', 'region', 'category'])
+    buckets = grouped.sum().reset_index()
+    bucket = grouped.ngroup().to_numpy()
+
+    # An order in several cells of one bucket counts once there; the ones
+    # in several buckets are corrected for in the browser
+    shared = pd.DataFrame({'order': cube._shared_order_codes, 'bucket': bucket[cube._shared_order_cells]})
+    per_bucket = shared.groupby(['order', 'bucket']).size().rename('cells').reset_index()
+    repeats = per_bucket.groupby('bucket')['cells'].sum() - per_bucket.groupby('bucket').size()
+    buckets.loc[repeats.index, 'orders'] -= repeats.to_numpy()
+    spanning = per_bucket[per_bucket['order'].duplicated(keep=False)]
+
+    known = product >= 0
+    product_cents = (pd.DataFrame({'bucket': bucket[known], 'product': product[known],
+                                   'cents': cells['revenue_cents'].to_numpy()[known]})
+                     .groupby(['bucket', 'product'])['cents'].sum().reset_index())
+    rated = (cells['customer_rating'] > 0).to_numpy()
+    rating_rows = (pd.DataFrame({'bucket': bucket[rated], 'rating': cells['customer_rating'].to_numpy()[rated],
+                                 'rows': cells['rows'].to_numpy()[rated]})
+                   .groupby(['bucket', 'rating'])['rows'].sum().reset_index())
+
+    # Customer registers per (month, region, category) and per bucket
+    months = np.full(len(buckets), np.iinfo(np.int64).min)
+    bucket_dated = buckets['day'].to_numpy() >= 0
+    months[bucket_dated] = _month_numbers(buckets['day'].to_numpy()[bucket_dated] + first_day)
+    month_keys = pd.DataFrame({'month': months, 'region': buckets['region'], 'category': buckets['category']})
+    month_bucket = month_keys.groupby(['month', 'region', 'category']).ngroup().to_numpy()
+    n_months = month_bucket.max() + 1 if len(month_bucket) else 0
+
+    entries = cube.customer_registers
+    entry_dates = entries['order_date'].to_numpy()
+    entry_days = np.full(len(entries), -1, dtype=np.int64)
+    entry_dated = ~np.isnat(entry_dates)
+    entry_days[entry_dated] = day_numbers(entry_dates[entry_dated]) - first_day
+    entry_keys = pd.DataFrame({'day': entry_days,
+                               'region': pd.Categorical(entries['customer_region'], list(region_of)).codes,
+                               'category': pd.Categorical(entries['category'], list(category_of)).codes})
+    entry_bucket = entry_keys.merge(buckets[['day', 'region', 'category']].reset_index(), how='left',
+                                    on=['day', 'region', 'category'])['index']
+    found = entry_bucket.notna().to_numpy()
+    entry_bucket = entry_bucket[found].to_numpy(dtype=np.int64)
+    register, rank = entries['register'].to_numpy()[found], entries['rank'].to_numpy()[found]
+    month_registers = _dense_registers(month_bucket[entry_bucket], n_months, register, rank, MONTH_HLL_PRECISION)
+    month_low_registers = _dense_registers(month_bucket[entry_bucket], n_months, register, rank, DAY_HLL_PRECISION)
+    day_registers = _dense_registers(entry_bucket, len(buckets), register, rank, DAY_HLL_PRECISION)
+
+    return {
+        'version': data_version,
+        'export_path': export_path,
+        'first_day': int(first_day),
+        'n_days': len(prefix) - 1,
+        'regions': list(region_of),
+        'categories': list(category_of),
+        'products': [str(name) for name in products],
+        'buckets': {'day': typed_array(buckets['day'].to_numpy()),
+                    'region': typed_array(buckets['region'].to_numpy()),
+                    'category': typed_array(buckets['category'].to_numpy()),
+                    # Cents as float64, which holds them exactly and has no size limit in the browser
+                    'cents': typed_array(buckets['cents'].to_numpy(dtype='float64')),
+                    # Revenue of the rows with an order_id, for the average order value
+                    'order_cents': typed_array(buckets['order_cents'].to_numpy(dtype='float64')),
+                    'rows': typed_array(buckets['rows'].to_numpy()),
+                    'orders': typed_array(buckets['orders'].to_numpy()),
+                    'month_bucket': typed_array(month_bucket)},
+        'spanning': {'order': typed_array(pd.factorize(spanning['order'])[0]),
+                     'bucket': typed_array(spanning['bucket'].to_numpy())},
+        'product_cents': {'bucket': typed_array(product_cents['bucket'].to_numpy()),
+                          'product': typed_array(product_cents['product'].to_numpy()),
+                          'cents': typed_array(product_cents['cents'].to_numpy(dtype='float64'))},
+        'rating_rows': {'bucket': typed_array(rating_rows['bucket'].to_numpy()),
+                        'rating': typed_array(rating_rows['rating'].to_numpy(dtype='float64')),
+                        'rows': typed_array(rating_rows['rows'].to_numpy())},
+        'customers': {'month_precision': MONTH_HLL_PRECISION,
+                      'month_registers': typed_array(month_registers.ravel()),
+                      'day_precision': DAY_HLL_PRECISION,
+                      'month_low_registers': typed_array(month_low_registers.ravel()),
+                      'day_registers': typed_array(day_registers.ravel())},
+        'trend': {'max_points': TREND_MAX_POINTS, 'auto': AUTO_GRANULARITY},
+        'figures': client_skeletons(),
+    }
@@ -0,0 +1,106 @@
+import gzip
+import os
+import threading
+from collections import OrderedDict
+
+from flask import request
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Compression of the server's responses.
+#
+# Callback responses, the page and Dash's JavaScript bundles are compressed
+# with Brotli when the brotli package is installed and the browser accepts
+# it, and with gzip otherwise. Responses smaller than
+# SWIFTSHOP_COMPRESS_MIN_BYTES are sent as they are, since compressing a
+# few hundred bytes costs more than it saves. Dash's bundles never change
+# at a given URL (the URL carries their version), so each one is only
+# compressed once per process. Streamed responses (the CSV export) are left
+# alone; the export compresses itself when asked to.
+
+COMPRESS = os.environ.get('SWIFTSHOP_COMPRESS', '1') not in ('', '0')
+COMPRESS_MIN_BYTES = int(os.environ.get('SWIFTSHOP_COMPRESS_MIN_BYTES') or 1024)
+COMPRESS_LEVEL = int(os.environ.get('SWIFTSHOP_COMPRESS_LEVEL') or 6)
+
+COMPRESSIBLE_TYPES = ('application/json', 'application/javascript', 'text/')
+
+# Prefix of the fingerprinted URLs Dash serves its bundles from
+ASSET_PREFIXES = ('/_dash-component-suites/',)
+# Compressed bundles kept per process
+ASSET_CACHE_SIZE = 64
+
+
+def accepted_encoding(accept_encoding):
+    """'br' or 'gzip' from an Accept-Encoding header (br only when brotli is installed), or None."""
+    accepted = {part.split(';')[0].strip().lower() for part in accept_encoding.split(',')
+                if not part.strip().endswith(';q=0')}
+    if brotli is not None and 'br' in accepted:
+        return 'br'
+    if 'gzip' in accepted:
+        return 'gzip'
+    return None
+
+
+def compress(data, encoding, level=COMPRESS_LEVEL):
+    if encoding == 'br':
+        # Brotli's quality runs from 0 to 11; level 6 of gzip maps to 5
+        return brotli.compress(data, quality=min(11, max(0, level - 1)))
+    return gzip.compress(data, compresslevel=level, mtime=0)
+
+
+class ResponseCompressor:
+    """Flask after_request hook compressing large text responses."""
+
+    def __init__(self, min_bytes=COMPRESS_MIN_BYTES, level=COMPRESS_LEVEL):
+        self.min_bytes = min_bytes
+        self.level = level
+        self._assets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _compress_asset(self, path, data, encoding):
+        key = (path, encoding)
+        with self._lock:
+            if key in self._assets:
+                self._assets.move_to_end(key)
+                return self._assets[key]
+        body = compress(data, encoding, self.level)
+        with self._lock:
+            self._assets[key] = body
+            while len(self._assets) > ASSET_CACHE_SIZE:
+                self._assets.popitem(last=False)
+        return body
+
+    def __call__(self, response):
+        if (response.status_code != 200 or response.is_streamed or response.direct_passthrough
+                or 'Content-Encoding' in response.headers
+                or not (response.mimetype or '').startswith(COMPRESSIBLE_TYPES)):
+            return response
+        response.vary.add('Accept-Encoding')
+        encoding = accepted_encoding(request.headers.get('Accept-Encoding', ''))
+        if encoding is None:
+            return response
+        data = response.get_data()
+        if len(data) < self.min_bytes:
+            return response
+
+        if request.path.startswith(ASSET_PREFIXES):
+            body = self._compress_asset(request.full_path, data, encoding)
+        else:
+            body = compress(data, encoding, self.level)
+        response.set_data(body)
+        # The ETag stays the same: Dash answers If-None-Match for its bundles
+        # by comparing with the uncompressed one
+        response.headers['Content-Encoding'] = encoding
+        return response
+
+
+def install_compression(server):
+    """Compress the Flask server's large responses, unless SWIFTSHOP_COMPRESS=0."""
+    if not COMPRESS:
+        return None
+    compressor = ResponseCompressor()
+    server.after_request(compressor)
+    return compressor
@@ -0,0 +1,171 @@
+import pandas as pd
+import numpy as np
+
+# Cleaning and imputation steps for the SwiftShop sales data.
+# Everything in here works on whole columns at once (groupby/map/fillna),
+# so the cost stays proportional to the number of rows instead of the
+# number of missing cells.
+
+# In-memory representation of each column once the data is cleaned:
+#   'integer'  - downcast to the smallest signed int type that fits
+#   'category' - pandas categorical (low-cardinality text)
+#   'float32'  - single precision float (small whole numbers only)
+# Columns not listed keep the dtype they were parsed with. month_year is
+# built directly as a monthly Period, so it needs no entry here.
+COLUMN_SCHEMA = {
+    'order_id': 'integer',
+    'customer_id': 'integer',
+    'product_id': 'integer',
+    'quantity': 'integer',
+    'year': 'integer',
+    'month': 'integer',
+    'customer_region': 'category',
+    'product_name': 'category',
+    'category': 'category',
+    'payment_method': 'category',
+    'customer_rating': 'float32',
+}
+
+
+def add_time_columns(df):
+    """Parse order_date and derive the year/month keys used by the dashboard."""
+    df['order_date'] = pd.to_datetime(df['order_date'])
+
+    # Extract year and month for time-based analysis
+    df['year'] = df['order_date'].dt.year
+    df['month'] = df['order_date'].dt.month
+    df['month_year'] = df['order_date'].dt.to_period('M')
+    return df
+
+
+def product_median_ratings(df):
+    """Median rating per product_id, rounded to a whole star."""
+    return df.groupby('product_id')['customer_rating'].median().apply(np.round)
+
+
+def region_counts(df):
+    """Number of rows per (customer_id, known customer_region)."""
+    known = df.loc[df['customer_region'].notna(), ['customer_id', 'customer_region']]
+    return known.groupby(['customer_id', 'customer_region'], observed=True).size()
+
+
+def mode_from_counts(counts):
+    """Most common region per customer from region_counts() output.
+
+    Ties are broken on the alphabetically first region, the same value
+    Series.mode()[0] returns. Customers without any known region are left out.
+    """
+    counts = counts.rename('orders').reset_index()
+    counts = counts.sort_values(['customer_id', 'orders', 'customer_region'],
+                                ascending=[True, False, True])
+    return counts.drop_duplicates('customer_id').set_index('customer_id')['customer_region']
+
+
+def customer_mode_regions(df):
+    """Most common known region per customer_id."""
+    return mode_from_counts(region_counts(df))
+
+
+def rating_counts(df):
+    """Number of rows per (product_id, known customer_rating)."""
+    return df.groupby(['product_id', 'customer_rating']).size()
+
+
+def medians_from_counts(counts):
+    """Median rating per product_id from rating_counts() output, rounded like product_median_ratings().
+
+    Gives the same value as a median over the individual rows, so counts
+    summed over several chunks lead to the same fill as one full frame.
+    """
+    counts = counts.rename('rows').reset_index().sort_values(['product_id', 'customer_rating'])
+    end = counts.groupby('product_id')['rows'].cumsum()
+    start = end - counts['rows']
+    total = counts['product_id'].map(counts.groupby('product_id')['rows'].sum())
+
+    # Values at the two middle positions (the same one when the count is odd)
+    lower = counts[(start <= (total - 1) // 2) & ((total - 1) // 2 < end)]
+    upper = counts[(start <= total // 2) & (total // 2 < end)]
+    lower = lower.set_index('product_id')['customer_rating']
+    upper = upper.set_index('product_id')['customer_rating']
+    return ((lower + upper) / 2).apply(np.round)
+
+
+def impute_customer_rating(df, median_by_product=None, overall_median=None):
+    """Fill missing ratings with the product median, else the overall median.
+
+    The lookups can be passed in when they were computed on a larger frame
+    than the one being filled (e.g. chunked ingestion).
+    """
+    missing = df['customer_rating'].isna()
+    if not missing.any():
+        return df
+
+    if median_by_product is None:
+        median_by_product = product_median_ratings(df)
+    if overall_median is None:
+        overall_median = np.round(df['customer_rating'].median())
+
+    fill = df.loc[missing, 'product_id'].map(median_by_product).fillna(overall_median)
+    df.loc[missing, 'customer_rating'] = fill
+    return df
+
+
+def impute_customer_region(df, region_by_customer=None):
+    """Fill missing regions with the customer's most common region, else 'Unknown'."""
+    missing = df['customer_region'].isna()
+    if not missing.any():
+        return df
+
+    if region_by_customer is None:
+        region_by_customer = customer_mode_regions(df)
+
+    fill = df.loc[missing, 'customer_id'].map(region_by_customer).fillna('Unknown')
+    df.loc[missing, 'customer_region'] = fill
+    return df
+
+
+def compact_dtypes(df, schema=COLUMN_SCHEMA):
+    """Convert columns to the compact dtypes listed in schema."""
+    for column, kind in schema.items():
+        if column not in df.columns:
+            continue
+        if kind == 'integer':
+            if pd.api.types.is_integer_dtype(df[column]):
+                df[column] = pd.to_numeric(df[column], downcast='integer')
+        elif kind == 'category':
+            df[column] = df[column].astype('category')
+        else:
+            df[column] = df[column].astype(kind)
+    return df
+
+
+def memory_report(df):
+    """Bytes used by each column, largest first, with a total row."""
+    usage = df.memory_usage(index=False, deep=True)
+    report = pd.DataFrame({'dtype': df.dtypes.astype(str), 'bytes': usage})
+    report = report.sort_values('bytes', ascending=False)
+    report.loc['TOTAL'] = ['', usage.sum()]
+    report['MB'] = (report['bytes'] / 1024 ** 2).round(2)
+    return report
+
+
+def clean_sales_data(df, median_by_product=None, overall_median=None, region_by_customer=None):
+    """Run the full cleaning pipeline on a freshly read sales frame.
+
+    The imputation lookups are computed from df unless they are passed in,
+    which chunked ingestion does with lookups covering the whole dataset.
+    """
+    df = add_time_columns(df)
+
+    # Handle missing payment methods
+    df['payment_method'] = df['payment_method'].fillna("Unknown")
+
+    # Handle missing ratings
+    df = impute_customer_rating(df, median_by_product, overall_median)
+
+    # This fills missing 'customer_region' values based on the most common region (mode) used by
+    # the same 'customer_id'. If the customer's region cannot be determined, it sets it as 'Unknown'.
+    df = impute_customer_region(df, region_by_customer)
+
+    return compact_dtypes(df)
+
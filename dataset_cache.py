@@ -0,0 +1,227 @@
+import hashlib
+import json
+import os
+import shutil
+import time
+
+import numpy as np
+import pandas as pd
+
+# On-disk cache of the cleaned sales frame.
+#
+# Each column is stored as its own .npy file so a warm start can memory-map
+# the numeric and date columns instead of parsing the CSV again. Text and
+# categorical columns are stored as integer codes plus their list of
+# distinct values, and monthly periods as their integer ordinals.
+# A small pointer file (current.json) records which source file the cache
+# was built from; it is replaced atomically, so several workers can start
+# at the same time without reading a half-written cache.
+
+# Bump this whenever the cleaning pipeline changes its output.
+CACHE_VERSION = 2
+
+DEFAULT_CACHE_DIR = os.environ.get('SWIFTSHOP_CACHE_DIR', '.swiftshop_cache')
+
+POINTER_FILE = 'current.json'
+MANIFEST_FILE = 'manifest.json'
+HASH_CHUNK_SIZE = 8 * 1024 * 1024
+
+
+def content_hash(path):
+    """SHA-256 of a file, read in fixed-size chunks."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def file_fingerprint(path, sha256=None):
+    """Size, mtime and content hash identifying one version of a source file."""
+    stat = os.stat(path)
+    return {
+        'size': stat.st_size,
+        'mtime_ns': stat.st_mtime_ns,
+        'sha256': sha256 or content_hash(path),
+    }
+
+
+def _read_json(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_json_atomic(path, data):
+    tmp_path = f"{path}.tmp-{os.getpid()}"
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+
+
+def _source_cache_dir(cache_dir, source_path):
+    # The stem for reading, and a hash of the full path so that sources with
+    # the same name in different directories do not share (and keep
+    # replacing) one cache
+    source_path = os.path.abspath(source_path)
+    stem = os.path.splitext(os.path.basename(source_path))[0]
+    path_hash = hashlib.sha256(source_path.encode()).hexdigest()[:8]
+    return os.path.join(cache_dir, f"{stem}-{path_hash}")
+
+
+def find_cached_frame(source_path, cache_dir=DEFAULT_CACHE_DIR):
+    """Return the cache directory for source_path if it is still valid, else None.
+
+    Matching size and mtime are trusted without reading the file. When only
+    the mtime moved (the file was touched or copied) the content hash
+    decides, so an unchanged file does not force a rebuild.
+    """
+    root = _source_cache_dir(cache_dir, source_path)
+    pointer = _read_json(os.path.join(root, POINTER_FILE))
+    if not pointer or pointer.get('version') != CACHE_VERSION:
+        return None
+
+    data_dir = os.path.join(root, pointer['data_dir'])
+    if not os.path.isfile(os.path.join(data_dir, MANIFEST_FILE)):
+        return None
+
+    cached = pointer['source']
+    stat = os.stat(source_path)
+    if stat.st_size != cached['size']:
+        return None
+    if stat.st_mtime_ns != cached['mtime_ns']:
+        if content_hash(source_path) != cached['sha256']:
+            return None
+        pointer['source']['mtime_ns'] = stat.st_mtime_ns
+        _write_json_atomic(os.path.join(root, POINTER_FILE), pointer)
+    return data_dir
+
+
+def write_frame(df, directory):
+    """Write df to a new directory as one .npy file per column plus a manifest."""
+    os.makedirs(directory)
+    columns = []
+    for position, name in enumerate(df.columns):
+        column = {'name': name, 'file': f"{position}.npy"}
+        series = df[name]
+        if isinstance(series.dtype, pd.CategoricalDtype):
+            column['kind'] = 'categorical'
+            column['categories'] = series.cat.categories.tolist()
+            values = series.cat.codes.to_numpy()
+        elif isinstance(series.dtype, pd.PeriodDtype):
+            column['kind'] = 'period'
+            column['dtype'] = str(series.dtype)
+            values = series.array.asi8
+        elif series.dtype == object:
+            column['kind'] = 'text'
+            codes, uniques = pd.factorize(series)
+            column['categories'] = uniques.tolist()
+            values = codes.astype(np.int32)
+        else:
+            column['kind'] = 'array'
+            values = series.to_numpy()
+        np.save(os.path.join(directory, column['file']), values)
+        columns.append(column)
+
+    _write_json_atomic(os.path.join(directory, MANIFEST_FILE),
+                       {'version': CACHE_VERSION, 'rows': len(df), 'columns': columns})
+
+
+def write_cached_frame(df, source_path, fingerprint=None, cache_dir=DEFAULT_CACHE_DIR):
+    """Persist df as a directory of .npy columns and point the cache at it."""
+    fingerprint = fingerprint or file_fingerprint(source_path)
+    root = _source_cache_dir(cache_dir, source_path)
+    os.makedirs(root, exist_ok=True)
+
+    data_dir_name = f"v{CACHE_VERSION}-{fingerprint['sha256'][:16]}"
+    data_dir = os.path.join(root, data_dir_name)
+
+    if not os.path.isdir(data_dir):
+        tmp_dir = f"{data_dir}.tmp-{os.getpid()}"
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        write_frame(df, tmp_dir)
+        try:
+            os.rename(tmp_dir, data_dir)
+        except OSError:
+            # Another worker finished writing the same cache first
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    _write_json_atomic(os.path.join(root, POINTER_FILE),
+                       {'version': CACHE_VERSION, 'source': fingerprint, 'data_dir': data_dir_name})
+
+    # Drop caches built from older versions of the source file
+    for entry in os.listdir(root):
+        if entry not in (data_dir_name, POINTER_FILE) and '.tmp-' not in entry:
+            shutil.rmtree(os.path.join(root, entry), ignore_errors=True)
+    return data_dir
+
+
+def read_cached_frame(data_dir):
+    """Rebuild the frame from a cache directory (or any directory written by write_frame).
+
+    Numeric and date columns are read-only memory maps of the .npy files;
+    text columns are decoded from their codes.
+    """
+    manifest = _read_json(os.path.join(data_dir, MANIFEST_FILE))
+    data = {}
+    for column in manifest['columns']:
+        values = np.load(os.path.join(data_dir, column['file']), mmap_mode='r')
+        if column['kind'] == 'categorical':
+            data[column['name']] = pd.Categorical.from_codes(values, column['categories'])
+        elif column['kind'] == 'period':
+            data[column['name']] = pd.arrays.PeriodArray(values, dtype=pd.api.types.pandas_dtype(column['dtype']))
+        elif column['kind'] == 'text':
+            categories = np.array(column['categories'] + [np.nan], dtype=object)
+            data[column['name']] = categories[values]
+        else:
+            data[column['name']] = values
+    return pd.DataFrame(data, copy=False)
+
+
+def load_with_cache(source_path, build, cache_dir=DEFAULT_CACHE_DIR):
+    """Return the cleaned frame for source_path, building and caching it on a miss.
+
+    build(source_path) must return the cleaned frame. df.attrs['data_version']
+    is set to a string that changes whenever the source file does, and
+    df.attrs['cache_data_dir'] to the cache directory of the frame. The load
+    time and whether the cache was hit are printed, so cold and warm starts
+    can be compared per worker. An empty cache_dir disables the cache.
+    """
+    start = time.perf_counter()
+    data_dir = None
+    if cache_dir:
+        try:
+            data_dir = find_cached_frame(source_path, cache_dir)
+        except OSError as e:
+            print(f"Ignoring unreadable data cache: {e}")
+
+    if data_dir is not None:
+        df = read_cached_frame(data_dir)
+        version = os.path.basename(data_dir)
+        source = 'cache'
+    else:
+        if cache_dir:
+            fingerprint = file_fingerprint(source_path)
+            version = f"v{CACHE_VERSION}-{fingerprint['sha256'][:16]}"
+        else:
+            stat = os.stat(source_path)
+            version = f"{stat.st_size}-{stat.st_mtime_ns}"
+        df = build(source_path)
+        if cache_dir:
+            try:
+                data_dir = write_cached_frame(df, source_path, fingerprint, cache_dir)
+            except OSError as e:
+                print(f"Could not write data cache: {e}")
+        source = 'csv'
+
+    # Identifies this version of the data, e.g. for keying cached results
+    df.attrs['data_version'] = version
+    # Where state derived from this version can be kept next to it (see live_ingest.py)
+    if data_dir is not None:
+        df.attrs['cache_data_dir'] = data_dir
+
+    elapsed = time.perf_counter() - start
+    print(f"[pid {os.getpid()}] Loaded {len(df):,} rows from {source} in {elapsed:.3f}s")
+    return df
@@ -0,0 +1,55 @@
+import os
+import zlib
+
+# Streaming CSV export.
+#
+# Rows are written in fixed-size chunks through generators, so memory use
+# while exporting depends on the chunk size, not on how many rows match.
+
+EXPORT_CHUNK_ROWS = int(os.environ.get('SWIFTSHOP_EXPORT_CHUNK_ROWS', 50_000))
+
+
+def iter_csv_chunks(df, rows, chunk_rows=EXPORT_CHUNK_ROWS, header=True):
+    """Yield (CSV text, rows in it) for df.iloc[rows], header first, chunk_rows rows at a time."""
+    if header:
+        yield df.iloc[:0].to_csv(index=False), 0
+    for start in range(0, len(rows), chunk_rows):
+        chunk = df.iloc[rows[start:start + chunk_rows]]
+        yield chunk.to_csv(index=False, header=False), len(chunk)
+
+
+def iter_encoded(chunks, encoding='utf-8'):
+    for chunk in chunks:
+        yield chunk.encode(encoding)
+
+
+def iter_gzip(chunks, level=6):
+    """Gzip a stream of byte chunks on the fly."""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)  # 31 = gzip container
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def write_csv_file(path, chunks, compress=False, progress=None):
+    """Write a stream of (CSV text, rows in it) chunks (header first) to path, gzipped with compress.
+
+    Calls progress(rows) after each chunk with the number of data rows
+    written so far.
+    """
+    def counted(chunks):
+        written = 0
+        for text, rows in chunks:
+            yield text
+            written += rows
+            if progress is not None:
+                progress(written)
+
+    body = iter_encoded(counted(chunks))
+    if compress:
+        body = iter_gzip(body)
+    with open(path, 'wb') as f:
+        for data in body:
+            f.write(data)
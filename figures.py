@@ -0,0 +1,233 @@
+import base64
+import functools
+
+import numpy as np
+import pandas as pd
+import plotly.express as px
+import plotly.graph_objects as go
+
+from trends import PERIOD_LABELS
+
+# Figures of the dashboard.
+#
+# The *_figure functions build each chart with plotly.express, the way the
+# dashboard always has. Argument processing, template merging and
+# validation make that slower than the aggregation feeding it, so the
+# callbacks use the fast_* variants instead: every chart is built once
+# with plotly.express on sample data, its data arrays are taken out, and
+# each call puts the new arrays into a copy of that skeleton. The result is
+# the plain dict plotly.js receives, identical to the plotly.express figure
+# (benchmarks/bench_figures.py checks this).
+
+# Create a custom graph template for consistency
+custom_template = go.layout.Template()
+custom_template.layout.colorway = ['#3a7bd5', '#00d2ff', '#3498db', '#2ecc71', '#f39c12', '#e74c3c', '#9b59b6', '#1abc9c', '#34495e', '#f1c40f']
+custom_template.layout.font = dict(family="Segoe UI, Roboto, sans-serif", size=12, color="#495057")
+custom_template.layout.paper_bgcolor = "white"
+custom_template.layout.plot_bgcolor = "white"
+custom_template.layout.xaxis = dict(gridcolor="#f5f5f5", zerolinecolor="#f5f5f5")
+custom_template.layout.yaxis = dict(gridcolor="#f5f5f5", zerolinecolor="#f5f5f5")
+custom_template.layout.legend = dict(orientation="h", y=-0.2)
+custom_template.layout.margin = dict(l=40, r=40, t=50, b=50)
+
+
+# Heights of the dashboard's charts, whose placeholders are built at import
+CHART_HEIGHTS = (300, 350, 450)
+
+
+@functools.lru_cache(maxsize=None)
+def message_figure(height, text):
+    """Empty figure showing text, as a plotly.js dict.
+
+    Built once per height and text and shared by every caller, so it must
+    not be modified.
+    """
+    fig = go.Figure()
+    fig.add_annotation(
+        text=text,
+        xref="paper", yref="paper",
+        x=0.5, y=0.5, showarrow=False,
+        font=dict(size=16)
+    )
+    fig.update_layout(height=height)
+    return fig.to_plotly_json()
+
+
+def no_data_figure(height):
+    """Empty figure with a "No data" message (see message_figure)."""
+    return message_figure(height, "No data available for the selected filters")
+
+
+for _height in CHART_HEIGHTS:
+    no_data_figure(_height)
+
+
+def sales_time_figure(sales_by_month, granularity='month'):
+    """Sales Over Time line chart from (period, total_amount), e.g. sales_by_month (month_year, total_amount).
+
+    granularity ('day', 'week', 'month' or 'quarter') names the x axis.
+    """
+    period = sales_by_month.columns[0]
+    fig_time = px.line(sales_by_month, x=period, y='total_amount',
+                      labels={period: PERIOD_LABELS[granularity], 'total_amount': 'Revenue ($)'},
+                      template=custom_template)
+
+    fig_time.update_traces(mode='lines+markers',
+                          line=dict(width=3, color='#3a7bd5'),
+                          marker=dict(size=8, color='#00d2ff'))
+    # Force the x-axis to be categorical when there's only one data point
+    if len(sales_by_month) <= 1:
+        fig_time.update_layout(
+            xaxis=dict(type='category', tickangle=-45),
+            yaxis=dict(automargin=True),
+            title=None,
+            hovermode="x unified",
+            height=350,
+        )
+    else:
+        fig_time.update_layout(
+            xaxis_tickangle=-45,
+            yaxis=dict(automargin=True),
+            title=None,
+            hovermode="x unified",
+            height=350,
+        )
+
+    fig_time.update_yaxes(tickprefix="$", gridwidth=0.5)
+    return fig_time
+
+
+def category_figure(category_performance):
+    """Category Performance donut chart from (category, total_amount)."""
+    fig_category = px.pie(category_performance, values='total_amount', names='category',
+                         template=custom_template, hole=0.4)
+    fig_category.update_traces(textposition='inside', textinfo='percent+label')
+    fig_category.update_layout(
+        showlegend=True,
+        title=None,
+        uniformtext_minsize=10,
+        uniformtext_mode='hide',
+        height=300
+    )
+    return fig_category
+
+
+def rating_figure(rating_counts):
+    """Rating Distribution bar chart from the number of reviews per rating."""
+    fig_rating = px.bar(x=rating_counts.index.astype('float64'), y=rating_counts.values,
+                       labels={'x': 'Rating', 'y': 'Number of Reviews'},
+                       template=custom_template)
+    fig_rating.update_traces(marker_color='#3498db', opacity=0.8)
+    fig_rating.update_layout(
+        title=None,
+        xaxis=dict(tickmode='linear', tickvals=[1, 2, 3, 4, 5]),
+        height=300
+    )
+    return fig_rating
+
+
+def top_products_figure(top_products):
+    """Top 10 Products horizontal bar chart from (product_name, total_amount)."""
+    fig_top_products = px.bar(top_products, x='total_amount', y='product_name',
+                             orientation='h',
+                             labels={'total_amount': 'Revenue ($)', 'product_name': 'Product'},
+                             template=custom_template)
+    fig_top_products.update_traces(marker_color='#2ecc71', opacity=0.85)
+    fig_top_products.update_layout(
+        title=None,
+        yaxis={'categoryorder': 'total ascending',
+               'automargin': True },
+        xaxis=dict(tickprefix="$"),
+        height=450,
+    )
+    return fig_top_products
+
+
+# plotly.js names of the typed arrays it accepts
+TYPED_ARRAY_DTYPES = {
+    'int8': 'i1', 'uint8': 'u1',
+    'int16': 'i2', 'uint16': 'u2',
+    'int32': 'i4', 'uint32': 'u4',
+    'float32': 'f4', 'float64': 'f8',
+}
+
+
+def typed_array(values):
+    """Numeric values as a base64 typed array, the form plotly stores them in; text as a list."""
+    values = np.asarray(values)
+    if values.dtype.kind not in 'iuf' or values.size == 0:
+        return values.tolist()
+    if values.dtype.kind in 'iu' and values.dtype.itemsize == 8:
+        # plotly.js has no 64-bit integer arrays; use the smallest type that fits
+        for dtype in ('int8', 'int16', 'int32') if values.dtype.kind == 'i' else ('uint8', 'uint16', 'uint32'):
+            info = np.iinfo(dtype)
+            if values.min() >= info.min and values.max() <= info.max:
+                values = values.astype(dtype)
+                break
+        else:
+            return values.tolist()
+    return {'dtype': TYPED_ARRAY_DTYPES[str(values.dtype)],
+            'bdata': base64.b64encode(np.ascontiguousarray(values)).decode('ascii')}
+
+
+def _sample_frame(column, n_rows):
+    return pd.DataFrame({column: [f"{column}-{i}" for i in range(n_rows)],
+                         'total_amount': np.arange(1, n_rows + 1, dtype='float64')})
+
+
+@functools.lru_cache(maxsize=None)
+def _skeleton(chart, single_point=False, granularity='month'):
+    """(trace, layout) of a chart as plotly.js receives it, built once from sample data."""
+    if chart == 'sales_time':
+        figure = sales_time_figure(_sample_frame('period', 1 if single_point else 2), granularity)
+    elif chart == 'category':
+        figure = category_figure(_sample_frame('category', 2))
+    elif chart == 'rating':
+        figure = rating_figure(pd.Series([1, 2], index=pd.Index([1.0, 2.0])))
+    else:
+        figure = top_products_figure(_sample_frame('product_name', 2))
+    figure = figure.to_plotly_json()
+    (trace,) = figure['data']
+    return trace, figure['layout']
+
+
+def _figure(chart, arrays, single_point=False, granularity='month'):
+    # The skeleton dicts are shared between figures and never modified
+    trace, layout = _skeleton(chart, single_point, granularity)
+    return {'data': [{**trace, **arrays}], 'layout': layout}
+
+
+def fast_sales_time_figure(sales_by_month, granularity='month'):
+    return _figure('sales_time', {'x': typed_array(sales_by_month.iloc[:, 0]),
+                                  'y': typed_array(sales_by_month['total_amount'])},
+                   single_point=len(sales_by_month) <= 1, granularity=granularity)
+
+
+def fast_category_figure(category_performance):
+    return _figure('category', {'labels': typed_array(category_performance['category'].astype(object)),
+                                'values': typed_array(category_performance['total_amount'])})
+
+
+def fast_rating_figure(rating_counts):
+    return _figure('rating', {'x': typed_array(rating_counts.index.astype('float64')),
+                              'y': typed_array(rating_counts.to_numpy())})
+
+
+def fast_top_products_figure(top_products):
+    return _figure('top_products', {'x': typed_array(top_products['total_amount']),
+                                    'y': typed_array(top_products['product_name'].astype(object))})
+
+
+def client_skeletons():
+    """Every chart skeleton and placeholder, for building the same figures in the browser (see clientside.py).
+
+    sales_time maps each granularity to the skeletons for several points
+    and for a single one.
+    """
+    return {
+        'sales_time': {granularity: [list(_skeleton('sales_time', single_point, granularity))
+                                     for single_point in (False, True)]
+                       for granularity in PERIOD_LABELS},
+        **{chart: list(_skeleton(chart)) for chart in ('category', 'rating', 'top_products')},
+        'no_data': {str(height): no_data_figure(height) for height in CHART_HEIGHTS},
+    }
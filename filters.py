@@ -0,0 +1,269 @@
+import copy
+import functools
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from appendable import GrowableArray
+
+# Row selection for the dashboard filters (date range, regions, categories).
+#
+# Built once per dataset, the engine keeps the row order sorted by date, so
+# a date range is a searchsorted slice, and the row positions of every
+# region and category value, so a value filter never has to compare
+# strings. A selection is an array of row positions; nothing here copies
+# the frame.
+#
+# Rows appended by live refresh are indexed as they arrive. Their codes and
+# positions go into arrays with spare capacity (see appendable.py), and
+# rows that arrive out of date order wait in an unsorted tail, which a date
+# filter scans, until it holds an eighth of the rows and the date order is
+# sorted again.
+
+# The date order is sorted again once the unsorted tail holds 1/DATE_TAIL_SHARE of the rows
+DATE_TAIL_SHARE = 8
+
+
+@functools.lru_cache(maxsize=256)
+def parse_date(value):
+    """Timestamp for a date string from the date picker, parsed once per value."""
+    return pd.Timestamp(value).to_datetime64()
+
+
+class FilterEngine:
+    """Turns the dashboard filters into row positions of one frame."""
+
+    def __init__(self, df, value_columns=('customer_region', 'category')):
+        self.n_rows = len(df)
+        self._dates = df['order_date'].to_numpy()
+        self._index_dates()
+        self._growable = {}
+
+        # Per column: the code of every row, and the row positions of every value
+        self._codes = {}
+        self._positions = {}
+        for column in value_columns:
+            values = df[column]
+            if isinstance(values.dtype, pd.CategoricalDtype):
+                codes, uniques = values.cat.codes.to_numpy(), values.cat.categories
+            else:
+                codes, uniques = pd.factorize(values)
+            self._codes[column] = (codes, {value: code for code, value in enumerate(uniques)})
+            order = np.argsort(codes, kind='stable')
+            bounds = np.searchsorted(codes[order], np.arange(len(uniques) + 1))
+            self._positions[column] = {value: order[bounds[code]:bounds[code + 1]]
+                                       for code, value in enumerate(uniques)}
+
+    def _index_dates(self):
+        """Sort the date order over all rows."""
+        dates = self._dates
+        self._indexed = len(dates)  # rows covered by the date order; the rest are the tail
+        if len(dates) < 2 or (dates[1:] >= dates[:-1]).all():
+            self._date_order = None  # already in date order
+            self._sorted_dates = dates
+        else:
+            self._date_order = np.argsort(dates, kind='stable')
+            self._sorted_dates = dates[self._date_order]
+
+    def save(self, directory):
+        """Write the index arrays to a new directory, for load() to memory-map."""
+        if self._indexed < self.n_rows:
+            engine = copy.copy(self)
+            engine._index_dates()
+            return engine.save(directory)
+        os.makedirs(directory)
+        meta = {'n_rows': self.n_rows, 'date_order': self._date_order is not None, 'columns': {}}
+        if self._date_order is not None:
+            np.save(os.path.join(directory, 'date_order.npy'), self._date_order)
+            np.save(os.path.join(directory, 'sorted_dates.npy'), self._sorted_dates)
+        for position, (column, (codes, code_of)) in enumerate(self._codes.items()):
+            # The positions of all values back to back, in code order
+            values = sorted(code_of, key=code_of.get)
+            positions = [self._positions[column].get(value, np.empty(0, dtype=np.intp)) for value in values]
+            order = np.concatenate(positions) if positions else np.empty(0, dtype=np.intp)
+            np.save(os.path.join(directory, f"codes-{position}.npy"), codes)
+            np.save(os.path.join(directory, f"order-{position}.npy"), order)
+            meta['columns'][column] = {'values': values,
+                                       'bounds': np.cumsum([0] + [len(p) for p in positions]).tolist()}
+        with open(os.path.join(directory, 'filters.json'), 'w') as f:
+            json.dump(meta, f)
+
+    @classmethod
+    def load(cls, directory, df):
+        """Engine saved by save() for df, its arrays memory-mapped read-only."""
+        with open(os.path.join(directory, 'filters.json')) as f:
+            meta = json.load(f)
+        engine = cls.__new__(cls)
+        engine.n_rows = engine._indexed = meta['n_rows']
+        engine._dates = df['order_date'].to_numpy()
+        engine._growable = {}
+        if meta['date_order']:
+            engine._date_order = np.load(os.path.join(directory, 'date_order.npy'), mmap_mode='r')
+            engine._sorted_dates = np.load(os.path.join(directory, 'sorted_dates.npy'), mmap_mode='r')
+        else:
+            engine._date_order = None
+            engine._sorted_dates = engine._dates
+        engine._codes, engine._positions = {}, {}
+        for position, (column, saved) in enumerate(meta['columns'].items()):
+            codes = np.load(os.path.join(directory, f"codes-{position}.npy"), mmap_mode='r')
+            order = np.load(os.path.join(directory, f"order-{position}.npy"), mmap_mode='r')
+            values, bounds = saved['values'], saved['bounds']
+            engine._codes[column] = (codes, {value: code for code, value in enumerate(values)})
+            engine._positions[column] = {value: order[bounds[code]:bounds[code + 1]]
+                                         for code, value in enumerate(values)}
+        return engine
+
+    def _appendable(self, key, values):
+        """The GrowableArray under key holding values, shared by the engines extended from this one.
+
+        An engine that is not the newest gets a copy, so appending to it
+        never changes the arrays of the newer ones.
+        """
+        growable = self._growable.get(key)
+        if growable is None or growable.size != len(values) or not np.may_share_memory(growable.values, values):
+            growable = self._growable[key] = GrowableArray(values)
+        return growable
+
+    def extended(self, df):
+        """Engine for df, whose first n_rows rows are the ones this engine was built on.
+
+        Only the new rows are indexed, so the cost depends on their number:
+        their codes and positions are appended to the arrays of this engine.
+        Rows appended in date order extend the date order as they are; the
+        others join the unsorted tail.
+        """
+        engine = copy.copy(self)
+        new = df.iloc[self.n_rows:]
+        engine.n_rows = len(df)
+        if new.empty:
+            return engine
+
+        engine._dates = df['order_date'].to_numpy()
+        new_dates = engine._dates[self.n_rows:]
+        in_order = (new_dates[1:] >= new_dates[:-1]).all()
+        if (self._indexed == self.n_rows and self._date_order is None and in_order
+                and (not self.n_rows or new_dates[0] >= self._sorted_dates[-1])):
+            engine._indexed = engine.n_rows
+            engine._sorted_dates = engine._dates
+        elif (engine.n_rows - self._indexed) * DATE_TAIL_SHARE > engine.n_rows:
+            engine._index_dates()
+
+        engine._codes, engine._positions = {}, {}
+        for column, (codes, code_of) in self._codes.items():
+            code_of = dict(code_of)
+            values = new[column].astype(object)
+            for value in values.dropna().unique():
+                code_of.setdefault(value, len(code_of))
+            new_codes = values.map(code_of).fillna(-1).to_numpy(dtype=np.intp)
+            engine._codes[column] = (self._appendable(('codes', column), codes).append(new_codes), code_of)
+
+            positions = dict(self._positions[column])
+            value_of = {code: value for value, code in code_of.items()}
+            order = np.argsort(new_codes, kind='stable')
+            sorted_codes = new_codes[order]
+            for code in np.unique(sorted_codes[sorted_codes >= 0]):
+                value = value_of[code]
+                lo, hi = np.searchsorted(sorted_codes, [code, code + 1])
+                added = order[lo:hi] + self.n_rows
+                existing = positions.get(value, np.empty(0, dtype=np.intp))
+                positions[value] = self._appendable(('positions', column, value), existing).append(added)
+            engine._positions[column] = positions
+        return engine
+
+    def _tail_rows(self, start_date, end_date):
+        """Positions of the rows of the unsorted tail within the date range."""
+        dates = self._dates[self._indexed:]
+        return np.flatnonzero((dates >= parse_date(start_date)) & (dates <= parse_date(end_date))) + self._indexed
+
+    def _date_bounds(self, start_date, end_date):
+        lo = np.searchsorted(self._sorted_dates, parse_date(start_date), side='left')
+        hi = np.searchsorted(self._sorted_dates, parse_date(end_date), side='right')
+        return lo, hi
+
+    def _value_lookup(self, column, selected):
+        """Boolean table indexed by code (-1, i.e. missing, maps to the last slot)."""
+        codes, code_of = self._codes[column]
+        allowed = np.zeros(len(code_of) + 1, dtype=bool)
+        for value in selected:
+            if value in code_of:
+                allowed[code_of[value]] = True
+        return codes, allowed
+
+    def select(self, start_date=None, end_date=None, selected_regions=None, selected_categories=None):
+        """Positions (ascending) of the rows matching the filters.
+
+        Same rules as the callbacks: the date range applies only when both
+        ends are set, and an empty region or category list means no filter.
+        """
+        value_filters = [(column, selected) for column, selected in
+                         (('customer_region', selected_regions), ('category', selected_categories))
+                         if selected and len(selected) > 0]
+        use_dates = bool(start_date and end_date)
+
+        # Start from whichever filter leaves the fewest candidate rows
+        candidates = []
+        if use_dates:
+            lo, hi = self._date_bounds(start_date, end_date)
+            candidates.append((hi - lo + self.n_rows - self._indexed, 'date', None))
+        for column, selected in value_filters:
+            size = sum(len(self._positions[column].get(value, ())) for value in set(selected))
+            candidates.append((size, column, selected))
+        if not candidates:
+            return np.arange(self.n_rows)
+
+        _, source, selected = min(candidates, key=lambda candidate: candidate[0])
+        if source == 'date':
+            needs_sort = False
+            if self._date_order is not None and (hi - lo) * 8 > self.n_rows:
+                # Sorting a wide slice back into row order costs more than one
+                # scan, which covers the unsorted tail as well
+                start, end = parse_date(start_date), parse_date(end_date)
+                rows = np.flatnonzero((self._dates >= start) & (self._dates <= end))
+            else:
+                if self._date_order is None:
+                    rows = np.arange(lo, hi)
+                else:
+                    rows = self._date_order[lo:hi]
+                    needs_sort = True
+                if self._indexed < self.n_rows:
+                    rows = np.concatenate([rows, self._tail_rows(start_date, end_date)])
+        else:
+            parts = [self._positions[source][value] for value in set(selected) if value in self._positions[source]]
+            rows = np.concatenate(parts) if parts else np.empty(0, dtype=np.intp)
+            needs_sort = len(parts) > 1
+
+        # Apply the remaining filters to the candidates only
+        if use_dates and source != 'date':
+            dates = self._dates[rows]
+            rows = rows[(dates >= parse_date(start_date)) & (dates <= parse_date(end_date))]
+        for column, selected in value_filters:
+            if column != source:
+                codes, allowed = self._value_lookup(column, selected)
+                rows = rows[allowed[codes[rows]]]
+
+        if needs_sort:
+            rows = np.sort(rows)
+        return rows
+
+    def count(self, start_date=None, end_date=None, selected_regions=None, selected_categories=None):
+        """Number of rows matching the filters."""
+        return len(self.select(start_date, end_date, selected_regions, selected_categories))
+
+
+def filter_rows(df, start_date=None, end_date=None, selected_regions=None, selected_categories=None):
+    """Positions of the rows matching the filters, found with one scan.
+
+    For frames that are filtered only once (e.g. chunks streamed from disk),
+    where building a FilterEngine would not pay off.
+    """
+    mask = np.ones(len(df), dtype=bool)
+    if start_date and end_date:
+        dates = df['order_date'].to_numpy()
+        mask &= (dates >= parse_date(start_date)) & (dates <= parse_date(end_date))
+    if selected_regions and len(selected_regions) > 0:
+        mask &= df['customer_region'].isin(selected_regions).to_numpy()
+    if selected_categories and len(selected_categories) > 0:
+        mask &= df['category'].isin(selected_categories).to_numpy()
+    return np.flatnonzero(mask)
@@ -0,0 +1,419 @@
+import glob
+import hashlib
+import json
+import os
+import time
+
+import numpy as np
+import pandas as pd
+import psutil
+
+from aggregates import CubeBuilder
+from appendable import GROWTH
+from data_processing import (clean_sales_data, medians_from_counts, mode_from_counts,
+                             rating_counts, region_counts)
+from dataset_cache import read_cached_frame, write_frame
+from export import iter_csv_chunks
+from filters import filter_rows
+from table_query import page_from_chunks, query_rows
+
+# Chunked (out-of-core) ingestion of sales data that does not fit in memory.
+#
+# The source, one CSV or a directory of CSV files (e.g. one per day), is
+# read twice in fixed-size chunks. The first pass reads only the columns
+# the imputation needs and sums up the per-product rating counts and
+# per-customer region counts, plus which order_ids occur more than once.
+# The second pass cleans every chunk with those dataset-wide lookups,
+# exactly like the in-memory pipeline would, and feeds it into the
+# aggregate cube. Only the cube stays in memory; the table and the export
+# stream the source again when they need rows.
+
+# Peak memory the ingestion should stay under, in MB (0 = no budget)
+MEMORY_BUDGET_MB = float(os.environ.get('SWIFTSHOP_MEMORY_BUDGET_MB') or 0)
+
+# 'auto' (chunked when the data would not fit the budget), 'memory' or 'chunked'
+INGEST_MODE = os.environ.get('SWIFTSHOP_INGEST_MODE', 'auto')
+
+# Rows per chunk; 0 derives it from the budget
+INGEST_CHUNK_ROWS = int(os.environ.get('SWIFTSHOP_INGEST_CHUNK_ROWS') or 0)
+DEFAULT_CHUNK_ROWS = 250_000
+MIN_CHUNK_ROWS, MAX_CHUNK_ROWS = 10_000, 1_000_000
+
+SAMPLE_ROWS = 10_000
+LOOKUP_COLUMNS = ['order_id', 'customer_id', 'customer_region', 'product_id', 'customer_rating']
+
+
+def current_rss_mb():
+    """Resident memory of this process in MB."""
+    return psutil.Process().memory_info().rss / 1024 ** 2
+
+
+def source_files(path):
+    """The CSV files making up the source: the file itself, or a directory's *.csv in name order."""
+    if os.path.isdir(path):
+        return sorted(glob.glob(os.path.join(path, '*.csv')))
+    return [path]
+
+
+def iter_raw_chunks(path, chunk_rows, usecols=None):
+    """Uncleaned chunks of at most chunk_rows rows, across all source files."""
+    for file in source_files(path):
+        with pd.read_csv(file, chunksize=chunk_rows, usecols=usecols) as reader:
+            yield from reader
+
+
+def read_raw_source(path):
+    """The whole uncleaned source as one frame.
+
+    df.attrs['source_rows'] maps every file read to its number of rows.
+    """
+    frames = {file: pd.read_csv(file) for file in source_files(path)}
+    df = pd.concat(frames.values(), ignore_index=True) if len(frames) > 1 else next(iter(frames.values()))
+    df.attrs['source_rows'] = {file: len(frame) for file, frame in frames.items()}
+    return df
+
+
+def estimate_sizes(path):
+    """(estimated rows, estimated in-memory bytes per raw row) from a sample of the first file."""
+    files = source_files(path)
+    if not files:
+        return 0, 0
+    sample = pd.read_csv(files[0], nrows=SAMPLE_ROWS)
+    if sample.empty:
+        return 0, 0
+    csv_bytes_per_row = len(sample.to_csv(index=False, header=False).encode()) / len(sample)
+    memory_bytes_per_row = sample.memory_usage(index=False, deep=True).sum() / len(sample)
+    total_bytes = sum(os.path.getsize(file) for file in files)
+    return int(total_bytes / csv_bytes_per_row), memory_bytes_per_row
+
+
+def plan_ingest(path, mode=INGEST_MODE, budget_mb=MEMORY_BUDGET_MB, chunk_rows=INGEST_CHUNK_ROWS):
+    """Return (mode, chunk_rows) for loading path.
+
+    In 'auto' mode the data is loaded chunked when the raw frame would take
+    more than half the memory budget.
+    """
+    if mode not in ('auto', 'memory', 'chunked'):
+        raise ValueError(f"Unknown ingest mode {mode!r}; expected auto, memory or chunked")
+
+    n_rows, bytes_per_row = estimate_sizes(path) if budget_mb else (0, 0)
+    if mode == 'auto':
+        too_big = budget_mb and n_rows * bytes_per_row > budget_mb * 1024 ** 2 / 2
+        mode = 'chunked' if too_big else 'memory'
+
+    if not chunk_rows:
+        chunk_rows = DEFAULT_CHUNK_ROWS
+        if budget_mb and bytes_per_row:
+            # A raw chunk, its cleaned copy and the groupby temporaries fit in an eighth of the budget
+            chunk_rows = int(budget_mb * 1024 ** 2 / 8 / bytes_per_row)
+        chunk_rows = min(max(chunk_rows, MIN_CHUNK_ROWS), MAX_CHUNK_ROWS)
+    return mode, chunk_rows
+
+
+class RepeatedOrderIds:
+    """Tracks which order_ids occur more than once, across chunks.
+
+    Two bitsets over the range of ids seen so far (one bit per id), so the
+    memory use depends on the id range rather than the number of rows. They
+    grow with room to spare, so ids added in increasing batches (live
+    refresh) do not copy them every time.
+    """
+
+    def __init__(self):
+        self._offset = 0  # id of the first bit, a multiple of 8
+        self._seen = np.zeros(0, dtype=np.uint8)
+        self._repeated = np.zeros(0, dtype=np.uint8)
+
+    def _cover(self, low, high):
+        """Grow the bitsets so they cover ids low..high, with room to spare on the side they grow."""
+        if len(self._seen):
+            end = self._offset + len(self._seen) * 8  # first id past the bitsets
+            if low >= self._offset and high < end:
+                return
+            spare = int(len(self._seen) * 8 * (GROWTH - 1))
+            low = low - spare if low < self._offset else self._offset
+            high = high + spare if high >= end else end - 1
+        low -= low % 8
+        size = (high - low) // 8 + 1
+        shift = (self._offset - low) // 8
+        for name in ('_seen', '_repeated'):
+            grown = np.zeros(size, dtype=np.uint8)
+            old = getattr(self, name)
+            grown[shift:shift + len(old)] = old
+            setattr(self, name, grown)
+        self._offset = low
+
+    def _bits(self, ids):
+        position = ids - self._offset
+        return position >> 3, (1 << (position & 7)).astype(np.uint8)
+
+    @staticmethod
+    def _valid_ids(order_ids):
+        order_ids = pd.Series(order_ids).dropna()
+        return order_ids.to_numpy(dtype=np.int64)
+
+    def add(self, order_ids):
+        ids, counts = np.unique(self._valid_ids(order_ids), return_counts=True)
+        if not len(ids):
+            return
+        self._cover(int(ids[0]), int(ids[-1]))
+        byte, bit = self._bits(ids)
+        repeated = (counts > 1) | ((self._seen[byte] & bit) != 0)
+        np.bitwise_or.at(self._repeated, byte[repeated], bit[repeated])
+        np.bitwise_or.at(self._seen, byte, bit)
+
+    def _lookup(self, bitset, order_ids):
+        order_ids = pd.Series(order_ids)
+        result = np.zeros(len(order_ids), dtype=bool)
+        known = order_ids.notna().to_numpy()
+        if not len(bitset) or not known.any():
+            return result
+        ids = order_ids[known].to_numpy(dtype=np.int64)
+        inside = (ids >= self._offset) & (ids < self._offset + len(bitset) * 8)
+        byte, bit = self._bits(ids[inside])
+        flags = np.zeros(len(ids), dtype=bool)
+        flags[inside] = (bitset[byte] & bit) != 0
+        result[known] = flags
+        return result
+
+    def is_repeated(self, order_ids):
+        """Boolean array: does each order_id occur more than once in everything added?"""
+        return self._lookup(self._repeated, order_ids)
+
+    def is_seen(self, order_ids):
+        """Boolean array: has each order_id been added before?"""
+        return self._lookup(self._seen, order_ids)
+
+    def save(self, path):
+        np.savez(path, offset=self._offset, seen=self._seen, repeated=self._repeated)
+
+    @classmethod
+    def load(cls, path):
+        order_ids = cls()
+        with np.load(path) as saved:
+            order_ids._offset = int(saved['offset'])
+            order_ids._seen, order_ids._repeated = saved['seen'], saved['repeated']
+        return order_ids
+
+
+def _sum_counts(total, counts):
+    if total is None:
+        return counts
+    return pd.concat([total, counts]).groupby(level=[0, 1], observed=True).sum()
+
+
+class RunningCounts:
+    """Counts per (key, value), e.g. region counts per customer, summed batch by batch.
+
+    Kept as runs sorted by key: every batch becomes a run of its own, merged
+    with the one before it while it is at least half as long, so adding a
+    batch does not regroup the counts of everything added before, and the
+    counts of a few keys are found by binary search in each run.
+    """
+
+    def __init__(self):
+        self._runs = []  # (counts with a sorted (key, value) index, their keys)
+
+    def __len__(self):
+        return sum(len(counts) for counts, _ in self._runs)
+
+    def add(self, counts):
+        self._runs.append(counts.sort_index())
+        while len(self._runs) > 1 and 2 * len(self._runs[-1]) >= len(self._runs[-2][0]):
+            last = self._runs.pop()
+            self._runs[-1] = _sum_counts(self._runs[-1][0], last)
+        counts = self._runs[-1]
+        self._runs[-1] = (counts, counts.index.get_level_values(0).to_numpy())
+
+    def total(self):
+        """All the counts as one Series, or None if nothing was added."""
+        total = None
+        for counts, _ in self._runs:
+            total = _sum_counts(total, counts)
+        return total
+
+    def of(self, keys):
+        """The counts of the given keys only, as one Series."""
+        keys = pd.unique(pd.Series(keys).dropna().to_numpy())
+        total = None
+        for counts, run_keys in self._runs:
+            starts = np.searchsorted(run_keys, keys, side='left')
+            ends = np.searchsorted(run_keys, keys, side='right')
+            lengths = ends - starts
+            positions = np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(lengths.sum())
+            total = _sum_counts(total, counts.iloc[positions])
+        return total
+
+
+class ImputationLookups:
+    """Running totals behind the imputation lookups, built up chunk by chunk.
+
+    Holds the rating counts per product and region counts per customer of
+    the raw (not yet imputed) rows, and which order_ids occur more than once.
+    """
+
+    def __init__(self):
+        self.ratings = None
+        self.regions = RunningCounts()
+        self.order_ids = RepeatedOrderIds()
+        self.n_rows = 0
+
+    def add(self, raw):
+        self.n_rows += len(raw)
+        self.ratings = _sum_counts(self.ratings, rating_counts(raw))
+        self.regions.add(region_counts(raw))
+        self.order_ids.add(raw['order_id'])
+
+    def fill_values(self, customers=None):
+        """(median_by_product, overall_median, region_by_customer) for clean_sales_data().
+
+        With customers, the region lookup only covers those customer_ids.
+        """
+        if self.ratings is None or self.ratings.empty:
+            median_by_product, overall_median = pd.Series(dtype='float64'), np.nan
+        else:
+            # The overall median is the median of one product holding every rating
+            overall = self.ratings.groupby(level='customer_rating').sum()
+            overall.index = pd.MultiIndex.from_product([[0], overall.index], names=self.ratings.index.names)
+            overall_median = medians_from_counts(overall).iloc[0]
+            median_by_product = medians_from_counts(self.ratings)
+
+        regions = self.regions.total() if customers is None else self.regions.of(customers)
+        if regions is None or regions.empty:
+            return median_by_product, overall_median, pd.Series(dtype=object)
+        return median_by_product, overall_median, mode_from_counts(regions)
+
+    def save(self, directory):
+        """Write the lookups to a new directory, for load()."""
+        os.makedirs(directory)
+        for name, counts in (('ratings', self.ratings), ('regions', self.regions.total())):
+            if counts is not None:
+                write_frame(counts.rename('rows').reset_index(), os.path.join(directory, name))
+        self.order_ids.save(os.path.join(directory, 'order_ids.npz'))
+        with open(os.path.join(directory, 'lookups.json'), 'w') as f:
+            json.dump({'n_rows': self.n_rows}, f)
+
+    @classmethod
+    def load(cls, directory):
+        """Lookups saved by save()."""
+        with open(os.path.join(directory, 'lookups.json')) as f:
+            meta = json.load(f)
+        lookups = cls()
+        lookups.n_rows = meta['n_rows']
+        for name in ('ratings', 'regions'):
+            if os.path.isdir(os.path.join(directory, name)):
+                counts = read_cached_frame(os.path.join(directory, name))
+                counts = counts.set_index(list(counts.columns[:2]))['rows']
+                if name == 'ratings':
+                    lookups.ratings = counts
+                else:
+                    lookups.regions.add(counts)
+        lookups.order_ids = RepeatedOrderIds.load(os.path.join(directory, 'order_ids.npz'))
+        return lookups
+
+
+def scan_lookups(path, chunk_rows):
+    """First pass: the imputation lookups and repeated order_ids of the whole dataset."""
+    lookups = ImputationLookups()
+    for chunk in iter_raw_chunks(path, chunk_rows, usecols=LOOKUP_COLUMNS):
+        lookups.add(chunk)
+    return lookups
+
+
+def source_version(path, prefix='chunked'):
+    """Identifies the current version of the source files (names, sizes and mtimes)."""
+    stats = [(os.path.basename(file), os.stat(file).st_size, os.stat(file).st_mtime_ns)
+             for file in source_files(path)]
+    return f"{prefix}-{hashlib.sha256(repr(stats).encode()).hexdigest()[:16]}"
+
+
+class ChunkedSalesData:
+    """Sales data loaded in chunks: the cube in memory, the rows on disk."""
+
+    def __init__(self, path, chunk_rows, lookups, cube, columns, n_rows, data_version):
+        self.path = path
+        self.chunk_rows = chunk_rows
+        self.lookups = lookups
+        self.cube = cube
+        self.columns = columns
+        self.n_rows = n_rows
+        self.data_version = data_version
+
+    @classmethod
+    def load(cls, path, chunk_rows=DEFAULT_CHUNK_ROWS):
+        """Scan the source twice and build the cube, printing the time and memory it took."""
+        start = time.perf_counter()
+        data_version = source_version(path)
+        scanned = scan_lookups(path, chunk_rows)
+        lookups = scanned.fill_values()
+
+        # Counting the customers exactly would read the source again on every
+        # filter change, so the dashboard estimates them from the sketch
+        builder = CubeBuilder(customer_sketch=True)
+        columns = []
+        for chunk in iter_raw_chunks(path, chunk_rows):
+            chunk = clean_sales_data(chunk, *lookups)
+            columns = list(chunk.columns)
+            builder.add(chunk, scanned.order_ids.is_repeated(chunk['order_id']))
+        n_rows = scanned.n_rows
+        data = cls(path, chunk_rows, lookups, builder.build(), columns, n_rows, data_version)
+
+        elapsed = time.perf_counter() - start
+        print(f"[pid {os.getpid()}] Loaded {n_rows:,} rows in chunks of {chunk_rows:,} "
+              f"into {len(data.cube):,} cells in {elapsed:.3f}s (RSS {current_rss_mb():,.0f} MB)")
+        return data
+
+    def iter_chunks(self):
+        """Cleaned chunks, in source order."""
+        for chunk in iter_raw_chunks(self.path, self.chunk_rows):
+            yield clean_sales_data(chunk, *self.lookups)
+
+    def iter_matching(self, start_date=None, end_date=None, selected_regions=None,
+                      selected_categories=None, conditions=()):
+        """Cleaned chunks cut down to the rows matching the filters and table conditions."""
+        for chunk in self.iter_chunks():
+            rows = filter_rows(chunk, start_date, end_date, selected_regions, selected_categories)
+            if conditions:
+                rows = query_rows(chunk, conditions, rows)
+            yield chunk.iloc[rows]
+
+    def count(self, start_date=None, end_date=None, selected_regions=None, selected_categories=None):
+        """Number of rows matching the dashboard filters, from the cube."""
+        return self.cube.count(start_date, end_date, selected_regions, selected_categories)
+
+    def select(self, start_date=None, end_date=None, selected_regions=None, selected_categories=None):
+        """Cube cells matching the dashboard filters."""
+        return self.cube.select(start_date, end_date, selected_regions, selected_categories)
+
+    def distinct_customers(self, start_date=None, end_date=None, selected_regions=None, selected_categories=None,
+                           exact=False):
+        """Number of distinct customer_ids in the matching rows, estimated from the customer sketch.
+
+        With exact the CSV is read again to count them, which takes as long
+        as an export.
+        """
+        filters = (start_date, end_date, selected_regions, selected_categories)
+        if not exact:
+            return self.select(*filters).distinct_customers()
+        customers = [chunk['customer_id'].dropna().unique() for chunk in self.iter_matching(*filters)]
+        return len(pd.unique(np.concatenate(customers))) if customers else 0
+
+    def filter_values(self):
+        return self.cube.filter_values()
+
+    def table_page(self, filters, conditions, sort_by, page_current, page_size, columns=None):
+        """Same result as table_query.table_page over the matching rows, in one pass.
+
+        Without table conditions the page count comes from the cube and the
+        scan stops as soon as the page is complete.
+        """
+        total = None if conditions else self.count(*filters)
+        return page_from_chunks(self.iter_matching(*filters, conditions=conditions),
+                                sort_by, page_current, page_size, columns=columns, total=total)
+
+    def iter_csv(self, start_date=None, end_date=None, selected_regions=None, selected_categories=None):
+        """(CSV text, rows in it) for the matching rows, header first, one piece per source chunk."""
+        header = True
+        for chunk in self.iter_matching(start_date, end_date, selected_regions, selected_categories):
+            yield from iter_csv_chunks(chunk, np.arange(len(chunk)), header=header)
+            header = False
@@ -0,0 +1,205 @@
+import contextlib
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import psutil
+
+from dataset_cache import DEFAULT_CACHE_DIR
+
+# Background jobs, for the CSV export.
+#
+# With SWIFTSHOP_BACKGROUND_EXPORTS=1 the export button starts a job instead
+# of streaming the CSV from the request thread. Jobs run on a pool of
+# SWIFTSHOP_JOB_WORKERS threads per process and write their result to a
+# file; the dashboard polls the job for its progress, offers the file for
+# download once it is done, and can cancel it meanwhile.
+#
+# Jobs are recorded in a SQLite file next to their results, which all the
+# worker processes on the machine share: a job started through one worker
+# can be polled, cancelled and downloaded through any other. Every job has
+# a key (for an export: its filters, format and the data version). Asking
+# for a key that is already queued, running or done returns that job
+# instead of starting another, so identical exports run once and a
+# repeated export is served from the file of the first. Finished jobs are
+# removed after SWIFTSHOP_JOB_TTL_SECONDS, and the oldest first once their
+# files take more than SWIFTSHOP_JOB_CACHE_MB.
+
+BACKGROUND_EXPORTS = os.environ.get('SWIFTSHOP_BACKGROUND_EXPORTS', '') not in ('', '0')
+JOB_WORKERS = int(os.environ.get('SWIFTSHOP_JOB_WORKERS') or 2)
+JOB_DIR = os.environ.get('SWIFTSHOP_JOB_DIR') or os.path.join(DEFAULT_CACHE_DIR or '.', 'jobs')
+JOB_TTL_SECONDS = float(os.environ.get('SWIFTSHOP_JOB_TTL_SECONDS') or 3600)
+JOB_CACHE_MB = float(os.environ.get('SWIFTSHOP_JOB_CACHE_MB') or 1024)
+
+ACTIVE = ('queued', 'running')
+FINISHED = ('done', 'failed', 'cancelled')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    key TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    status TEXT NOT NULL,
+    done INTEGER NOT NULL DEFAULT 0,
+    total INTEGER NOT NULL DEFAULT 0,
+    filename TEXT NOT NULL,
+    path TEXT NOT NULL,
+    size INTEGER,
+    error TEXT,
+    pid INTEGER NOT NULL,
+    cancel INTEGER NOT NULL DEFAULT 0,
+    created REAL NOT NULL,
+    updated REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_key ON jobs (key);
+"""
+
+
+class JobCancelled(Exception):
+    """Raised in a job's thread once the job has been cancelled."""
+
+
+def job_key(*parts):
+    """Key of a job from JSON-able parts, e.g. its kind, filters and the data version."""
+    return hashlib.sha256(json.dumps(parts, default=str).encode()).hexdigest()
+
+
+class JobStore:
+    """Jobs in a SQLite file shared by the processes on this machine."""
+
+    def __init__(self, directory=JOB_DIR, ttl=JOB_TTL_SECONDS, max_mb=JOB_CACHE_MB):
+        # Absolute, since Flask's send_file takes relative paths from the app's directory
+        self.directory = os.path.abspath(directory)
+        self.ttl = ttl
+        self.max_bytes = max_mb * 1024 ** 2
+        self.path = os.path.join(self.directory, 'jobs.sqlite')
+        self._local = threading.local()
+        os.makedirs(self.directory, exist_ok=True)
+        self._connection().executescript(SCHEMA)
+
+    def _connection(self):
+        # sqlite3 connections belong to the thread that opened them
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL')
+        return conn
+
+    @contextlib.contextmanager
+    def _transaction(self):
+        # BEGIN IMMEDIATE takes the write lock up front, so two processes
+        # asking for the same key cannot both start a job
+        conn = self._connection()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            yield conn
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+
+    def get(self, job_id):
+        """The job as a dict, or None if there is no such job."""
+        row = self._connection().execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        return dict(row) if row is not None else None
+
+    def claim(self, key, kind, total, filename, reuse_done=True):
+        """(job, created): the queued, running or (with reuse_done) done job for key, or a new queued one."""
+        now = time.time()
+        with self._transaction() as conn:
+            rows = conn.execute("SELECT * FROM jobs WHERE key = ? AND status IN ('queued', 'running', 'done') "
+                                "ORDER BY created DESC", (key,)).fetchall()
+            for row in rows:
+                if row['status'] in ACTIVE and psutil.pid_exists(row['pid']):
+                    return dict(row), False
+                if row['status'] == 'done' and reuse_done and os.path.exists(row['path']):
+                    return dict(row), False
+                if row['status'] in ACTIVE:
+                    # The process running it is gone
+                    conn.execute("UPDATE jobs SET status = 'failed', error = 'interrupted', updated = ? "
+                                 "WHERE id = ?", (now, row['id']))
+            job_id = uuid.uuid4().hex
+            path = os.path.join(self.directory, job_id + os.path.splitext(filename)[1])
+            conn.execute("INSERT INTO jobs (id, key, kind, status, total, filename, path, pid, created, updated) "
+                         "VALUES (?, ?, ?, 'queued', ?, ?, ?, ?, ?, ?)",
+                         (job_id, key, kind, total, filename, path, os.getpid(), now, now))
+        return self.get(job_id), True
+
+    def update(self, job_id, **fields):
+        assignments = ', '.join(f"{name} = ?" for name in fields)
+        self._connection().execute(f"UPDATE jobs SET {assignments}, updated = ? WHERE id = ?",
+                                   (*fields.values(), time.time(), job_id))
+
+    def progress(self, job_id, done):
+        """Record how much of the job is done; True if it has been cancelled meanwhile."""
+        self.update(job_id, done=done)
+        return bool(self._connection().execute('SELECT cancel FROM jobs WHERE id = ?', (job_id,)).fetchone()[0])
+
+    def cancel(self, job_id):
+        """Ask a queued or running job to stop; its thread notices at its next progress report."""
+        self._connection().execute("UPDATE jobs SET cancel = 1, updated = ? WHERE id = ? AND status IN "
+                                   "('queued', 'running')", (time.time(), job_id))
+        return self.get(job_id)
+
+    def expire(self):
+        """Remove finished jobs older than the TTL, then the oldest results over the size limit."""
+        now = time.time()
+        with self._transaction() as conn:
+            finished = conn.execute("SELECT id, path, size, updated FROM jobs WHERE status IN "
+                                    "('done', 'failed', 'cancelled') ORDER BY updated DESC").fetchall()
+            kept_bytes = 0
+            for row in finished:
+                kept_bytes += row['size'] or 0
+                if now - row['updated'] > self.ttl or kept_bytes > self.max_bytes:
+                    conn.execute('DELETE FROM jobs WHERE id = ?', (row['id'],))
+                    with contextlib.suppress(FileNotFoundError):
+                        os.remove(row['path'])
+
+
+class JobQueue:
+    """Runs the jobs of a JobStore on a bounded pool of threads in this process."""
+
+    def __init__(self, store, workers=JOB_WORKERS):
+        self.store = store
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='swiftshop-job')
+
+    def submit(self, key, kind, total, filename, write, reuse_done=True):
+        """The job for key, started unless an identical one is queued, running or done.
+
+        write(path, progress) writes the result to path, calling progress(done)
+        as it goes; progress raises JobCancelled once the job is cancelled.
+        """
+        self.store.expire()
+        job, created = self.store.claim(key, kind, total, filename, reuse_done)
+        if created:
+            self._pool.submit(self._run, job, write)
+        return job
+
+    def _run(self, job, write):
+        store, job_id = self.store, job['id']
+
+        def progress(done):
+            if store.progress(job_id, done):
+                raise JobCancelled()
+
+        partial = job['path'] + '.partial'
+        try:
+            progress(0)
+            store.update(job_id, status='running')
+            write(partial, progress)
+            os.replace(partial, job['path'])
+            store.update(job_id, status='done', size=os.path.getsize(job['path']))
+        except JobCancelled:
+            store.update(job_id, status='cancelled')
+        except Exception as e:
+            print(f"Job {job_id} ({job['kind']}) failed: {e}")
+            store.update(job_id, status='failed', error=str(e))
+        finally:
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(partial)
@@ -0,0 +1,294 @@
+import io
+import os
+import shutil
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+from aggregates import CUBE_KEYS, LiveCube
+from appendable import GROWTH, AppendableFrame, GrowableArray
+from backends import SalesSnapshot
+from data_processing import clean_sales_data
+from ingest import LOOKUP_COLUMNS, ImputationLookups, source_files
+
+# Live refresh of the in-memory data.
+#
+# A background thread watches the source (the sales CSV, or a directory
+# that new CSV files are dropped into) for rows appended after the initial
+# load. Only the new rows are parsed and cleaned, then added to the frame,
+# the cube and the filter index, producing a new SalesSnapshot. Callbacks
+# read the current snapshot once per request, so they never combine the
+# rows of one version with the cube or index of another.
+#
+# Adding a batch costs time in proportion to the batch, not to the rows
+# loaded before: the columns are appended to in place (appendable.py), the
+# cube keeps the batches as cubes of their own (aggregates.LiveCube), and
+# the rows of an order_id seen again are found through OrderRows instead
+# of a scan of the frame.
+#
+# Missing values in the new rows are filled from lookups that include them;
+# rows loaded earlier keep the values they were filled with. The lookups of
+# the loaded rows are saved next to the dataset cache by the first worker
+# that needs them, so the others (and later starts on the same data) read
+# them instead of parsing the source's lookup columns again.
+#
+# Live refresh is off unless SWIFTSHOP_LIVE_REFRESH_SECONDS is set.
+
+LIVE_REFRESH_SECONDS = float(os.environ.get('SWIFTSHOP_LIVE_REFRESH_SECONDS') or 0)
+
+LOOKUPS_DIR = 'lookups'
+
+READ_BLOCK_SIZE = 8 * 1024 * 1024
+
+
+def offset_after_rows(path, n_rows):
+    """Byte offset just past the header line and the next n_rows lines of a CSV."""
+    remaining = n_rows + 1
+    offset = 0
+    with open(path, 'rb') as f:
+        while remaining:
+            block = f.read(READ_BLOCK_SIZE)
+            if not block:
+                break
+            count = block.count(b'\n')
+            if count < remaining:
+                remaining -= count
+                offset += len(block)
+                continue
+            end = -1
+            for _ in range(remaining):
+                end = block.index(b'\n', end + 1)
+            offset += end + 1
+            remaining = 0
+    return offset
+
+
+class SourceTail:
+    """Reads the complete lines added to the source files since the last read."""
+
+    def __init__(self, path, offsets):
+        self.path = path
+        self.offsets = dict(offsets)
+        self._columns = {}
+        self._truncated = set()
+
+    def _header(self, file):
+        if file not in self._columns:
+            self._columns[file] = list(pd.read_csv(file, nrows=0).columns)
+        return self._columns[file]
+
+    def _read_new_lines(self, file, offset):
+        with open(file, 'rb') as f:
+            f.seek(offset)
+            data = f.read()
+        # A line still being written is picked up on the next read
+        end = data.rfind(b'\n') + 1
+        return data[:end]
+
+    def read_new_rows(self):
+        """Raw frame of the rows added since the last call, or None if there are none."""
+        frames = []
+        for file in source_files(self.path):
+            if file in self._truncated:
+                continue
+            offset = self.offsets.get(file, 0)
+            size = os.path.getsize(file)
+            if size < offset:
+                print(f"{file} got shorter; restart the app to reload it")
+                self._truncated.add(file)
+                continue
+            if size == offset:
+                continue
+
+            data = self._read_new_lines(file, offset)
+            if not data:
+                continue
+            if offset == 0:
+                frame = pd.read_csv(io.BytesIO(data))
+            else:
+                frame = pd.read_csv(io.BytesIO(data), header=None, names=self._header(file))
+            self.offsets[file] = offset + len(data)
+            if len(frame):
+                frames.append(frame)
+        if not frames:
+            return None
+        return pd.concat(frames, ignore_index=True) if len(frames) > 1 else frames[0]
+
+
+def scan_loaded_rows(source_rows, chunk_rows=250_000):
+    """Imputation lookups over the rows already loaded from each file."""
+    lookups = ImputationLookups()
+    for file, n_rows in source_rows.items():
+        if not n_rows:
+            continue
+        with pd.read_csv(file, usecols=LOOKUP_COLUMNS, nrows=n_rows, chunksize=chunk_rows) as reader:
+            for chunk in reader:
+                lookups.add(chunk)
+    return lookups
+
+
+def loaded_lookups(df, source_rows):
+    """Imputation lookups over the loaded rows: the ones saved next to df's dataset cache, if any.
+
+    Otherwise the source is scanned, and the result saved there for next time.
+    """
+    data_dir = df.attrs.get('cache_data_dir')
+    directory = os.path.join(data_dir, LOOKUPS_DIR) if data_dir else None
+    if directory and os.path.isdir(directory):
+        try:
+            return ImputationLookups.load(directory)
+        except (OSError, ValueError, KeyError) as e:
+            print(f"Ignoring unreadable imputation lookups: {e}")
+
+    lookups = scan_loaded_rows(source_rows)
+    if directory:
+        tmp_dir = f"{directory}.tmp-{os.getpid()}"
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        try:
+            lookups.save(tmp_dir)
+            os.rename(tmp_dir, directory)
+        except OSError as e:
+            # Unwritable, or another worker saved them first
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            if not os.path.isdir(directory):
+                print(f"Could not save the imputation lookups: {e}")
+    return lookups
+
+
+class OrderRows:
+    """The rows of the frame each order_id occurs in.
+
+    The last row of every id is kept in an array over the range of ids
+    seen, and every row points to the row before it with the same id, so
+    the rows of a few ids are found by following those links.
+    """
+
+    def __init__(self):
+        self._offset = 0
+        self._last = np.zeros(0, dtype=np.int64)  # -1 for ids not seen
+        self._earlier = GrowableArray(np.zeros(0, dtype=np.int64))
+        self.n_rows = 0
+
+    def _cover(self, low, high):
+        if len(self._last):
+            end = self._offset + len(self._last)
+            if low >= self._offset and high < end:
+                return
+            spare = int(len(self._last) * (GROWTH - 1))
+            low = low - spare if low < self._offset else self._offset
+            high = high + spare if high >= end else end - 1
+        grown = np.full(high - low + 1, -1, dtype=np.int64)
+        grown[self._offset - low:self._offset - low + len(self._last)] = self._last
+        self._last, self._offset = grown, low
+
+    def add(self, order_ids):
+        """Record the order_ids of the rows appended to the frame."""
+        order_ids = pd.Series(order_ids)
+        earlier = np.full(len(order_ids), -1, dtype=np.int64)
+        known = np.flatnonzero(order_ids.notna().to_numpy())
+        if len(known):
+            ids = order_ids.iloc[known].to_numpy(dtype=np.int64)
+            self._cover(int(ids.min()), int(ids.max()))
+            order = np.argsort(ids, kind='stable')
+            ids, rows = ids[order] - self._offset, known[order] + self.n_rows
+            first = np.r_[True, ids[1:] != ids[:-1]]
+            last = np.r_[ids[1:] != ids[:-1], True]
+            before = np.r_[-1, rows[:-1]]
+            before[first] = self._last[ids[first]]
+            earlier[rows - self.n_rows] = before
+            self._last[ids[last]] = rows[last]
+        self._earlier.append(earlier)
+        self.n_rows += len(order_ids)
+
+    def rows(self, order_ids):
+        """Sorted rows of the given (known) order_ids."""
+        ids = np.asarray(order_ids, dtype=np.int64) - self._offset
+        ids = ids[(ids >= 0) & (ids < len(self._last))]
+        found = []
+        rows = self._last[ids]
+        rows = rows[rows >= 0]
+        while len(rows):
+            found.append(rows)
+            rows = self._earlier.values[rows]
+            rows = rows[rows >= 0]
+        return np.sort(np.concatenate(found)) if found else np.zeros(0, dtype=np.int64)
+
+
+class TailIngester:
+    """Background thread adding rows appended to the source to the current snapshot.
+
+    on_update(snapshot) is called after every update, from the thread.
+    """
+
+    def __init__(self, path, snapshot, interval=LIVE_REFRESH_SECONDS, on_update=None):
+        self.path = path
+        self.snapshot = snapshot
+        self.interval = interval
+        self.on_update = on_update
+        self._base_version = snapshot.data_version
+        self._tail = None
+        self._lookups = None
+        self._frame = None
+        self._order_rows = None
+        self._cube = None
+        self._thread = threading.Thread(target=self._run, name='tail-ingester', daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def prepare(self):
+        """Find where the loaded rows end in each file and get the lookups for them."""
+        df = self.snapshot.df
+        source_rows = df.attrs.get('source_rows') or {self.path: len(df)}
+        self._tail = SourceTail(self.path, {file: offset_after_rows(file, n_rows)
+                                            for file, n_rows in source_rows.items()})
+        self._lookups = loaded_lookups(df, source_rows)
+        self._frame = AppendableFrame(df)
+        self._order_rows = OrderRows()
+        self._order_rows.add(df['order_id'])
+        self._cube = LiveCube.of(self.snapshot.cube)
+
+    def _run(self):
+        try:
+            self.prepare()
+        except Exception as e:
+            print(f"Live refresh disabled: {e}")
+            return
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.poll()
+            except Exception as e:
+                print(f"Live refresh failed: {e}")
+
+    def poll(self):
+        """Add any new rows; returns how many were added."""
+        raw = self._tail.read_new_rows()
+        if raw is None:
+            return 0
+        start = time.perf_counter()
+        snapshot = self.snapshot
+
+        # Orders already loaded whose id shows up again
+        seen_before = self._lookups.order_ids.is_seen(raw['order_id'])
+        self._lookups.add(raw)
+        rows = clean_sales_data(raw, *self._lookups.fill_values(customers=raw['customer_id'].unique()))
+        repeated = self._lookups.order_ids.is_repeated(rows['order_id'])
+
+        earlier = self._order_rows.rows(rows['order_id'][seen_before].unique())
+        previous = snapshot.df.iloc[earlier, snapshot.df.columns.get_indexer(CUBE_KEYS + ['order_id'])]
+        self._order_rows.add(rows['order_id'])
+
+        df = self._frame.append(rows)
+        df.attrs['data_version'] = f"{self._base_version}+{len(df)}"
+        self._cube = self._cube.extend(rows, repeated, previous)
+        self.snapshot = SalesSnapshot(df, self._cube, snapshot.row_filter.extended(df), df.attrs['data_version'])
+
+        elapsed = time.perf_counter() - start
+        print(f"[pid {os.getpid()}] Added {len(rows):,} new rows in {elapsed:.3f}s ({len(df):,} in total)")
+        if self.on_update is not None:
+            self.on_update(self.snapshot)
+        return len(rows)
@@ -0,0 +1,58 @@
+import cProfile
+import os
+import re
+import time
+
+from flask import g, request
+
+# Optional per-request profiling with cProfile.
+#
+# With SWIFTSHOP_PROFILE_DIR set, every request runs under cProfile and its
+# profile is written to that directory as <time>-<unit or path>.prof, to be
+# read with pstats or a viewer such as snakeviz. Requests faster than
+# SWIFTSHOP_PROFILE_MIN_MS are not written. When the directory is not set
+# the hooks are not installed, so there is no cost at all.
+
+PROFILE_DIR = os.environ.get('SWIFTSHOP_PROFILE_DIR') or None
+PROFILE_MIN_MS = float(os.environ.get('SWIFTSHOP_PROFILE_MIN_MS') or 0)
+
+
+def _start_profile():
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError:
+        # Another profiler is already active in this thread
+        return
+    g.profiler = profiler
+    g.profile_start = time.perf_counter()
+
+
+def _save_profile(response):
+    profiler = g.pop('profiler', None)
+    if profiler is None:
+        return response
+    profiler.disable()
+    elapsed_ms = (time.perf_counter() - g.pop('profile_start')) * 1000
+    if elapsed_ms >= PROFILE_MIN_MS:
+        units = [name for name, _ in g.get('unit_timings', [])]
+        label = '+'.join(units) or request.path.strip('/') or 'index'
+        label = re.sub(r'[^A-Za-z0-9_.+-]', '_', label)[:80]
+        stamp = time.strftime('%Y%m%d-%H%M%S') + f"-{time.time() % 1 * 1000:03.0f}"
+        profiler.dump_stats(os.path.join(PROFILE_DIR, f"{stamp}-{label}-{elapsed_ms:.0f}ms.prof"))
+    return response
+
+
+def install_profiling(server):
+    """Profile every request of the Flask server if SWIFTSHOP_PROFILE_DIR is set.
+
+    Install it after the other after_request hooks: Flask runs them last
+    registered first, and the profile is named after the request's units.
+    """
+    if not PROFILE_DIR:
+        return False
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    server.before_request(_start_profile)
+    server.after_request(_save_profile)
+    print(f"Profiling every request into {PROFILE_DIR}")
+    return True
@@ -0,0 +1,183 @@
+import functools
+import hashlib
+import os
+import pickle
+import threading
+import time
+from collections import OrderedDict
+
+# Memoization of dashboard callbacks keyed on the filter state.
+#
+# Entries are bounded by count (least recently used goes first) and by age.
+# Every key also carries the version of the loaded data, so results computed
+# from an older dataset are never served after a reload. By default entries
+# live in this process; with a directory the entries are pickled files that
+# every worker on the machine shares (a directory under /dev/shm keeps them
+# in shared memory).
+
+DEFAULT_MAXSIZE = int(os.environ.get('SWIFTSHOP_RESULT_CACHE_SIZE', 64))
+DEFAULT_TTL = float(os.environ.get('SWIFTSHOP_RESULT_CACHE_TTL', 600))
+DEFAULT_DIRECTORY = os.environ.get('SWIFTSHOP_RESULT_CACHE_DIR') or None
+
+
+def normalize_filters(start_date, end_date, selected_regions, selected_categories, *_):
+    """Hashable key for a filter state.
+
+    Lists are sorted, None and [] mean the same thing (no filter), and the
+    date range only counts when both ends are set, like the callbacks do.
+    Further arguments are ignored (e.g. the data version the dashboard
+    passes along, which the cache already tracks itself).
+    """
+    if not (start_date and end_date):
+        start_date = end_date = None
+    return (start_date, end_date,
+            tuple(sorted(selected_regions or [])),
+            tuple(sorted(selected_categories or [])))
+
+
+class ResultCache:
+    """Bounded LRU + TTL cache with hit/miss counters."""
+
+    def __init__(self, maxsize=DEFAULT_MAXSIZE, ttl=DEFAULT_TTL, directory=DEFAULT_DIRECTORY,
+                 data_version=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.directory = directory
+        self.data_version = data_version
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def _expired(self, stored_at):
+        return self.ttl is not None and time.time() - stored_at > self.ttl
+
+    def _path(self, key):
+        digest = hashlib.sha256(repr((self.data_version, key)).encode()).hexdigest()
+        return os.path.join(self.directory, f"{digest}.pkl")
+
+    def get(self, key):
+        """Return (True, value) on a hit, (False, None) on a miss."""
+        with self._lock:
+            if self.directory:
+                found, value = self._get_file(key)
+            else:
+                found, value = self._get_memory(key)
+            if found:
+                self.hits += 1
+            else:
+                self.misses += 1
+            return found, value
+
+    def _get_memory(self, key):
+        entry = self._entries.get((self.data_version, key))
+        if entry is None:
+            return False, None
+        stored_at, value = entry
+        if self._expired(stored_at):
+            del self._entries[(self.data_version, key)]
+            return False, None
+        self._entries.move_to_end((self.data_version, key))
+        return True, value
+
+    def _get_file(self, key):
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                stored_at, value = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return False, None
+        if self._expired(stored_at):
+            self._remove(path)
+            return False, None
+        # The file's mtime records the last use, for LRU eviction across workers
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return True, value
+
+    def set(self, key, value):
+        with self._lock:
+            if self.directory:
+                self._set_file(key, value)
+            else:
+                self._entries[(self.data_version, key)] = (time.time(), value)
+                self._entries.move_to_end((self.data_version, key))
+                while len(self._entries) > self.maxsize:
+                    self._entries.popitem(last=False)
+
+    def _set_file(self, key, value):
+        path = self._path(key)
+        tmp_path = f"{path}.tmp-{os.getpid()}-{threading.get_ident()}"
+        with open(tmp_path, 'wb') as f:
+            pickle.dump((time.time(), value), f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+
+        entries = [entry for entry in os.scandir(self.directory) if entry.name.endswith('.pkl')]
+        if len(entries) > self.maxsize:
+            entries.sort(key=lambda entry: entry.stat().st_mtime)
+            for entry in entries[:len(entries) - self.maxsize]:
+                self._remove(entry.path)
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def invalidate(self, data_version=None):
+        """Drop every entry, e.g. after the data was reloaded.
+
+        Passing the new data version also keeps other workers that still
+        hold the old data from serving or storing results under it.
+        """
+        with self._lock:
+            if data_version is not None:
+                self.data_version = data_version
+            self._entries.clear()
+            if self.directory:
+                for entry in os.scandir(self.directory):
+                    if entry.name.endswith('.pkl'):
+                        self._remove(entry.path)
+
+    def stats(self):
+        with self._lock:
+            if self.directory:
+                size = sum(1 for entry in os.scandir(self.directory) if entry.name.endswith('.pkl'))
+            else:
+                size = len(self._entries)
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total else 0.0,
+            'size': size,
+            'maxsize': self.maxsize,
+            'ttl': self.ttl,
+        }
+
+    def memoize(self, func=None, key=normalize_filters):
+        """Decorator caching func's return value under key(*args).
+
+        Keys also carry the function's name, so several functions can share
+        one cache.
+        """
+        if func is None:
+            return functools.partial(self.memoize, key=key)
+
+        @functools.wraps(func)
+        def wrapper(*args):
+            cache_key = (func.__name__, key(*args))
+            found, value = self.get(cache_key)
+            if found:
+                return value
+            value = func(*args)
+            self.set(cache_key, value)
+            return value
+
+        wrapper.cache = self
+        return wrapper
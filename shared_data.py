@@ -0,0 +1,184 @@
+"""Build the shared dataset for a sales CSV (run by the app, or ahead of starting the workers).
+
+    python -m shared_data swiftshop_sales_data.csv
+"""
+import argparse
+import contextlib
+import os
+import shutil
+import subprocess
+import sys
+import threading
+import time
+
+from aggregates import SAVE_FORMAT, SalesCube
+from backends import SalesSnapshot
+from data_processing import clean_sales_data
+from dataset_cache import DEFAULT_CACHE_DIR, find_cached_frame, load_with_cache, read_cached_frame
+from filters import FilterEngine
+from ingest import current_rss_mb, read_raw_source
+from sketches import CUSTOMER_SKETCH
+
+# One copy of the dataset for all worker processes.
+#
+# Normally every worker process loads the data and builds the aggregate cube
+# and the filter index on its own, so N workers hold N copies of all of it.
+# In shared mode a separate loader process cleans the data once and writes
+# the frame (in the dataset cache), the cube and the filter index as .npy
+# files. The workers map those files read-only: the pages are held once, in
+# the OS page cache, however many workers map them. The cube is written
+# sorted and typed as SalesCube keeps it, together with the prefix sums and
+# sketch arrays it would otherwise derive, so attaching copies none of it.
+#
+# A file lock makes sure only one loader runs at a time; workers that start
+# meanwhile wait for it and then attach to what it built. When the CSV
+# changes, the first worker to notice runs the loader again, and every
+# worker switches to the new version once it has been published.
+
+SHARED_DATA = os.environ.get('SWIFTSHOP_SHARED_DATA', '') not in ('', '0')
+
+# Approximate and clientside mode add the customer sketch to the cube
+SHARED_DIR = f"shared{'-approximate' if CUSTOMER_SKETCH else ''}-v{SAVE_FORMAT}"
+LOCK_FILE = '.lock'
+
+
+@contextlib.contextmanager
+def file_lock(path):
+    """Exclusive lock on path across processes, held for the duration of the block."""
+    with open(path, 'a+') as f:
+        if os.name == 'nt':
+            import msvcrt
+            while True:
+                try:
+                    msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    pass  # LK_LOCK gives up after 10 seconds; keep waiting
+            try:
+                yield
+            finally:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+        else:
+            import fcntl
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def read_sales_csv(path):
+    return clean_sales_data(read_raw_source(path))
+
+
+def build_shared(source_path, cache_dir=DEFAULT_CACHE_DIR):
+    """Clean the data into the dataset cache and add the cube and filter index next to it."""
+    df = load_with_cache(source_path, read_sales_csv, cache_dir)
+    data_dir = find_cached_frame(source_path, cache_dir)
+    shared_dir = os.path.join(data_dir, SHARED_DIR)
+    if os.path.isdir(shared_dir):
+        return data_dir
+
+    start = time.perf_counter()
+    cube = SalesCube.from_frame(df)
+    tmp_dir = f"{shared_dir}.tmp-{os.getpid()}"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    cube.save(tmp_dir)
+    FilterEngine(df).save(os.path.join(tmp_dir, 'filters'))
+    os.rename(tmp_dir, shared_dir)
+    print(f"[pid {os.getpid()}] Built the shared cube and filter index in {time.perf_counter() - start:.3f}s")
+    return data_dir
+
+
+def _find_shared(source_path, cache_dir):
+    data_dir = find_cached_frame(source_path, cache_dir)
+    if data_dir is not None and os.path.isdir(os.path.join(data_dir, SHARED_DIR)):
+        return data_dir
+    return None
+
+
+def attach(data_dir):
+    """Snapshot of the shared data in data_dir; the rows, the cube and the index are read-only memory maps."""
+    shared_dir = os.path.join(data_dir, SHARED_DIR)
+    df = read_cached_frame(data_dir)
+    df.attrs['data_version'] = os.path.basename(data_dir)
+    cube = SalesCube.load(shared_dir)
+    row_filter = FilterEngine.load(os.path.join(shared_dir, 'filters'), df)
+    return SalesSnapshot(df, cube, row_filter, df.attrs['data_version'])
+
+
+def load_shared(source_path, cache_dir=DEFAULT_CACHE_DIR):
+    """Attach to the shared data for source_path, running the loader first if it is missing or stale."""
+    if not cache_dir:
+        raise ValueError("Shared mode keeps the data in the cache directory; set SWIFTSHOP_CACHE_DIR")
+    if os.path.isdir(source_path):
+        raise ValueError("Shared mode needs a single CSV file, not a directory")
+    start = time.perf_counter()
+    data_dir = _find_shared(source_path, cache_dir)
+    if data_dir is None:
+        os.makedirs(cache_dir, exist_ok=True)
+        with file_lock(os.path.join(cache_dir, LOCK_FILE)):
+            # Another worker may have built it while this one waited
+            data_dir = _find_shared(source_path, cache_dir)
+            if data_dir is None:
+                # A separate process, so the memory used while building is returned afterwards
+                # (run from this module's directory, so the paths must not be relative)
+                subprocess.run([sys.executable, '-m', 'shared_data', os.path.abspath(source_path),
+                                '--cache-dir', os.path.abspath(cache_dir)],
+                               check=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+                data_dir = _find_shared(source_path, cache_dir)
+
+    snapshot = attach(data_dir)
+    print(f"[pid {os.getpid()}] Attached to shared data {snapshot.data_version} "
+          f"({len(snapshot.df):,} rows) in {time.perf_counter() - start:.3f}s (RSS {current_rss_mb():,.0f} MB)")
+    return snapshot
+
+
+class SharedDataWatcher:
+    """Background thread switching to a new shared version when the source changes.
+
+    on_update(snapshot) is called after every switch, from the thread.
+    """
+
+    def __init__(self, source_path, snapshot, interval, on_update=None, cache_dir=DEFAULT_CACHE_DIR):
+        self.source_path = source_path
+        self.snapshot = snapshot
+        self.interval = interval
+        self.on_update = on_update
+        self.cache_dir = cache_dir
+        self._thread = threading.Thread(target=self._run, name='shared-data-watcher', daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.poll()
+            except Exception as e:
+                print(f"Shared data reload failed: {e}")
+
+    def poll(self):
+        """Switch to the current version if it changed; returns True if it did."""
+        data_dir = _find_shared(self.source_path, self.cache_dir)
+        if data_dir is not None and os.path.basename(data_dir) == self.snapshot.data_version:
+            return False
+        self.snapshot = load_shared(self.source_path, self.cache_dir)
+        if self.on_update is not None:
+            self.on_update(self.snapshot)
+        return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('source')
+    parser.add_argument('--cache-dir', default=DEFAULT_CACHE_DIR)
+    args = parser.parse_args()
+    build_shared(args.source, args.cache_dir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,149 @@
+import math
+import os
+
+import numpy as np
+import pandas as pd
+
+# Mergeable sketches for the approximate mode of the aggregate cube.
+#
+# HyperLogLog counts distinct customers: every customer_id is hashed to one
+# of 2**precision registers, which keeps the longest run of leading zero
+# bits seen. Registers of two sets merge with an elementwise max, so one
+# sketch per bucket of the data can be combined into the sketch of any
+# selection of buckets. The relative standard error is 1.04 / sqrt(2**precision).
+#
+# Top counters find the products with the highest revenue: each bucket keeps
+# only its largest counters, and the largest value it dropped (its floor)
+# bounds what any product missing from it can have had there. Summed over
+# buckets, a product's revenue is never overstated, and understated by at
+# most the floors of the buckets it is missing from.
+
+# Answer top products and distinct customers from sketches instead of exactly
+APPROXIMATE = os.environ.get('SWIFTSHOP_APPROXIMATE', '') not in ('', '0')
+
+# Compute the KPIs and charts in the browser (see clientside.py), which
+# estimates distinct customers from the customer sketch
+CLIENTSIDE = os.environ.get('SWIFTSHOP_CLIENTSIDE', '') not in ('', '0')
+
+# Whether the cube keeps the customer sketch
+CUSTOMER_SKETCH = APPROXIMATE or CLIENTSIDE
+
+# Target relative standard error of the distinct customer count
+DISTINCT_ERROR = float(os.environ.get('SWIFTSHOP_DISTINCT_ERROR') or 0.02)
+
+# Counters kept per bucket of the top products sketch
+TOPK_COUNTERS = int(os.environ.get('SWIFTSHOP_TOPK_COUNTERS') or 1000)
+
+
+def hll_precision(error):
+    """Smallest precision whose standard error is at most error (between 4 and 16)."""
+    return min(16, max(4, math.ceil(math.log2((1.04 / error) ** 2))))
+
+
+HLL_PRECISION = hll_precision(DISTINCT_ERROR)
+
+
+def _hash(values):
+    values = np.asarray(values)
+    if values.dtype.kind in 'iuf':
+        # The same id hashes the same whether it was read as int or float
+        values = values.astype(np.int64)
+    return pd.util.hash_array(values)
+
+
+def _bit_length(values):
+    """Number of significant bits of every uint64."""
+    values = values.copy()
+    length = np.zeros(len(values), dtype=np.uint8)
+    for shift in (32, 16, 8, 4, 2, 1):
+        high = values >> np.uint64(shift) != 0
+        length[high] += shift
+        values[high] >>= np.uint64(shift)
+    return length + (values != 0)
+
+
+def hll_entries(values, precision=HLL_PRECISION):
+    """(register, rank) of each value, the register update one value makes."""
+    hashes = _hash(values)
+    low_bits = 64 - precision
+    registers = (hashes >> np.uint64(low_bits)).astype(np.int32)
+    rest = hashes & np.uint64((1 << low_bits) - 1)
+    ranks = (low_bits + 1 - _bit_length(rest)).astype(np.uint8)
+    return registers, ranks
+
+
+def fold_registers(registers, ranks, precision, new_precision):
+    """(register, rank) entries of a sketch with precision as entries of one with a lower new_precision.
+
+    The register bits dropped from the index become the leading bits of the
+    rest of the hash, so the result equals a sketch built at new_precision.
+    """
+    shift = precision - new_precision
+    dropped = (np.asarray(registers) & ((1 << shift) - 1)).astype(np.uint64)
+    ranks = np.where(dropped != 0, shift + 1 - _bit_length(dropped).astype(np.int64),
+                     np.asarray(ranks, dtype=np.int64) + shift)
+    return np.asarray(registers) >> shift, ranks.astype(np.uint8)
+
+
+def _sigma(x):
+    if x == 1:
+        return math.inf
+    y, z = 1.0, x
+    while True:
+        x *= x
+        previous, z = z, z + x * y
+        y += y
+        if z == previous:
+            return z
+
+
+def _tau(x):
+    if x in (0, 1):
+        return 0.0
+    y, z = 1.0, 1 - x
+    while True:
+        x = math.sqrt(x)
+        previous = z
+        y *= 0.5
+        z -= (1 - x) ** 2 * y
+        if z == previous:
+            return z / 3
+
+
+def hll_estimate(registers):
+    """Distinct count estimated from HyperLogLog registers.
+
+    Uses Ertl's improved estimator ("New cardinality estimation algorithms
+    for HyperLogLog sketches", 2017), which needs no empirical bias
+    correction for small or large counts.
+    """
+    m = len(registers)
+    low_bits = 64 - int(math.log2(m))
+    counts = np.bincount(registers, minlength=low_bits + 2)
+    if counts[0] == m:
+        return 0.0
+    z = m * _tau(1 - counts[low_bits + 1] / m)
+    for k in range(low_bits, 0, -1):
+        z = 0.5 * (z + counts[k])
+    z += m * _sigma(counts[0] / m)
+    return m * m / (2 * math.log(2) * z)
+
+
+def top_counters(buckets, items, values, n_buckets, counters=TOPK_COUNTERS):
+    """Keep the counters largest values of each bucket.
+
+    Takes one value per (bucket, item), with buckets numbered from 0 to
+    n_buckets - 1. Returns the kept rows as a boolean mask and the floor of
+    every bucket: its largest dropped value, 0 if nothing was dropped.
+    """
+    order = np.lexsort((items, -values, buckets))
+    sorted_buckets = buckets[order]
+    starts = np.flatnonzero(np.r_[True, sorted_buckets[1:] != sorted_buckets[:-1]])
+    rank = np.arange(len(order)) - np.repeat(starts, np.diff(np.r_[starts, len(order)]))
+
+    kept = np.zeros(len(order), dtype=bool)
+    kept[order[rank < counters]] = True
+    floors = np.zeros(n_buckets, dtype=values.dtype)
+    first_dropped = order[rank == counters]
+    floors[buckets[first_dropped]] = values[first_dropped]
+    return kept, floors
@@ -0,0 +1,424 @@
+import functools
+import json
+import math
+import os
+import pathlib
+import sqlite3
+import threading
+import time
+from contextlib import closing
+
+import numpy as np
+import pandas as pd
+
+from aggregates import from_cents, to_cents
+from data_processing import clean_sales_data
+from dataset_cache import DEFAULT_CACHE_DIR
+from export import iter_csv_chunks
+from ingest import DEFAULT_CHUNK_ROWS, current_rss_mb, iter_raw_chunks, scan_lookups, source_version
+from shared_data import LOCK_FILE, file_lock
+from table_query import page_from_chunks, page_records, query_rows
+from trends import TREND_MAX_POINTS, day_numbers, range_start_day, sales_trend
+
+# SQLite backend: the cleaned rows in one on-disk table.
+#
+# The store is built once from the source, in chunks and with the same
+# cleaning as the chunked ingestion, and rebuilt when the source changes.
+# Every worker opens the same file read-only, so the rows are on disk once
+# instead of in each worker's memory. The dashboard filters become a WHERE
+# clause on indexed columns, and the KPIs and charts are GROUP BY queries,
+# so only the aggregated results come back to Python. Revenue is stored in
+# integer cents as well, so totals match the pandas backends to the cent.
+#
+# A small table of row counts per (day, region, category) is kept in memory.
+# It answers count() without touching the rows, and tells whether the
+# filters select few enough rows for the indexes to pay off: reading a
+# large share of the table through an index is several times slower than
+# scanning it.
+#
+# Like the chunked ingestion, the store does not pick up appended rows
+# while the app runs.
+
+# Bump this whenever the layout of the store changes.
+STORE_VERSION = 1
+
+SQLITE_PATH = os.environ.get('SWIFTSHOP_SQLITE_PATH') or os.path.join(DEFAULT_CACHE_DIR or '.', 'sales.sqlite')
+
+INDEXED_COLUMNS = ['order_date', 'customer_region', 'category']
+
+# Use the indexes only when the filters select at most this share of the rows
+INDEX_MAX_FRACTION = 0.1
+
+# Dates are stored as text in this format, which sorts chronologically
+DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+
+def _quote(column):
+    return '"' + column.replace('"', '""') + '"'
+
+
+def _sql_type(dtype):
+    if dtype.kind in 'iub':
+        return 'INTEGER'
+    if dtype.kind == 'f':
+        return 'REAL'
+    return 'TEXT'
+
+
+def _column_values(series):
+    """Values of a cleaned column as plain Python objects SQLite can store (None for missing)."""
+    if pd.api.types.is_datetime64_any_dtype(series):
+        series = series.dt.strftime(DATE_FORMAT)
+    elif isinstance(series.dtype, pd.PeriodDtype):
+        series = series.astype(str).where(series.notna())
+    elif series.dtype.kind in 'iubf':
+        return series.tolist()  # NaN is stored as NULL
+    return series.astype(object).where(series.notna(), None).tolist()
+
+
+def _merge_dtype(known, dtype):
+    """A dtype holding the values of both chunks (chunks are downcast on their own)."""
+    if known is None or known == str(dtype):
+        return str(dtype)
+    if np.dtype(known).kind in 'iuf' and dtype.kind in 'iuf':
+        return str(np.promote_types(known, dtype))
+    return known
+
+
+def build_store(source, path, data_version, chunk_rows=DEFAULT_CHUNK_ROWS):
+    """Clean the source in chunks into a new SQLite file at path, replacing it atomically."""
+    start = time.perf_counter()
+    scanned = scan_lookups(source, chunk_rows)
+    fill_values = scanned.fill_values()
+
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp_path = f"{path}.tmp-{os.getpid()}"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+
+    columns, dtypes, n_rows, counts = None, {}, 0, []
+    with closing(sqlite3.connect(tmp_path)) as conn:
+        conn.execute('PRAGMA journal_mode=OFF')
+        conn.execute('PRAGMA synchronous=OFF')
+        for chunk in iter_raw_chunks(source, chunk_rows):
+            chunk = clean_sales_data(chunk, *fill_values)
+            if columns is None:
+                columns = list(chunk.columns)
+                definitions = ', '.join(f"{_quote(c)} {_sql_type(chunk[c].dtype)}" for c in columns)
+                conn.execute(f"CREATE TABLE sales ({definitions}, revenue_cents INTEGER)")
+                insert = f"INSERT INTO sales VALUES ({', '.join('?' * len(columns))}, ?)"
+            for column in columns:
+                dtypes[column] = _merge_dtype(dtypes.get(column), chunk[column].dtype)
+            values = [_column_values(chunk[column]) for column in columns]
+            values.append(to_cents(chunk['total_amount']).tolist())
+            conn.executemany(insert, zip(*values))
+            n_rows += len(chunk)
+            counts.append(chunk.groupby(INDEXED_COLUMNS, observed=True, dropna=False).size())
+
+        for column in INDEXED_COLUMNS:
+            conn.execute(f"CREATE INDEX idx_sales_{column} ON sales ({_quote(column)})")
+        conn.execute('ANALYZE')
+
+        counts = pd.concat(counts).groupby(level=INDEXED_COLUMNS, observed=True, dropna=False).sum()
+        counts = counts.rename('n_rows').reset_index()
+        conn.execute('CREATE TABLE filter_counts (order_date TEXT, customer_region TEXT, '
+                     'category TEXT, n_rows INTEGER)')
+        conn.executemany('INSERT INTO filter_counts VALUES (?, ?, ?, ?)',
+                         zip(*[_column_values(counts[column]) for column in counts.columns]))
+        conn.execute('CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT)')
+        meta = {'store_version': STORE_VERSION, 'data_version': data_version,
+                'columns': columns, 'dtypes': dtypes, 'n_rows': n_rows}
+        conn.executemany('INSERT INTO meta VALUES (?, ?)', [(k, json.dumps(v)) for k, v in meta.items()])
+        conn.commit()
+    os.replace(tmp_path, path)
+
+    elapsed = time.perf_counter() - start
+    print(f"[pid {os.getpid()}] Built SQLite store {path} with {n_rows:,} rows in {elapsed:.3f}s")
+
+
+def _connect(path):
+    return sqlite3.connect(pathlib.Path(path).resolve().as_uri() + '?mode=ro', uri=True)
+
+
+def read_meta(path):
+    """The metadata of the store at path, or None if there is no usable store."""
+    if not os.path.exists(path):
+        return None
+    try:
+        with closing(_connect(path)) as conn:
+            return {key: json.loads(value) for key, value in conn.execute('SELECT key, value FROM meta')}
+    except sqlite3.Error:
+        return None
+
+
+def _is_current(meta, data_version):
+    return (meta is not None and meta.get('store_version') == STORE_VERSION
+            and meta.get('data_version') == data_version)
+
+
+def where_clause(start_date=None, end_date=None, selected_regions=None, selected_categories=None):
+    """(conditions, parameters) for the dashboard filters, with the same rules as the pandas backends."""
+    conditions, params = [], []
+    if start_date and end_date:
+        conditions.append('order_date BETWEEN ? AND ?')
+        params += [pd.Timestamp(start_date).strftime(DATE_FORMAT), pd.Timestamp(end_date).strftime(DATE_FORMAT)]
+    for column, selected in (('customer_region', selected_regions), ('category', selected_categories)):
+        if selected and len(selected) > 0:
+            conditions.append(f"{column} IN ({', '.join('?' * len(selected))})")
+            params += list(selected)
+    return conditions, params
+
+
+def _where(conditions):
+    return ' WHERE ' + ' AND '.join(conditions) if conditions else ''
+
+
+class SqliteSalesStore:
+    """Sales rows in a SQLite file; filters and aggregations run as SQL."""
+
+    def __init__(self, path, meta, chunk_rows=DEFAULT_CHUNK_ROWS):
+        self.path = path
+        self.chunk_rows = chunk_rows
+        self.columns = meta['columns']
+        self.dtypes = meta['dtypes']
+        self.n_rows = meta['n_rows']
+        self.data_version = meta['data_version']
+        self._local = threading.local()
+
+        # Missing dates last, as numpy sorts NaT, so the dates stay searchable
+        counts = self.query_frame('SELECT * FROM filter_counts ORDER BY order_date IS NULL, order_date')
+        self._count_dates = pd.to_datetime(counts['order_date'], format=DATE_FORMAT).to_numpy()
+        self._count_values = {column: counts[column] for column in ('customer_region', 'category')}
+        self._counts = counts['n_rows'].to_numpy()
+
+    @classmethod
+    def open(cls, source, path=SQLITE_PATH, chunk_rows=DEFAULT_CHUNK_ROWS):
+        """Open the store for source, building it first if it is missing or out of date."""
+        data_version = source_version(source, prefix='sqlite')
+        meta = read_meta(path)
+        if not _is_current(meta, data_version):
+            os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+            # The same lock as the shared data loader, so one worker builds and the others wait
+            with file_lock(os.path.join(os.path.dirname(path) or '.', LOCK_FILE)):
+                # Another worker may have built it while this one waited
+                meta = read_meta(path)
+                if not _is_current(meta, data_version):
+                    build_store(source, path, data_version, chunk_rows)
+                    meta = read_meta(path)
+        store = cls(path, meta, chunk_rows)
+        print(f"[pid {os.getpid()}] Opened SQLite store {path} ({store.n_rows:,} rows, "
+              f"RSS {current_rss_mb():,.0f} MB)")
+        return store
+
+    def _connection(self):
+        # sqlite3 connections belong to the thread that opened them
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = _connect(self.path)
+        return conn
+
+    def query(self, sql, params=()):
+        return self._connection().execute(sql, params).fetchall()
+
+    def query_frame(self, sql, params=()):
+        return pd.read_sql_query(sql, self._connection(), params=params)
+
+    def restore_dtypes(self, frame):
+        """Give the columns read back the dtypes the cleaning produced."""
+        for column in frame.columns:
+            dtype = self.dtypes.get(column)
+            if dtype is None or dtype == 'category':
+                continue
+            if dtype.startswith('datetime64'):
+                frame[column] = pd.to_datetime(frame[column], format=DATE_FORMAT)
+            elif dtype.startswith('period'):
+                frame[column] = frame[column].astype(dtype)
+            elif np.dtype(dtype).kind == 'f' or (np.dtype(dtype).kind in 'iub' and frame[column].notna().all()):
+                frame[column] = frame[column].astype(dtype)
+        return frame
+
+    def count(self, start_date=None, end_date=None, selected_regions=None, selected_categories=None):
+        """Number of rows matching the dashboard filters, from the counts kept in memory."""
+        lo, hi = 0, len(self._counts)
+        if start_date and end_date:
+            lo = np.searchsorted(self._count_dates, pd.Timestamp(start_date).to_datetime64(), side='left')
+            hi = np.searchsorted(self._count_dates, pd.Timestamp(end_date).to_datetime64(), side='right')
+        mask = np.zeros(len(self._counts), dtype=bool)
+        mask[lo:hi] = True
+        for column, selected in (('customer_region', selected_regions), ('category', selected_categories)):
+            if selected and len(selected) > 0:
+                mask &= self._count_values[column].isin(selected).to_numpy()
+        return int(self._counts[mask].sum())
+
+    def _table(self, n_rows):
+        """The table to select n_rows from, with the indexes turned off when that is many rows."""
+        return 'sales NOT INDEXED' if n_rows > INDEX_MAX_FRACTION * self.n_rows else 'sales'
+
+    def select(self, start_date=None, end_date=None, selected_regions=None, selected_categories=None):
+        """Aggregates over the rows matching the dashboard filters."""
+        filters = (start_date, end_date, selected_regions, selected_categories)
+        n_rows = self.count(*filters)
+        return SqlSelection(self, self._table(n_rows), *where_clause(*filters), n_rows,
+                            range_start_day(start_date, end_date))
+
+    def distinct_customers(self, start_date=None, end_date=None, selected_regions=None, selected_categories=None):
+        """Number of distinct customer_ids in the matching rows, counted by SQLite (always exact)."""
+        filters = (start_date, end_date, selected_regions, selected_categories)
+        where, params = where_clause(*filters)
+        return self.query(f"SELECT COUNT(DISTINCT customer_id) FROM {self._table(self.count(*filters))}"
+                          f"{_where(where)}", params)[0][0]
+
+    def filter_values(self):
+        regions = [value for (value,) in self.query(
+            'SELECT DISTINCT customer_region FROM sales WHERE customer_region IS NOT NULL ORDER BY 1')]
+        categories = [value for (value,) in self.query(
+            'SELECT DISTINCT category FROM sales WHERE category IS NOT NULL ORDER BY 1')]
+        first, last = self.query('SELECT MIN(order_date), MAX(order_date) FROM sales')[0]
+        return regions, categories, (pd.Timestamp(first), pd.Timestamp(last))
+
+    def _order_by(self, sort_by):
+        # Missing values last in either direction, ties in source order, as pandas sorts
+        terms = []
+        for s in sort_by or []:
+            if s['column_id'] in self.columns:
+                column = _quote(s['column_id'])
+                terms.append(f"{column} IS NULL, {column} {'ASC' if s['direction'] == 'asc' else 'DESC'}")
+        return ', '.join(terms + ['rowid'])
+
+    def iter_matching(self, filters, conditions=()):
+        """Frames of the rows matching the filters and table conditions, in source order."""
+        where, params = where_clause(*filters)
+        sql = (f"SELECT {', '.join(map(_quote, self.columns))} FROM {self._table(self.count(*filters))}"
+               f"{_where(where)} ORDER BY rowid")
+        # Its own connection, since the caller may hold on to the generator
+        with closing(_connect(self.path)) as conn:
+            for chunk in pd.read_sql_query(sql, conn, params=params, chunksize=self.chunk_rows):
+                chunk = self.restore_dtypes(chunk)
+                if conditions:
+                    chunk = chunk.iloc[query_rows(chunk, conditions, np.arange(len(chunk)))]
+                yield chunk
+
+    def table_page(self, filters, conditions, sort_by, page_current, page_size, columns=None):
+        """Same result as table_query.table_page over the matching rows.
+
+        Without table conditions the page is cut out by SQLite (ORDER BY,
+        LIMIT and OFFSET). The table's own conditions follow pandas' rules
+        for mixed types (see table_query), so with them the matching rows are
+        read in chunks and the conditions applied in pandas.
+        """
+        if conditions:
+            return page_from_chunks(self.iter_matching(filters, conditions),
+                                    sort_by, page_current, page_size, columns=columns)
+
+        page_size = page_size or 10
+        total = self.count(*filters)
+        page_count = max(1, math.ceil(total / page_size))
+        page_current = min(page_current or 0, page_count - 1)
+        where, params = where_clause(*filters)
+        selected = columns if columns is not None else self.columns
+        page = self.query_frame(
+            f"SELECT {', '.join(map(_quote, selected))} FROM {self._table(total)}{_where(where)} "
+            f"ORDER BY {self._order_by(sort_by)} LIMIT ? OFFSET ?",
+            params + [page_size, page_current * page_size])
+        return page_records(self.restore_dtypes(page)), page_count, page_current
+
+    def iter_csv(self, start_date=None, end_date=None, selected_regions=None, selected_categories=None):
+        """(CSV text, rows in it) for the matching rows, header first, one piece per chunk read."""
+        header = True
+        for chunk in self.iter_matching((start_date, end_date, selected_regions, selected_categories)):
+            yield from iter_csv_chunks(chunk, np.arange(len(chunk)), header=header)
+            header = False
+        if header:
+            yield pd.DataFrame(columns=self.columns).to_csv(index=False), 0
+
+
+class SqlSelection:
+    """Aggregates over the rows matching one filter, each computed by one query."""
+
+    def __init__(self, store, table, conditions, params, n_rows, start_day=None):
+        self.store = store
+        self.table = table
+        self.conditions = conditions
+        self.params = params
+        self.n_rows = n_rows
+        # First day of the date range, for the labels of the trend chart
+        self.start_day = start_day
+
+    def _select(self, columns, extra=(), group_by=None, order_by=None, limit=None):
+        sql = f"SELECT {columns} FROM {self.table}{_where(self.conditions + list(extra))}"
+        params = list(self.params)
+        if group_by:
+            sql += f" GROUP BY {group_by}"
+        if order_by:
+            sql += f" ORDER BY {order_by}"
+        if limit is not None:
+            sql += ' LIMIT ?'
+            params.append(limit)
+        return sql, params
+
+    @functools.cached_property
+    def _totals(self):
+        """(revenue in cents, distinct orders, mean rating of the rated rows,
+        revenue in cents of the rows with an order_id), in one scan."""
+        return tuple(self.store.query(*self._select(
+            'COALESCE(SUM(revenue_cents), 0), COUNT(DISTINCT order_id), '
+            'AVG(CASE WHEN customer_rating > 0 THEN customer_rating END), '
+            'COALESCE(SUM(CASE WHEN order_id IS NOT NULL THEN revenue_cents END), 0)'))[0])
+
+    @property
+    def empty(self):
+        return self.n_rows == 0
+
+    def row_count(self):
+        return self.n_rows
+
+    def total_revenue(self):
+        return from_cents(self._totals[0])
+
+    def avg_order_value(self):
+        """Revenue of the rows with an order_id per distinct order; 0 when there are none."""
+        orders = self._totals[1]
+        return from_cents(self._totals[3]) / orders if orders else 0.0
+
+    def avg_rating(self):
+        """Mean rating over rated rows (rating > 0), or None if there are none."""
+        mean = self._totals[2]
+        return None if mean is None else float(mean)
+
+    def _revenue_by(self, column, order_by=None, limit=None):
+        frame = self.store.query_frame(*self._select(
+            f"{column} AS bucket, SUM(revenue_cents) AS cents", group_by='bucket',
+            order_by=order_by or 'bucket', limit=limit))
+        return frame['bucket'], from_cents(frame['cents'].astype(np.int64))
+
+    def sales_by_month(self):
+        """Revenue per month as a frame with month_year strings and total_amount."""
+        months, revenue = self._revenue_by('substr(order_date, 1, 7)')
+        return pd.DataFrame({'month_year': months, 'total_amount': revenue})
+
+    def sales_trend(self, granularity='auto', max_points=TREND_MAX_POINTS):
+        """(granularity, frame of period and total_amount) for the trend chart; see trends.py."""
+        daily = self.store.query_frame(*self._select(
+            'substr(order_date, 1, 10) AS day, SUM(revenue_cents) AS cents, COUNT(*) AS n_rows',
+            extra=['order_date IS NOT NULL'], group_by='day', order_by='day'))
+        days = day_numbers(pd.to_datetime(daily['day'], format='%Y-%m-%d').to_numpy())
+        return sales_trend(days, daily['cents'].to_numpy(dtype=np.int64), daily['n_rows'].to_numpy(),
+                           granularity, max_points, self.start_day)
+
+    def category_revenue(self):
+        """Revenue per category as a frame with category and total_amount."""
+        categories, revenue = self._revenue_by('category')
+        return pd.DataFrame({'category': categories, 'total_amount': revenue})
+
+    def rating_counts(self):
+        """Number of rated rows per rating value, sorted by rating."""
+        frame = self.store.query_frame(*self._select(
+            'customer_rating, COUNT(*) AS n_rows', extra=['customer_rating > 0'],
+            group_by='customer_rating', order_by='customer_rating'))
+        return pd.Series(frame['n_rows'].to_numpy(), name='rows',
+                         index=pd.Index(frame['customer_rating'], name='customer_rating'))
+
+    def top_products(self, n=10):
+        """The n products with the highest revenue, as product_name and total_amount."""
+        products, revenue = self._revenue_by('product_name', order_by='cents DESC, bucket', limit=n)
+        return pd.DataFrame({'product_name': products, 'total_amount': revenue})
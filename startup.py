@@ -0,0 +1,117 @@
+import os
+import threading
+import time
+
+import pandas as pd
+
+from dataset_cache import DEFAULT_CACHE_DIR, _read_json, _write_json_atomic
+from ingest import source_files
+
+# Lazy startup.
+#
+# Normally app.py loads the data while it is imported, so a worker can
+# neither bind its port nor answer a health check until the CSV is parsed
+# and cleaned (or the dataset cache, shared data or SQLite file opened).
+# With SWIFTSHOP_LAZY_STARTUP=1 the data is loaded on a background thread
+# instead, and the layout is served at once from a small metadata file that
+# every load leaves in the cache directory: the columns, the filter options
+# and the date range. Until the data is ready the callbacks show a loading
+# state and /readyz answers 503; /healthz answers as soon as the server runs.
+#
+# Metadata written for an older version of the source is still used, since
+# the dashboard updates the filters once the data is loaded; without any
+# (the first start) the filters start empty.
+
+LAZY_STARTUP = os.environ.get('SWIFTSHOP_LAZY_STARTUP', '') not in ('', '0')
+
+METADATA_SUFFIX = '.startup.json'
+
+
+def metadata_path(source_path, cache_dir=DEFAULT_CACHE_DIR):
+    stem = os.path.splitext(os.path.basename(os.path.normpath(source_path)))[0]
+    return os.path.join(cache_dir, stem + METADATA_SUFFIX)
+
+
+def source_stamp(source_path):
+    """(file name, size, mtime) of every source file, which changes whenever the data does."""
+    stamp = []
+    for path in source_files(source_path):
+        stat = os.stat(path)
+        stamp.append([os.path.basename(path), stat.st_size, stat.st_mtime_ns])
+    return stamp
+
+
+def sales_metadata(sales):
+    """Columns, regions, categories and (first, last) order date of loaded data."""
+    regions, categories, date_range = sales.filter_values()
+    return {'columns': list(sales.columns), 'regions': list(regions), 'categories': list(categories),
+            'date_range': tuple(date_range)}
+
+
+def write_metadata(source_path, metadata, stamp, cache_dir=DEFAULT_CACHE_DIR):
+    """Keep metadata (see sales_metadata) for the next lazy start; stamp is the source's when it was read."""
+    if not cache_dir:
+        return
+    first, last = metadata['date_range']
+    record = {**metadata, 'source': stamp,
+              'date_range': [None if pd.isna(first) else first.isoformat(),
+                             None if pd.isna(last) else last.isoformat()]}
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        _write_json_atomic(metadata_path(source_path, cache_dir), record)
+    except OSError as e:
+        print(f"Could not write the startup metadata: {e}")
+
+
+def read_metadata(source_path, cache_dir=DEFAULT_CACHE_DIR):
+    """The metadata the last load of source_path left, or None."""
+    record = _read_json(metadata_path(source_path, cache_dir)) if cache_dir else None
+    if record is None:
+        print(f"No startup metadata for {source_path} yet; the filters fill in once the data is loaded")
+        return None
+    try:
+        current = source_stamp(source_path)
+    except OSError:
+        current = None
+    if record.pop('source', None) != current:
+        print(f"Startup metadata for {source_path} is out of date; the filters update once the data is loaded")
+    record['date_range'] = tuple(pd.Timestamp(value) if value else None for value in record['date_range'])
+    return record
+
+
+class BackgroundLoader:
+    """Runs load() on a daemon thread and passes its result to on_ready(result).
+
+    status is 'loading', then 'ready', or 'failed' with the exception's
+    message in error.
+    """
+
+    def __init__(self, load, on_ready):
+        self.load = load
+        self.on_ready = on_ready
+        self.status = 'loading'
+        self.error = None
+        self.started = time.time()
+        self.seconds = None
+
+    def start(self):
+        threading.Thread(target=self._run, name='swiftshop-loader', daemon=True).start()
+        return self
+
+    def _run(self):
+        try:
+            self.on_ready(self.load())
+            self.status = 'ready'
+        except Exception as e:
+            print(f"Error loading data: {e!r}")
+            self.error = str(e) or type(e).__name__
+            self.status = 'failed'
+        self.seconds = time.time() - self.started
+        print(f"Data {self.status} after {self.seconds:.2f}s in the background")
+
+    def report(self):
+        """Status for /readyz."""
+        report = {'status': self.status, 'seconds': round(self.seconds or time.time() - self.started, 3)}
+        if self.error:
+            report['error'] = self.error
+        return report
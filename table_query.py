@@ -0,0 +1,270 @@
+import math
+import operator
+import re
+
+import numpy as np
+import pandas as pd
+
+# Server-side filtering, sorting and paging for the Data Preview table.
+#
+# The DataTable runs with page_action/sort_action/filter_action='custom',
+# so the browser only ever receives the page it shows. The functions here
+# turn the table's filter_query and sort_by into operations on the
+# in-memory frame and cut out the requested page.
+
+OPERATORS = {
+    '=': 'eq', 'eq': 'eq',
+    '!=': 'ne', 'ne': 'ne',
+    '<': 'lt', 'lt': 'lt',
+    '<=': 'le', 'le': 'le',
+    '>': 'gt', 'gt': 'gt',
+    '>=': 'ge', 'ge': 'ge',
+    'contains': 'contains',
+    'datestartswith': 'datestartswith',
+}
+
+# The operators, longest first so that '<=' is not read as '<' and '=', each
+# optionally prefixed with i/s (case-insensitive/sensitive). Word operators
+# must end before the value; symbols need no space after them, as in
+# '{quantity} >5'.
+_SYMBOLS = '|'.join(re.escape(op) for op in sorted(
+    (op for op in OPERATORS if not op.isalpha()), key=len, reverse=True))
+_WORDS = '|'.join(sorted((op for op in OPERATORS if op.isalpha()), key=len, reverse=True))
+_CONDITION = re.compile(
+    r'^\{(?P<column>[^}]+)\}\s*'
+    rf'(?P<op>[is]?(?:{_SYMBOLS})|(?:[is]?(?:{_WORDS})|is)(?=[\s"\'`]|$))'
+    r'\s*(?P<value>.*)$', re.S)
+
+
+class FilterQueryError(ValueError):
+    """Raised for a filter_query the parser does not understand."""
+
+
+def _split_conditions(query):
+    """Split on '&&' / 'and' outside of quoted values."""
+    parts, current, quote = [], [], None
+    i = 0
+    while i < len(query):
+        char = query[i]
+        if quote:
+            current.append(char)
+            if char == '\\' and i + 1 < len(query):
+                current.append(query[i + 1])
+                i += 1
+            elif char == quote:
+                quote = None
+        elif char in '"\'`':
+            quote = char
+            current.append(char)
+        elif query.startswith('&&', i):
+            parts.append(''.join(current))
+            current = []
+            i += 1
+        elif query.startswith(' and ', i) or query.startswith(' AND ', i):
+            parts.append(''.join(current))
+            current = []
+            i += 4
+        else:
+            current.append(char)
+        i += 1
+    if quote:
+        raise FilterQueryError(f"Unterminated quote in filter query: {query!r}")
+    parts.append(''.join(current))
+    return [part.strip() for part in parts if part.strip()]
+
+
+def _parse_value(text):
+    text = text.strip()
+    if len(text) >= 2 and text[0] in '"\'`' and text[-1] == text[0]:
+        return re.sub(r'\\(.)', r'\1', text[1:-1])
+    if text.startswith('num(') and text.endswith(')'):
+        text = text[4:-1]
+    try:
+        return float(text)
+    except ValueError:
+        return text
+
+
+def parse_filter_query(query):
+    """Parse a DataTable filter_query into (column, operator, value, case_sensitive) tuples.
+
+    Supports the relational operators (=, !=, <, <=, >, >= and their eq/ne/...
+    spellings), contains and datestartswith, each optionally prefixed with
+    'i' (case-insensitive) or 's' (case-sensitive), plus 'is blank' and
+    'is not blank'. Conditions are joined with '&&'.
+    """
+    conditions = []
+    for part in _split_conditions(query or ''):
+        match = _CONDITION.match(part)
+        if not match:
+            raise FilterQueryError(f"Cannot parse filter condition: {part!r}")
+        column, op, value = match.group('column'), match.group('op'), match.group('value')
+
+        if op == 'is':
+            value = value.strip()
+            if value in ('blank', 'nil'):
+                conditions.append((column, 'blank', None, True))
+            elif value in ('not blank', 'not nil'):
+                conditions.append((column, 'not_blank', None, True))
+            else:
+                raise FilterQueryError(f"Unsupported filter condition: {part!r}")
+            continue
+
+        case_sensitive = True
+        if op not in OPERATORS and op[:1] in ('i', 's') and op[1:] in OPERATORS:
+            case_sensitive = op[0] == 's'
+            op = op[1:]
+        if op not in OPERATORS:
+            raise FilterQueryError(f"Unsupported filter operator {op!r} in {part!r}")
+        if not value.strip():
+            raise FilterQueryError(f"Missing value in filter condition: {part!r}")
+
+        conditions.append((column, OPERATORS[op], _parse_value(value), case_sensitive))
+    return conditions
+
+
+def _date_prefix_range(prefix):
+    """[start, end) timestamps covered by a 'YYYY', 'YYYY-MM' or 'YYYY-MM-DD' prefix."""
+    pieces = str(prefix).strip().split('-')
+    try:
+        if len(pieces) == 1:
+            start = pd.Timestamp(year=int(pieces[0]), month=1, day=1)
+            return start, start + pd.DateOffset(years=1)
+        if len(pieces) == 2:
+            start = pd.Timestamp(year=int(pieces[0]), month=int(pieces[1]), day=1)
+            return start, start + pd.DateOffset(months=1)
+        start = pd.Timestamp(str(prefix).strip()).normalize()
+        return start, start + pd.Timedelta(days=1)
+    except ValueError as e:
+        raise FilterQueryError(f"Invalid date prefix: {prefix!r}") from e
+
+
+RELATIONAL = {
+    'eq': operator.eq, 'ne': operator.ne,
+    'lt': operator.lt, 'le': operator.le,
+    'gt': operator.gt, 'ge': operator.ge,
+}
+
+
+def _compare(values, op, value, case_sensitive):
+    """Evaluate one condition on a Series of plain (non-categorical) values."""
+    if pd.api.types.is_datetime64_any_dtype(values):
+        if op == 'datestartswith':
+            start, end = _date_prefix_range(value)
+            return ((values >= start) & (values < end)).to_numpy()
+        if op in RELATIONAL:
+            try:
+                return RELATIONAL[op](values, pd.Timestamp(value)).to_numpy()
+            except ValueError as e:
+                raise FilterQueryError(f"Invalid date: {value!r}") from e
+        text = values.dt.strftime('%Y-%m-%d %H:%M:%S')
+    elif pd.api.types.is_numeric_dtype(values) and op in RELATIONAL:
+        try:
+            return RELATIONAL[op](values, float(value)).to_numpy()
+        except ValueError:
+            return np.zeros(len(values), dtype=bool)
+    else:
+        text = values.astype(str)
+
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    value = str(value)
+    if not case_sensitive:
+        text, value = text.str.lower(), value.lower()
+    if op == 'contains':
+        return text.str.contains(value, regex=False).to_numpy()
+    if op == 'datestartswith':
+        return text.str.startswith(value).to_numpy()
+    return RELATIONAL[op](text, value).to_numpy()
+
+
+def condition_mask(series, op, value, case_sensitive=True):
+    """Boolean mask of the rows of series matching one parsed condition."""
+    if op == 'blank':
+        return series.isna().to_numpy() | (series.astype(str).str.strip() == '').to_numpy()
+    if op == 'not_blank':
+        return ~condition_mask(series, 'blank', None)
+
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        # Evaluate on the few categories, then look the answer up per row
+        per_category = _compare(series.cat.categories.to_series(), op, value, case_sensitive)
+        codes = series.cat.codes.to_numpy()
+        return np.append(per_category, False)[codes]
+    return _compare(series, op, value, case_sensitive)
+
+
+def query_rows(df, conditions, rows):
+    """The subset of rows (positions into df) matching all parsed conditions."""
+    for column, op, value, case_sensitive in conditions:
+        if column not in df.columns:
+            raise FilterQueryError(f"Unknown column in filter query: {column!r}")
+        rows = rows[condition_mask(df[column].iloc[rows], op, value, case_sensitive)]
+    return rows
+
+
+def page_records(page):
+    """Records of a table page, with dates already in the ISO text the browser receives.
+
+    to_dict leaves Timestamps, which the JSON encoder would convert one
+    value at a time; everything else comes out as plain Python values.
+    """
+    dates = {column: values.dt.strftime('%Y-%m-%dT%H:%M:%S').astype(object).where(values.notna(), None)
+             for column, values in page.items() if values.dtype.kind == 'M'}
+    return page.assign(**dates).to_dict('records') if dates else page.to_dict('records')
+
+
+def table_page(df, rows, sort_by, page_current, page_size, columns=None):
+    """Records for one page of the given rows, plus the page count and page index."""
+    page_size = page_size or 10
+    page_count = max(1, math.ceil(len(rows) / page_size))
+    page_current = min(page_current or 0, page_count - 1)
+    start = page_current * page_size
+
+    if sort_by:
+        sort_columns = [s['column_id'] for s in sort_by]
+        ascending = [s['direction'] == 'asc' for s in sort_by]
+        keys = df[sort_columns].iloc[rows]
+        order = keys.reset_index(drop=True).sort_values(sort_columns, ascending=ascending, kind='stable').index
+        rows = rows[order.to_numpy()]
+
+    page = df.iloc[rows[start:start + page_size]]
+    if columns is not None:
+        page = page[columns]
+    return page_records(page), page_count, page_current
+
+
+def page_from_chunks(chunks, sort_by, page_current, page_size, columns=None, total=None):
+    """Same result as table_page over the rows of a stream of frames, in one pass.
+
+    Only the rows up to the end of the requested page are kept: the first
+    ones in stream order, or the smallest ones when sorted. When the total
+    number of rows is known up front, an unsorted scan stops as soon as the
+    page is complete.
+    """
+    page_size = page_size or 10
+    keep = ((page_current or 0) + 1) * page_size
+
+    kept, seen = None, 0
+    for chunk in chunks:
+        if chunk.empty:
+            continue
+        seen += len(chunk)
+        kept = chunk if kept is None else pd.concat([kept, chunk], ignore_index=True)
+        if sort_by:
+            kept = kept.sort_values([s['column_id'] for s in sort_by],
+                                    ascending=[s['direction'] == 'asc' for s in sort_by],
+                                    kind='stable')
+        kept = kept.head(keep)
+        if total is not None and not sort_by and len(kept) >= keep:
+            break
+
+    total = seen if total is None else total
+    page_count = max(1, math.ceil(total / page_size))
+    page_current = min(page_current or 0, page_count - 1)
+    if kept is None:
+        return [], page_count, page_current
+    start = page_current * page_size
+    page = kept.iloc[start:start + page_size]
+    if columns is not None:
+        page = page[columns]
+    return page_records(page), page_count, page_current
@@ -0,0 +1,243 @@
+import contextlib
+import functools
+import os
+import threading
+import time
+from collections import defaultdict, deque
+
+import numpy as np
+from flask import g, has_request_context
+
+# Per-unit timings of the dashboard callbacks.
+#
+# Every callback wrapped with timed() records how long it took, so the
+# slowest chart can be told apart from the rest. The last durations of each
+# unit are kept for percentiles, and the units that ran during a request
+# are listed in its Server-Timing header, which the browser's network
+# panel shows next to every callback request.
+#
+# Within a unit, stage() times its steps (filtering, aggregation, figure
+# building; Dash's JSON serialization is the rest of the request) and
+# record_rows() adds up the rows it read and returned. Stages timed outside
+# any unit, such as loading the data, belong to the 'startup' unit. All of
+# it is served in the Prometheus text format by /metrics.
+
+TIMING_WINDOW = int(os.environ.get('SWIFTSHOP_TIMING_WINDOW', 1000))
+LOG_TIMINGS = os.environ.get('SWIFTSHOP_LOG_TIMINGS', '') not in ('', '0')
+
+
+class UnitTimings:
+    """The last `window` durations (in seconds) of each named unit."""
+
+    def __init__(self, window=TIMING_WINDOW):
+        self.window = window
+        self._durations = defaultdict(lambda: deque(maxlen=self.window))
+        self._counts = defaultdict(int)
+        self._sums = defaultdict(float)
+        self._lock = threading.Lock()
+
+    def record(self, name, seconds):
+        with self._lock:
+            self._durations[name].append(seconds)
+            self._counts[name] += 1
+            self._sums[name] += seconds
+
+    def summaries(self):
+        """(name, p50, p99, sum, count) per name; the percentiles cover the window, sum and count all time."""
+        with self._lock:
+            durations = {name: np.array(values) for name, values in self._durations.items()}
+            sums, counts = dict(self._sums), dict(self._counts)
+        return [(name, float(np.percentile(values, 50)), float(np.percentile(values, 99)), sums[name], counts[name])
+                for name, values in durations.items()]
+
+    def report(self):
+        """Count and p50/p99/max in ms per unit, slowest p50 first."""
+        with self._lock:
+            durations = {name: np.array(values) * 1000 for name, values in self._durations.items()}
+            counts = dict(self._counts)
+        report = {}
+        for name, values in sorted(durations.items(), key=lambda item: -np.median(item[1])):
+            report[name] = {
+                'count': counts[name],
+                'p50_ms': round(float(np.percentile(values, 50)), 3),
+                'p99_ms': round(float(np.percentile(values, 99)), 3),
+                'max_ms': round(float(values.max()), 3),
+            }
+        return report
+
+    def reset(self):
+        with self._lock:
+            self._durations.clear()
+            self._counts.clear()
+            self._sums.clear()
+
+
+class RowCounts:
+    """Running totals of rows scanned and returned per unit."""
+
+    def __init__(self):
+        self._totals = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def add(self, unit, scanned=0, returned=0):
+        with self._lock:
+            self._totals[unit, 'scanned'] += scanned
+            self._totals[unit, 'returned'] += returned
+
+    def totals(self):
+        with self._lock:
+            return dict(self._totals)
+
+    def reset(self):
+        with self._lock:
+            self._totals.clear()
+
+
+timings = UnitTimings()
+# Durations of the stages, keyed by (unit, stage)
+stage_timings = UnitTimings()
+# Sizes in bytes of the responses, keyed by unit
+response_sizes = UnitTimings()
+row_counts = RowCounts()
+
+_active = threading.local()
+
+
+def current_unit():
+    """Name of the unit running in this thread, 'startup' outside any."""
+    return getattr(_active, 'unit', 'startup')
+
+
+@contextlib.contextmanager
+def stage(name):
+    """Time the block as a stage of the current unit."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        stage_timings.record((current_unit(), name), elapsed)
+        if LOG_TIMINGS:
+            print(f"[timing] {current_unit()}.{name}: {elapsed * 1000:.1f} ms")
+
+
+def record_rows(scanned=0, returned=0):
+    """Add rows the current unit scanned (matched by its filters) and returned (rows or chart points)."""
+    row_counts.add(current_unit(), scanned, returned)
+
+
+def timed(name, registry=timings):
+    """Decorator recording the duration of every call under name."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            outer = getattr(_active, 'unit', None)
+            _active.unit = name
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - start
+                if outer is None:
+                    del _active.unit
+                else:
+                    _active.unit = outer
+                registry.record(name, elapsed)
+                if has_request_context():
+                    g.setdefault('unit_timings', []).append((name, elapsed))
+                if LOG_TIMINGS:
+                    print(f"[timing] {name}: {elapsed * 1000:.1f} ms")
+        return wrapper
+    return decorator
+
+
+def timed_stream(name, chunks, n_rows=0):
+    """Yield chunks, recording the time spent producing them as stage 'stream' of unit name.
+
+    For streamed responses, which are built after the request handler returned.
+    Once the stream is done, n_rows count as returned and the bytes as its size.
+    """
+    elapsed, n_bytes = 0.0, 0
+    iterator = iter(chunks)
+    while True:
+        start = time.perf_counter()
+        chunk = next(iterator, None)
+        elapsed += time.perf_counter() - start
+        if chunk is None:
+            break
+        n_bytes += len(chunk)
+        yield chunk
+    stage_timings.record((name, 'stream'), elapsed)
+    response_sizes.record(name, n_bytes)
+    row_counts.add(name, returned=n_rows)
+
+
+def start_request_timer():
+    """Flask before_request hook noting when the request started."""
+    g.request_start = time.perf_counter()
+
+
+def add_server_timing(response):
+    """Flask after_request hook listing the timed units of the request in Server-Timing.
+
+    For a request that ran one unit (a Dash callback), the time outside the
+    unit is recorded as its 'serialize' stage and the body size as its
+    response size.
+    """
+    entries = g.pop('unit_timings', None)
+    if entries:
+        response.headers.add('Server-Timing', ', '.join(
+            f"{name};dur={seconds * 1000:.1f}" for name, seconds in entries))
+        start = g.pop('request_start', None)
+        if len(entries) == 1 and start is not None and not response.is_streamed:
+            name, seconds = entries[0]
+            stage_timings.record((name, 'serialize'), max(0.0, time.perf_counter() - start - seconds))
+            response_sizes.record(name, response.calculate_content_length() or 0)
+    return response
+
+
+def _labels(**labels):
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+               for value in labels.values())
+    return ','.join(f'{key}="{value}"' for key, value in zip(labels, escaped))
+
+
+def _summary(lines, metric, help_text, summaries, label_names):
+    lines += [f"# HELP {metric} {help_text}", f"# TYPE {metric} summary"]
+    for key, p50, p99, total, count in sorted(summaries, key=lambda item: item[0]):
+        labels = _labels(**dict(zip(label_names, key if isinstance(key, tuple) else (key,))))
+        lines += [f'{metric}{{{labels},quantile="0.5"}} {p50:.6g}',
+                  f'{metric}{{{labels},quantile="0.99"}} {p99:.6g}',
+                  f'{metric}_sum{{{labels}}} {total:.6g}',
+                  f'{metric}_count{{{labels}}} {count}']
+
+
+def prometheus_text(caches=None):
+    """All timings, row counts and response sizes in the Prometheus text format.
+
+    caches maps a name to the stats() of a result cache, whose hits, misses
+    and entries are added.
+    """
+    lines = []
+    _summary(lines, 'swiftshop_unit_duration_seconds', "Duration of each callback or other timed unit.",
+             timings.summaries(), ['unit'])
+    _summary(lines, 'swiftshop_stage_duration_seconds', "Duration of each stage of a unit.",
+             stage_timings.summaries(), ['unit', 'stage'])
+    _summary(lines, 'swiftshop_response_bytes', "Size of the response of each unit.",
+             response_sizes.summaries(), ['unit'])
+    totals = row_counts.totals()
+    for kind, help_text in (('scanned', "Rows matched by the filters that a unit read or aggregated."),
+                            ('returned', "Rows or chart points a unit returned.")):
+        metric = f'swiftshop_rows_{kind}_total'
+        lines += [f"# HELP {metric} {help_text}", f"# TYPE {metric} counter"]
+        lines += [f'{metric}{{{_labels(unit=unit)}}} {value}'
+                  for (unit, counted), value in sorted(totals.items()) if counted == kind]
+    caches = sorted((caches or {}).items())
+    for metric, field, kind, help_text in (
+            ('swiftshop_cache_hits_total', 'hits', 'counter', "Lookups a result cache answered."),
+            ('swiftshop_cache_misses_total', 'misses', 'counter', "Lookups a result cache could not answer."),
+            ('swiftshop_cache_entries', 'size', 'gauge', "Entries held by a result cache."),
+            ('swiftshop_cache_max_entries', 'maxsize', 'gauge', "Entries a result cache holds at most.")):
+        lines += [f"# HELP {metric} {help_text}", f"# TYPE {metric} {kind}"]
+        lines += [f'{metric}{{{_labels(cache=name)}}} {stats[field]}' for name, stats in caches]
+    return '\n'.join(lines) + '\n'
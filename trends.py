@@ -0,0 +1,149 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+# Revenue over time for the Sales Over Time chart.
+#
+# Dates are integer day numbers (days since 1970-01-01), and a day, week,
+# month or quarter bucket is an integer key derived from them with integer
+# arithmetic, so bucketing never builds or sorts strings. Labels are only
+# made for the buckets that end up in the chart.
+#
+# With granularity 'auto' the bucket size follows the selected date span,
+# and a series longer than SWIFTSHOP_TREND_MAX_POINTS (a daily view of
+# several years, say) is downsampled with Largest-Triangle-Three-Buckets,
+# which keeps the peaks and dips a plain stride would drop. The chart never
+# gets more points than that, however long the history.
+
+GRANULARITIES = ['day', 'week', 'month', 'quarter']
+
+# Granularity of the trend chart when the page loads: auto or one of GRANULARITIES
+TREND_GRANULARITY = os.environ.get('SWIFTSHOP_TREND_GRANULARITY', 'auto')
+
+# Most points the trend chart shows
+TREND_MAX_POINTS = int(os.environ.get('SWIFTSHOP_TREND_MAX_POINTS') or 200)
+
+# Finest granularity for a span of up to this many days, used by 'auto'
+AUTO_GRANULARITY = [(92, 'day'), (366, 'week'), (5 * 366, 'month')]
+
+PERIOD_LABELS = {'day': 'Day', 'week': 'Week', 'month': 'Month', 'quarter': 'Quarter'}
+
+
+def day_numbers(dates):
+    """Days since 1970-01-01 of datetime64 values (NaT must be removed first)."""
+    return np.asarray(dates, dtype='datetime64[D]').astype(np.int64)
+
+
+def day_number(timestamp):
+    return int(np.datetime64(pd.Timestamp(timestamp).normalize(), 'D').astype(np.int64))
+
+
+def range_start_day(start_date=None, end_date=None):
+    """Day number of the start of the dashboard's date range, or None without one."""
+    return day_number(start_date) if start_date and end_date else None
+
+
+def bucket_keys(days, granularity):
+    """Integer key of the bucket every day number falls in; keys increase with time."""
+    if granularity == 'day':
+        return days
+    if granularity == 'week':
+        # Weeks start on Monday; day 0 was a Thursday
+        return (days + 3) // 7
+    months = days.astype('datetime64[D]').astype('datetime64[M]').astype(np.int64)
+    return months if granularity == 'month' else months // 3
+
+
+def bucket_start_days(keys, granularity):
+    """Day number of the first day of every bucket."""
+    if granularity == 'day':
+        return keys
+    if granularity == 'week':
+        return keys * 7 - 3
+    months = keys if granularity == 'month' else keys * 3
+    return months.astype('datetime64[M]').astype('datetime64[D]').astype(np.int64)
+
+
+def bucket_labels(keys, granularity, start_day=None):
+    """x values of the chart: the first day for days and weeks, 2024-05 and 2024-Q2 otherwise.
+
+    start_day, the first day of the date range, labels the week it falls in
+    (the only bucket that can start before it), so no label precedes the range.
+    """
+    if granularity in ('day', 'week'):
+        days = bucket_start_days(keys, granularity)
+        if start_day is not None:
+            days = np.maximum(days, start_day)
+        return np.datetime_as_string(days.astype('datetime64[D]'), unit='D')
+    if granularity == 'month':
+        return np.datetime_as_string(keys.astype('datetime64[M]'), unit='M')
+    years = keys // 4 + 1970
+    return np.array([f"{year}-Q{quarter}" for year, quarter in zip(years, keys % 4 + 1)], dtype=object)
+
+
+def choose_granularity(n_days, granularity='auto'):
+    """granularity, or for 'auto' the finest one suited to a span of n_days."""
+    if granularity in GRANULARITIES:
+        return granularity
+    for max_days, finest in AUTO_GRANULARITY:
+        if n_days <= max_days:
+            return finest
+    return 'quarter'
+
+
+def lttb(x, y, n_out):
+    """Positions of the n_out points Largest-Triangle-Three-Buckets keeps of (x, y).
+
+    The first and last points are always kept. Every bucket in between
+    contributes the point forming the largest triangle with the point kept
+    before it and the mean of the next bucket.
+    """
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+    x = np.asarray(x, dtype='float64')
+    y = np.asarray(y, dtype='float64')
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.int64)
+    kept = np.empty(n_out, dtype=np.int64)
+    kept[0], kept[-1] = 0, n - 1
+    previous = 0
+    for i in range(n_out - 2):
+        lo, hi = edges[i], edges[i + 1]
+        next_lo, next_hi = hi, edges[i + 2] if i + 2 < len(edges) else n
+        mean_x, mean_y = x[next_lo:next_hi].mean(), y[next_lo:next_hi].mean()
+        area = np.abs((x[previous] - mean_x) * (y[lo:hi] - y[previous])
+                      - (x[previous] - x[lo:hi]) * (mean_y - y[previous]))
+        previous = kept[i + 1] = lo + int(np.argmax(area))
+    return kept
+
+
+def trend_frame(keys, cents, rows, granularity, max_points=TREND_MAX_POINTS, start_day=None):
+    """Chart data from revenue per bucket: (period, total_amount), buckets without rows left out."""
+    has_rows = rows > 0
+    keys, cents = keys[has_rows], cents[has_rows]
+    if max_points and len(keys) > max_points:
+        kept = lttb(bucket_start_days(keys, granularity), cents, max_points)
+        keys, cents = keys[kept], cents[kept]
+    return pd.DataFrame({'period': bucket_labels(keys, granularity, start_day), 'total_amount': cents / 100})
+
+
+def bucket_sums(days, granularity, *values):
+    """Keys of the buckets of sorted day numbers and every value summed per bucket."""
+    keys = bucket_keys(days, granularity)
+    starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]]) if len(keys) else np.array([], dtype=np.int64)
+    return (keys[starts],) + tuple(np.add.reduceat(v, starts) if len(starts) else v[:0] for v in values)
+
+
+def sales_trend(days, cents, rows, granularity='auto', max_points=TREND_MAX_POINTS, start_day=None):
+    """(granularity, chart data) from revenue cents and rows per sorted day number.
+
+    With 'auto' the granularity follows the span from the first to the last
+    day with rows. start_day is the first day of the date range (see
+    range_start_day), if there is one.
+    """
+    present = np.flatnonzero(rows > 0)
+    n_days = int(days[present[-1]] - days[present[0]]) + 1 if len(present) else 0
+    granularity = choose_granularity(n_days, granularity)
+    keys, cents, rows = bucket_sums(days, granularity, cents, rows)
+    return granularity, trend_frame(keys, cents, rows, granularity, max_points, start_day)